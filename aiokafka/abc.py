@@ -60,6 +60,10 @@ class ConsumerRebalanceListener(BaseConsumerRebalanceListener):
         .. note:: This method is only called before rebalances. It is not
             called prior to ``AIOKafkaConsumer.close()``
 
+        .. note:: With ``CooperativeStickyPartitionAssignor`` this method is
+            called after the rebalance and only with partitions, that were
+            moved to other consumers.
+
         Arguments:
             revoked (list of TopicPartition): the partitions that were assigned
                 to the consumer on the last rebalance
@@ -80,6 +84,9 @@ class ConsumerRebalanceListener(BaseConsumerRebalanceListener):
         execute their on_partitions_revoked() callback before any instance
         executes its on_partitions_assigned() callback.
 
+        .. note:: With ``CooperativeStickyPartitionAssignor`` only partitions
+            added to the assignment are passed.
+
         Arguments:
             assigned (list of TopicPartition): the partitions assigned to the
                 consumer (may include partitions that were previously assigned)
@@ -1,15 +1,18 @@
 import asyncio
+import collections
+import itertools
 import logging
 import random
 
 from kafka.conn import collect_hosts
-from kafka.cluster import ClusterMetadata
+from kafka.protocol.admin import ApiVersionRequest
 from kafka.protocol.metadata import MetadataRequest
 from kafka.protocol.produce import ProduceRequest
 from kafka.protocol.commit import OffsetFetchRequest
 
 import aiokafka.errors as Errors
 from aiokafka import __version__
+from aiokafka.cluster import ClusterMetadata
 from aiokafka.conn import create_conn, CloseReason
 from aiokafka.errors import (
     KafkaError,
@@ -18,24 +21,116 @@ from aiokafka.errors import (
     RequestTimedOutError,
     UnknownTopicOrPartitionError,
     UnrecognizedBrokerVersion)
+from aiokafka.metrics import Metrics
+from aiokafka.structs import TopicPartition
 from aiokafka.util import ensure_future, create_future
 
 
-__all__ = ['AIOKafkaClient']
+__all__ = ['AIOKafkaClient', 'SharedClient']
 
 
 log = logging.getLogger('aiokafka')
 
+_SOCKET_OPTIONS = {"tcp_nodelay", "send_buffer_bytes", "receive_buffer_bytes"}
+
+# Distinguishes metrics of clients sharing a registry and a client_id
+_instance_ids = itertools.count()
+
+# Max request versions of Kafka releases by API key. Used if brokers can't
+# tell supported versions with ApiVersions request or `api_version` is set.
+_RELEASE_API_VERSIONS = [
+    ((0, 11, 0), {0: 3, 1: 5, 2: 2, 3: 4, 8: 3, 9: 3, 10: 1, 11: 2, 12: 1,
+                  13: 1, 14: 1, 18: 1}),
+    ((0, 10, 2), {0: 2, 1: 3, 2: 1, 3: 2, 8: 2, 9: 2, 10: 0, 11: 1, 12: 0,
+                  13: 0, 14: 0, 18: 0}),
+    ((0, 10, 1), {0: 2, 1: 3, 2: 1, 3: 2, 8: 2, 9: 1, 10: 0, 11: 1, 12: 0,
+                  13: 0, 14: 0, 18: 0}),
+    ((0, 10, 0), {0: 2, 1: 2, 2: 0, 3: 1, 8: 2, 9: 1, 10: 0, 11: 0, 12: 0,
+                  13: 0, 14: 0, 18: 0}),
+    ((0, 9, 0), {0: 1, 1: 1, 2: 0, 3: 0, 8: 2, 9: 1, 10: 0, 11: 0, 12: 0,
+                 13: 0, 14: 0}),
+]
+
+
+def _release_api_range(api_version, api_key):
+    api_version = tuple(api_version) + (0,) * (3 - len(api_version))
+    for release, max_versions in _RELEASE_API_VERSIONS:
+        if api_version >= release:
+            if api_key not in max_versions:
+                return None
+            return (0, max_versions[api_key])
+    return None
+
+
+# Delay before trying the next bootstrap server if the previous one did not
+# respond yet, like Happy Eyeballs (RFC 8305) connection attempt delay
+_BOOTSTRAP_ATTEMPT_DELAY = 0.25
+
+# Unchanged metadata is not written to the metadata cache more often than
+# this, as repeated refreshes are common while the cluster is unstable
+_METADATA_CACHE_SAVE_INTERVAL = 60
+
 
 class ConnectionGroup:
+    """ Traffic classes, that use separate connections to a broker, so big
+    responses of one class don't delay requests of another.
+    """
 
     DEFAULT = 0
     COORDINATION = 1
+    FETCH = 2
+    PRODUCE = 3
+
+    ALL = (DEFAULT, COORDINATION, FETCH, PRODUCE)
+
+
+class SharedClient:
+    """ Handle of an ``AIOKafkaClient`` used by one producer or consumer.
+    Topics set by it are merged with topics of other users of the client,
+    ``bootstrap()`` and ``close()`` are reference counted. All other
+    attributes are those of the client.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def __repr__(self):
+        return '<SharedClient {!r}>'.format(self._client)
+
+    def add_topic(self, topic):
+        return self._client._add_user_topic(self, topic)
+
+    def set_topics(self, topics):
+        assert not isinstance(topics, str)
+        return self._client._set_user_topics(self, topics)
+
+    @asyncio.coroutine
+    def _wait_on_metadata(self, topic):
+        self.add_topic(topic)
+        return (yield from self._client._wait_on_metadata(topic))
+
+    @asyncio.coroutine
+    def bootstrap(self):
+        yield from self._client._acquire()
+
+    @asyncio.coroutine
+    def close(self):
+        yield from self._client._release(self)
 
 
 class AIOKafkaClient:
     """Initialize an asynchronous kafka client
 
+    One client can be shared by several producers and consumers on the same
+    loop by passing it as ``client`` argument. They share broker connections
+    and cluster metadata. Metadata is tracked for the union of topics used by
+    all of them. Unless already bootstrapped by the application, the client
+    is bootstrapped by the first one started and closed when the last one is
+    stopped.
+
     Keyword Arguments:
         bootstrap_servers: 'host[:port]' string (or list of 'host[:port]'
             strings) that the consumer should contact to bootstrap initial
@@ -68,6 +163,28 @@ class AIOKafkaClient:
         connections_max_idle_ms (int): Close idle connections after the number
             of milliseconds specified by this config. Specifying `None` will
             disable idle checks. Default: 540000 (9hours).
+        metrics (Metrics): registry to record client metrics in. Metrics are
+            not collected by default. Instruments are tagged with
+            ``client_id`` and a process-wide ``instance`` number of the
+            client. Default: None
+        request_tracer (AbstractRequestTracer): hook called on each request
+            sent and response received by broker connections, see
+            :mod:`aiokafka.tracing`. Default: None
+        watchdog (LoopWatchdog): stall detector to time synchronous sections
+            of the client in, see :mod:`aiokafka.watchdog`. Default: None
+        connections_per_broker (dict): {ConnectionGroup: count} number of
+            connections to open to each broker for a traffic class. Requests
+            of the class are sent over them round-robin. Connections are
+            opened on demand. Default: 1 for all groups
+        socket_options (dict): {ConnectionGroup: dict} socket options for
+            connections of a traffic class. Supported keys are
+            ``tcp_nodelay`` (bool), ``send_buffer_bytes`` and
+            ``receive_buffer_bytes`` (int), system defaults are used for
+            missing keys. Default: None
+        metadata_cache (MetadataCache): on-disk cache of broker version and
+            cluster metadata to start from without waiting for the broker,
+            see :class:`aiokafka.metadata_cache.MetadataCache`.
+            Default: None
     """
 
     def __init__(self, *, loop, bootstrap_servers='localhost',
@@ -78,12 +195,33 @@ class AIOKafkaClient:
                  ssl_context=None,
                  security_protocol='PLAINTEXT',
                  api_version='auto',
-                 connections_max_idle_ms=540000):
+                 connections_max_idle_ms=540000,
+                 metrics=None,
+                 request_tracer=None,
+                 watchdog=None,
+                 connections_per_broker=None,
+                 socket_options=None,
+                 metadata_cache=None):
         if security_protocol not in ('SSL', 'PLAINTEXT'):
             raise ValueError("`security_protocol` should be SSL or PLAINTEXT")
         if security_protocol == "SSL" and ssl_context is None:
             raise ValueError(
                 "`ssl_context` is mandatory if security_protocol=='SSL'")
+        connections_per_broker = dict(connections_per_broker or {})
+        socket_options = dict(socket_options or {})
+        for group in set(connections_per_broker) | set(socket_options):
+            if group not in ConnectionGroup.ALL:
+                raise ValueError(
+                    "Unknown connection group {!r}".format(group))
+        for group, count in connections_per_broker.items():
+            if count < 1:
+                raise ValueError(
+                    "`connections_per_broker` should be at least 1")
+        for options in socket_options.values():
+            unknown = set(options) - _SOCKET_OPTIONS
+            if unknown:
+                raise ValueError(
+                    "Unknown socket options {}".format(sorted(unknown)))
 
         self._bootstrap_servers = bootstrap_servers
         self._client_id = client_id
@@ -94,16 +232,48 @@ class AIOKafkaClient:
         self._ssl_context = ssl_context
         self._retry_backoff = retry_backoff_ms / 1000
         self._connections_max_idle_ms = connections_max_idle_ms
+        if metrics is None:
+            metrics = Metrics(enabled=False)
+        self.metrics = metrics.with_tags(
+            client_id=client_id, instance=next(_instance_ids))
+        self._request_tracer = request_tracer
+        self.watchdog = watchdog
+        self._watchdog_started = False
+        self._connections_per_broker = connections_per_broker
+        self._socket_options = socket_options
+        self._metadata_cache = metadata_cache
+        # node_id => {api_key: (min_version, max_version)}
+        self._api_versions = {}
+        self._negotiate_versions = api_version == 'auto'
+        self._cache_validation_task = None
+        # (api_version, metadata fields) last written to the cache and when
+        self._md_cache_saved = (None, None)
+        self._md_cache_saved_at = None
 
         self.cluster = ClusterMetadata(metadata_max_age_ms=metadata_max_age_ms)
         self._topics = set()  # empty set will fetch all topic metadata
+        # SharedClient => set of topics, None to track all topics
+        self._user_topics = {}
+        self._users = 0
+        self._close_on_release = False
+        self._bootstrap_lock = asyncio.Lock(loop=loop)
+        # (node_id, group, index) => AIOKafkaConnection
         self._conns = {}
+        # (node_id, group) => counter to spread requests over connections
+        self._conn_counters = {}
         self._loop = loop
         self._sync_task = None
 
         self._md_update_fut = None
         self._md_update_waiter = create_future(loop=self._loop)
-        self._get_conn_lock = asyncio.Lock(loop=loop)
+        # Topics requested for a targeted refresh and its future
+        self._md_topics = set()
+        self._md_topics_fut = None
+        self._md_last_full_update = 0
+        # Connections are opened one at a time per connection id, but
+        # connections to different brokers are opened concurrently
+        self._get_conn_locks = collections.defaultdict(
+            lambda: asyncio.Lock(loop=loop))
 
     def __repr__(self):
         return '<AIOKafkaClient client_id=%s>' % self._client_id
@@ -121,6 +291,12 @@ class AIOKafkaClient:
 
     @asyncio.coroutine
     def close(self):
+        if self._cache_validation_task is not None:
+            self._cache_validation_task.cancel()
+            try:
+                yield from self._cache_validation_task
+            except asyncio.CancelledError:
+                pass
         if self._sync_task:
             self._sync_task.cancel()
             try:
@@ -128,6 +304,9 @@ class AIOKafkaClient:
             except asyncio.CancelledError:
                 pass
             self._sync_task = None
+        if self._watchdog_started:
+            self.watchdog.stop()
+            self._watchdog_started = False
         # Be careful to wait for graceful closure of all connections, so we
         # process all pending buffers.
         futs = []
@@ -139,70 +318,216 @@ class AIOKafkaClient:
     @asyncio.coroutine
     def bootstrap(self):
         """Try to to bootstrap initial cluster metadata"""
-        # using request v0 for bootstap (bcs api version is not detected yet)
-        metadata_request = MetadataRequest[0]([])
-        for host, port, _ in self.hosts:
-            log.debug("Attempting to bootstrap via node at %s:%s", host, port)
+        cached = None
+        if self._metadata_cache is not None:
+            cached = self._metadata_cache.load(self.hosts)
+        if cached is not None and cached["metadata"][0]:
+            self._bootstrap_from_cache(cached)
+        else:
+            yield from self._bootstrap_metadata()
 
-            try:
-                bootstrap_conn = yield from create_conn(
-                    host, port, loop=self._loop, client_id=self._client_id,
-                    request_timeout_ms=self._request_timeout_ms,
-                    ssl_context=self._ssl_context,
-                    security_protocol=self._security_protocol,
-                    max_idle_ms=self._connections_max_idle_ms)
-            except (OSError, asyncio.TimeoutError) as err:
-                log.error('Unable connect to "%s:%s": %s', host, port, err)
-                continue
+            # detect api version if need
+            if self._api_version == 'auto':
+                self._api_version = yield from self.check_version()
+            self._save_metadata_cache()
 
-            try:
-                metadata = yield from bootstrap_conn.send(metadata_request)
-            except KafkaError as err:
-                log.warning('Unable to request metadata from "%s:%s": %s',
-                            host, port, err)
-                bootstrap_conn.close()
-                continue
+        if self._sync_task is None:
+            # starting metadata synchronizer task
+            self._sync_task = ensure_future(
+                self._md_synchronizer(), loop=self._loop)
+        if self.watchdog is not None and not self._watchdog_started:
+            self.watchdog.start()
+            self._watchdog_started = True
+
+    def _bootstrap_from_cache(self, cached):
+        log.debug("Starting from cached metadata of %s", self.hosts)
+        self.cluster.update_metadata(
+            MetadataRequest[1].RESPONSE_TYPE(*cached["metadata"]))
+        check_version = self._api_version == 'auto'
+        if check_version:
+            self._api_version = cached["api_version"]
+        self._cache_validation_task = ensure_future(
+            self._validate_cached_metadata(check_version), loop=self._loop)
 
-            self.cluster.update_metadata(metadata)
+    @asyncio.coroutine
+    def _validate_cached_metadata(self, check_version):
+        try:
+            updated = yield from self.force_metadata_update()
+            if not updated:
+                log.warning(
+                    "Cached brokers are not available, bootstrapping from %s",
+                    self.hosts)
+                self._metadata_cache.invalidate(self.hosts)
+                yield from self._bootstrap_metadata()
+            if check_version:
+                api_version = yield from self._check_cached_version()
+                if api_version != self._api_version:
+                    log.warning(
+                        "Broker version changed from cached %s to %s",
+                        self._api_version, api_version)
+                    self._api_version = api_version
+            self._save_metadata_cache()
+        except asyncio.CancelledError:
+            pass
+        except KafkaError as err:
+            log.error("Unable to validate cached metadata: %s", err)
+        finally:
+            self._cache_validation_task = None
 
-            # A cluster with no topics can return no broker metadata...
-            # In that case, we should keep the bootstrap connection till
-            # we get a normal cluster layout.
-            if not len(self.cluster.brokers()):
-                bootstrap_id = ('bootstrap', ConnectionGroup.DEFAULT)
-                self._conns[bootstrap_id] = bootstrap_conn
-            else:
-                bootstrap_conn.close()
+    @asyncio.coroutine
+    def _check_cached_version(self):
+        # Probing may leave the connection in an undefined state, so it's done
+        # on a dedicated connection instead of a pooled one, that can have
+        # requests of producer or consumer in flight.
+        node_id = self.get_random_node()
+        broker = self.cluster.broker_metadata(node_id)
+        try:
+            conn = yield from create_conn(
+                broker.host, broker.port, loop=self._loop,
+                client_id=self._client_id,
+                request_timeout_ms=self._request_timeout_ms,
+                ssl_context=self._ssl_context,
+                security_protocol=self._security_protocol,
+                node_id=node_id)
+        except (OSError, asyncio.TimeoutError) as err:
+            raise ConnectionError(
+                "Unable connect to node with id {}: {}".format(node_id, err))
+        try:
+            return (yield from self._probe_version(node_id, conn))
+        finally:
+            conn.close()
+
+    def _save_metadata_cache(self):
+        if self._metadata_cache is None or \
+                type(self._api_version) is not tuple or \
+                not self.cluster.brokers():
+            return
+        state = (self._api_version, self.cluster.metadata_fields())
+        now = self._loop.time()
+        if state == self._md_cache_saved and \
+                now - self._md_cache_saved_at < _METADATA_CACHE_SAVE_INTERVAL:
+            return
+        self._metadata_cache.save(self.hosts, *state)
+        self._md_cache_saved = state
+        self._md_cache_saved_at = now
 
-            log.debug('Received cluster metadata: %s', self.cluster)
-            break
-        else:
+    @asyncio.coroutine
+    def _bootstrap_metadata(self):
+        # Bootstrap servers are raced: the next one is tried as soon as the
+        # previous attempt fails or does not respond in
+        # `_BOOTSTRAP_ATTEMPT_DELAY`. First metadata response wins.
+        hosts = list(self.hosts)
+        pending = set()
+        result = None
+        try:
+            while result is None and (hosts or pending):
+                timeout = None
+                if hosts:
+                    host, port, _ = hosts.pop(0)
+                    pending.add(ensure_future(
+                        self._bootstrap_attempt(host, port), loop=self._loop))
+                    if hosts:
+                        timeout = _BOOTSTRAP_ATTEMPT_DELAY
+                done, pending = yield from asyncio.wait(
+                    pending, timeout=timeout, loop=self._loop,
+                    return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    attempt = task.result()
+                    if attempt is None:
+                        continue
+                    if result is None:
+                        result = attempt
+                    else:
+                        attempt[0].close()
+        finally:
+            if pending:
+                for task in pending:
+                    task.cancel()
+                yield from asyncio.wait(pending, loop=self._loop)
+                for task in pending:
+                    if not task.cancelled() and task.exception() is None \
+                            and task.result() is not None:
+                        task.result()[0].close()
+
+        if result is None:
             raise ConnectionError(
                 'Unable to bootstrap from {}'.format(self.hosts))
 
-        # detect api version if need
-        if self._api_version == 'auto':
-            self._api_version = yield from self.check_version()
+        bootstrap_conn, metadata = result
+        self.cluster.update_metadata(metadata)
 
-        if self._sync_task is None:
-            # starting metadata synchronizer task
-            self._sync_task = ensure_future(
-                self._md_synchronizer(), loop=self._loop)
+        # A cluster with no topics can return no broker metadata...
+        # In that case, we should keep the bootstrap connection till
+        # we get a normal cluster layout.
+        if not len(self.cluster.brokers()):
+            bootstrap_id = ('bootstrap', ConnectionGroup.DEFAULT, 0)
+            self._conns[bootstrap_id] = bootstrap_conn
+        else:
+            bootstrap_conn.close()
+
+        log.debug('Received cluster metadata: %s', self.cluster)
+
+    @asyncio.coroutine
+    def _bootstrap_attempt(self, host, port):
+        # using request v0 for bootstap (bcs api version is not detected yet)
+        metadata_request = MetadataRequest[0]([])
+        log.debug("Attempting to bootstrap via node at %s:%s", host, port)
+        try:
+            bootstrap_conn = yield from create_conn(
+                host, port, loop=self._loop, client_id=self._client_id,
+                request_timeout_ms=self._request_timeout_ms,
+                ssl_context=self._ssl_context,
+                security_protocol=self._security_protocol,
+                max_idle_ms=self._connections_max_idle_ms,
+                metrics=self.metrics,
+                node_id="bootstrap",
+                request_tracer=self._request_tracer)
+        except (OSError, asyncio.TimeoutError) as err:
+            log.error('Unable connect to "%s:%s": %s', host, port, err)
+            return None
+
+        try:
+            metadata = yield from bootstrap_conn.send(metadata_request)
+        except (KafkaError, asyncio.TimeoutError) as err:
+            log.warning('Unable to request metadata from "%s:%s": %s',
+                        host, port, err)
+            bootstrap_conn.close()
+            return None
+        except asyncio.CancelledError:
+            bootstrap_conn.close()
+            raise
+        return bootstrap_conn, metadata
 
     @asyncio.coroutine
     def _md_synchronizer(self):
         """routine (async task) for synchronize cluster metadata every
         `metadata_max_age_ms` milliseconds"""
+        max_age = self._metadata_max_age_ms / 1000
+        self._md_last_full_update = self._loop.time()
         while True:
+            timeout = self._md_last_full_update + max_age - self._loop.time()
             yield from asyncio.wait(
-                [self._md_update_waiter],
-                timeout=self._metadata_max_age_ms / 1000,
+                [self._md_update_waiter], timeout=max(0, timeout),
                 loop=self._loop)
 
+            if self._md_update_fut is None and \
+                    self._md_topics_fut is not None:
+                yield from self._targeted_metadata_update()
+                continue
+
             topics = self._topics
             if self._md_update_fut is None:
                 self._md_update_fut = create_future(loop=self._loop)
+            # Targeted refresh of tracked topics is covered by a full one
+            targeted_fut = None
+            if self._md_topics_fut is not None and \
+                    (not topics or self._md_topics <= topics):
+                targeted_fut = self._md_topics_fut
+                self._md_topics, self._md_topics_fut = set(), None
+            self._md_last_full_update = self._loop.time()
             ret = yield from self._metadata_update(self.cluster, topics)
+            if targeted_fut is not None:
+                targeted_fut.set_result(ret)
             # If list of topics changed during metadata update we must update
             # it again right away.
             if topics != self._topics:
@@ -211,10 +536,24 @@ class AIOKafkaClient:
             # but that was to avoid topic list changes being unnoticed, which
             # is handled explicitly now.
             self._md_update_waiter = create_future(loop=self._loop)
+            if self._md_topics_fut is not None:
+                # Targeted refresh was requested during the full one
+                self._md_update_waiter.set_result(None)
 
             self._md_update_fut.set_result(ret)
             self._md_update_fut = None
 
+    @asyncio.coroutine
+    def _targeted_metadata_update(self):
+        # All topics requested until now are refreshed in one request, later
+        # requests are coalesced into the next one.
+        topics, fut = self._md_topics, self._md_topics_fut
+        self._md_topics, self._md_topics_fut = set(), None
+        self._md_update_waiter = create_future(loop=self._loop)
+        ret = yield from self._metadata_update(
+            self.cluster, topics, partial=True)
+        fut.set_result(ret)
+
     def get_random_node(self):
         """choice random node from known cluster brokers
 
@@ -227,15 +566,12 @@ class AIOKafkaClient:
         return random.choice(nodeids)
 
     @asyncio.coroutine
-    def _metadata_update(self, cluster_metadata, topics):
+    def _metadata_update(self, cluster_metadata, topics, *, partial=False):
         assert isinstance(cluster_metadata, ClusterMetadata)
         topics = list(topics)
-        version_id = 0 if self.api_version < (0, 10) else 1
-        if version_id == 1 and not topics:
-            topics = None
-        metadata_request = MetadataRequest[version_id](topics)
+        assert topics or not partial, "Partial update of all topics"
         nodeids = [b.nodeId for b in self.cluster.brokers()]
-        bootstrap_id = ('bootstrap', ConnectionGroup.DEFAULT)
+        bootstrap_id = ('bootstrap', ConnectionGroup.DEFAULT, 0)
         if bootstrap_id in self._conns:
             nodeids.append('bootstrap')
         random.shuffle(nodeids)
@@ -244,6 +580,11 @@ class AIOKafkaClient:
 
             if conn is None:
                 continue
+            version = self.pick_version(
+                MetadataRequest[0].API_KEY, (0, 2), node_id)
+            # Empty list means all topics only in version 0
+            metadata_request = MetadataRequest[version](
+                topics if topics or version == 0 else None)
             log.debug("Sending metadata request %s to node %s",
                       metadata_request, node_id)
 
@@ -261,7 +602,12 @@ class AIOKafkaClient:
             if not metadata.brokers:
                 return False
 
-            cluster_metadata.update_metadata(metadata)
+            if partial:
+                cluster_metadata.merge_metadata(metadata)
+            else:
+                cluster_metadata.update_metadata(metadata)
+            if cluster_metadata is self.cluster and not partial:
+                self._save_metadata_cache()
 
             # We only keep bootstrap connection to update metadata until
             # proper cluster layout is available.
@@ -276,12 +622,22 @@ class AIOKafkaClient:
             return False
         return True
 
-    def force_metadata_update(self):
+    def force_metadata_update(self, topics=None):
         """Update cluster metadata
 
+        Arguments:
+            topics (iterable of str): only refresh metadata of these topics
+                and merge it into the current one. Concurrent targeted
+                refreshes are coalesced into a single request. If None, all
+                tracked topics are refreshed. Default: None
+
         Returns:
             True/False - metadata updated or not
         """
+        if topics is not None and self._md_update_fut is None:
+            topics = set(topics)
+            if topics:
+                return self._request_topics_update(topics)
         if self._md_update_fut is None:
             # Wake up the `_md_synchronizer` task
             if not self._md_update_waiter.done():
@@ -290,6 +646,14 @@ class AIOKafkaClient:
         # Metadata will be updated in the background by syncronizer
         return asyncio.shield(self._md_update_fut, loop=self._loop)
 
+    def _request_topics_update(self, topics):
+        self._md_topics |= topics
+        if self._md_topics_fut is None:
+            if not self._md_update_waiter.done():
+                self._md_update_waiter.set_result(None)
+            self._md_topics_fut = create_future(loop=self._loop)
+        return asyncio.shield(self._md_topics_fut, loop=self._loop)
+
     @asyncio.coroutine
     def fetch_all_metadata(self):
         cluster_md = ClusterMetadata(
@@ -310,7 +674,7 @@ class AIOKafkaClient:
             res = create_future(loop=self._loop)
             res.set_result(True)
         else:
-            res = self.force_metadata_update()
+            res = self.force_metadata_update([topic])
         self._topics.add(topic)
         return res
 
@@ -321,14 +685,62 @@ class AIOKafkaClient:
             topics (list of str): topics to track
         """
         assert not isinstance(topics, str)
-        if not topics or set(topics).difference(self._topics):
+        new_topics = set(topics).difference(self._topics)
+        if not topics:
             res = self.force_metadata_update()
+        elif new_topics:
+            res = self.force_metadata_update(new_topics)
         else:
             res = create_future(loop=self._loop)
             res.set_result(True)
         self._topics = set(topics)
         return res
 
+    def _set_user_topics(self, user, topics):
+        self._user_topics[user] = set(topics) or None
+        return self._update_user_topics()
+
+    def _add_user_topic(self, user, topic):
+        if user not in self._user_topics:
+            self._user_topics[user] = {topic}
+        elif self._user_topics[user] is not None:
+            self._user_topics[user].add(topic)
+        return self._update_user_topics()
+
+    def _update_user_topics(self):
+        topics = set()
+        for user_topics in self._user_topics.values():
+            if user_topics is None:
+                # One of the users tracks all topics
+                return self.set_topics([])
+            topics |= user_topics
+        if topics == self._topics:
+            res = create_future(loop=self._loop)
+            res.set_result(True)
+            return res
+        return self.set_topics(topics)
+
+    @asyncio.coroutine
+    def _acquire(self):
+        with (yield from self._bootstrap_lock):
+            if self._users == 0 and self._sync_task is None:
+                # Not bootstrapped by the application, so the last user
+                # closes it.
+                yield from self.bootstrap()
+                self._close_on_release = True
+            self._users += 1
+
+    @asyncio.coroutine
+    def _release(self, user):
+        self._user_topics.pop(user, None)
+        with (yield from self._bootstrap_lock):
+            self._users -= 1
+            if self._users == 0 and self._close_on_release:
+                self._close_on_release = False
+                yield from self.close()
+            else:
+                self._update_user_topics()
+
     def _on_connection_closed(self, conn, reason):
         """ Callback called when connection is closed
         """
@@ -338,10 +750,20 @@ class AIOKafkaClient:
                 reason == CloseReason.CONNECTION_TIMEOUT:
             self.force_metadata_update()
 
+    def _next_conn_index(self, node_id, group):
+        count = self._connections_per_broker.get(group, 1)
+        if count == 1 or node_id == 'bootstrap':
+            return 0
+        counter = self._conn_counters.get((node_id, group))
+        if counter is None:
+            counter = self._conn_counters[(node_id, group)] = \
+                itertools.cycle(range(count))
+        return next(counter)
+
     @asyncio.coroutine
     def _get_conn(self, node_id, *, group=ConnectionGroup.DEFAULT):
         "Get or create a connection to a broker using host and port"
-        conn_id = (node_id, group)
+        conn_id = (node_id, group, self._next_conn_index(node_id, group))
         if conn_id in self._conns:
             conn = self._conns[conn_id]
             if not conn.connected():
@@ -355,18 +777,26 @@ class AIOKafkaClient:
             log.debug("Initiating connection to node %s at %s:%s",
                       node_id, broker.host, broker.port)
 
-            with (yield from self._get_conn_lock):
+            with (yield from self._get_conn_locks[conn_id]):
                 if conn_id in self._conns:
                     return self._conns[conn_id]
 
-                self._conns[conn_id] = yield from create_conn(
+                conn = self._conns[conn_id] = yield from create_conn(
                     broker.host, broker.port, loop=self._loop,
                     client_id=self._client_id,
                     request_timeout_ms=self._request_timeout_ms,
                     ssl_context=self._ssl_context,
                     security_protocol=self._security_protocol,
                     on_close=self._on_connection_closed,
-                    max_idle_ms=self._connections_max_idle_ms)
+                    max_idle_ms=self._connections_max_idle_ms,
+                    metrics=self.metrics,
+                    node_id=node_id,
+                    request_tracer=self._request_tracer,
+                    socket_options=self._socket_options.get(group))
+                if self._negotiate_versions and \
+                        self.api_version >= (0, 10) and \
+                        node_id not in self._api_versions:
+                    yield from self._fetch_api_versions(node_id, conn)
         except (OSError, asyncio.TimeoutError) as err:
             log.error('Unable connect to node with id %s: %s', node_id, err)
             # Connection failures imply that our metadata is stale, so let's
@@ -376,6 +806,102 @@ class AIOKafkaClient:
         else:
             return self._conns[conn_id]
 
+    @asyncio.coroutine
+    def _fetch_api_versions(self, node_id, conn):
+        try:
+            response = yield from conn.send(ApiVersionRequest[0]())
+        except (KafkaError, asyncio.TimeoutError) as err:
+            log.warning(
+                "Unable to get API versions of node %s: %s", node_id, err)
+            return
+        self._store_api_versions(node_id, response)
+
+    def _store_api_versions(self, node_id, response):
+        if response.error_code != 0:
+            return
+        self._api_versions[node_id] = {
+            api_key: (min_version, max_version)
+            for api_key, min_version, max_version in response.api_versions}
+
+    def pick_version(self, api_key, supported_range, node_id=None):
+        """ Pick the highest version of a request supported by both the
+        caller and the brokers. Versions are taken from ApiVersions responses
+        of brokers if ``api_version`` is ``auto`` and brokers are 0.10+,
+        otherwise from the known versions of the broker release.
+
+        Arguments:
+            api_key (int): API key of the request.
+            supported_range (tuple): (min, max) versions the caller can
+                build and parse.
+            node_id (int): broker the request is sent to. If None, a
+                version supported by all known brokers is picked.
+                Default: None
+
+        Returns:
+            int: version of the request to use
+
+        Raises:
+            UnsupportedVersionError: if brokers support none of the versions
+        """
+        if node_id is None and self._api_versions:
+            broker_ranges = [
+                versions.get(api_key)
+                for versions in self._api_versions.values()]
+        elif node_id in self._api_versions:
+            broker_ranges = [self._api_versions[node_id].get(api_key)]
+        else:
+            broker_ranges = [_release_api_range(self.api_version, api_key)]
+
+        min_version, max_version = supported_range
+        for broker_range in broker_ranges:
+            if broker_range is None:
+                max_version = -1
+                break
+            min_version = max(min_version, broker_range[0])
+            max_version = min(max_version, broker_range[1])
+        if min_version > max_version:
+            raise Errors.UnsupportedVersionError(
+                "Brokers do not support versions {}-{} of API {}".format(
+                    supported_range[0], supported_range[1], api_key))
+        return max_version
+
+    @asyncio.coroutine
+    def warm_up_connections(self, topics=None, *,
+                            group=ConnectionGroup.DEFAULT):
+        """ Open connections to leaders of topic partitions in advance, so
+        first requests to them don't wait for TCP and SSL handshakes.
+        Connections are opened concurrently, failures are only logged.
+
+        Arguments:
+            topics (iterable of str): topics to connect to leaders of. If
+                None, leaders of all known topics are used. Default: None
+            group (int): ConnectionGroup of connections to open, all
+                ``connections_per_broker`` of the group are opened.
+
+        Returns:
+            int: number of connections ready
+        """
+        if topics is None:
+            topics = self.cluster.topics()
+        node_ids = set()
+        for topic in topics:
+            for partition in self.cluster.partitions_for_topic(topic) or ():
+                leader = self.cluster.leader_for_partition(
+                    TopicPartition(topic, partition))
+                if leader is not None and leader != -1:
+                    node_ids.add(leader)
+        count = self._connections_per_broker.get(group, 1)
+        coros = [
+            self._get_conn(node_id, group=group)
+            for node_id in node_ids for _ in range(count)]
+        if not coros:
+            return 0
+        conns = yield from asyncio.gather(*coros, loop=self._loop)
+        ready = len({id(conn) for conn in conns if conn is not None})
+        log.debug("Warmed up %s connection(s) to nodes %s", ready,
+                  sorted(node_ids))
+        return ready
+
     @asyncio.coroutine
     def ready(self, node_id, *, group=ConnectionGroup.DEFAULT):
         conn = yield from self._get_conn(node_id, group=group)
@@ -400,7 +926,8 @@ class AIOKafkaClient:
         Returns:
             Future: resolves to Response struct
         """
-        if not (yield from self.ready(node_id, group=group)):
+        conn = yield from self._get_conn(node_id, group=group)
+        if conn is None:
             raise NodeNotReadyError(
                 "Attempt to send a request to node"
                 " which is not ready (node id {}).".format(node_id))
@@ -411,14 +938,12 @@ class AIOKafkaClient:
                 request.required_acks == 0:
             expect_response = False
 
-        future = self._conns[(node_id, group)].send(
-            request, expect_response=expect_response)
+        future = conn.send(request, expect_response=expect_response)
         try:
             result = yield from future
         except asyncio.TimeoutError:
             # close connection so it is renewed in next request
-            self._conns[(node_id, group)].close(
-                reason=CloseReason.CONNECTION_TIMEOUT)
+            conn.close(reason=CloseReason.CONNECTION_TIMEOUT)
             raise RequestTimedOutError()
         else:
             return result
@@ -428,7 +953,7 @@ class AIOKafkaClient:
         """Attempt to guess the broker version"""
         if node_id is None:
             default_group_conns = [
-                n_id for (n_id, group) in self._conns.keys()
+                n_id for (n_id, group, _) in self._conns.keys()
                 if group == ConnectionGroup.DEFAULT
             ]
             if default_group_conns:
@@ -437,6 +962,18 @@ class AIOKafkaClient:
                 assert self.cluster.brokers(), 'no brokers in metadata'
                 node_id = list(self.cluster.brokers())[0].nodeId
 
+        conn = yield from self._get_conn(node_id)
+        if conn is None:
+            raise ConnectionError(
+                "No connection to node with id {}".format(node_id))
+        version = yield from self._probe_version(node_id, conn)
+        # To avoid having a connection in undefined state
+        if node_id != "bootstrap" and conn.connected():
+            conn.close()
+        return version
+
+    @asyncio.coroutine
+    def _probe_version(self, node_id, conn):
         from kafka.protocol.admin import (
             ListGroupsRequest_v0, ApiVersionRequest_v0)
         from kafka.protocol.commit import (
@@ -455,10 +992,6 @@ class AIOKafkaClient:
         # vanilla MetadataRequest. If the server did not recognize the first
         # request, both will be failed with a ConnectionError that wraps
         # socket.error (32, 54, or 104)
-        conn = yield from self._get_conn(node_id)
-        if conn is None:
-            raise ConnectionError(
-                "No connection to node with id {}".format(node_id))
         for version, request in test_cases:
             try:
                 if not conn.connected():
@@ -466,7 +999,7 @@ class AIOKafkaClient:
                 assert conn, 'no connection to node with id {}'.format(node_id)
                 # request can be ignored by Kafka broker,
                 # so we send metadata request and wait response
-                task = self._loop.create_task(conn.send(request))
+                task = conn.send(request)
                 yield from asyncio.wait([task], timeout=0.1, loop=self._loop)
                 try:
                     yield from conn.send(MetadataRequest_v0([]))
@@ -478,13 +1011,11 @@ class AIOKafkaClient:
             except KafkaError:
                 continue
             else:
-                # To avoid having a connection in undefined state
-                if node_id != "bootstrap" and conn.connected():
-                    conn.close()
                 if isinstance(request, ApiVersionRequest_v0):
                     # Starting from 0.10 kafka broker we determine version
                     # by looking at ApiVersionResponse
                     version = self._check_api_version_response(response)
+                    self._store_api_versions(node_id, response)
                 return version
 
         raise UnrecognizedBrokerVersion()
@@ -538,7 +1069,7 @@ class AIOKafkaClient:
 
         t0 = self._loop.time()
         while True:
-            yield from self.force_metadata_update()
+            yield from self.force_metadata_update([topic])
             if topic in self.cluster.topics():
                 break
             if (self._loop.time() - t0) > (self._request_timeout_ms / 1000):
@@ -552,3 +1083,6 @@ class AIOKafkaClient:
         if self._md_update_fut is not None:
             yield from asyncio.shield(
                 self._md_update_fut, loop=self._loop)
+        if self._md_topics_fut is not None:
+            yield from asyncio.shield(
+                self._md_topics_fut, loop=self._loop)
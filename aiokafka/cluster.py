@@ -0,0 +1,122 @@
+import collections
+import logging
+
+from kafka.cluster import ClusterMetadata as BaseClusterMetadata
+from kafka.structs import BrokerMetadata, PartitionMetadata
+
+import aiokafka.errors as Errors
+from aiokafka.structs import TopicPartition
+
+__all__ = ["ClusterMetadata"]
+
+log = logging.getLogger(__name__)
+
+
+class ClusterMetadata(BaseClusterMetadata):
+    """ kafka-python ``ClusterMetadata``, that can also merge responses to
+    metadata requests for a subset of topics.
+    """
+
+    def merge_metadata(self, metadata):
+        """ Update state of the topics present in a MetadataResponse, keeping
+        metadata of other topics. Broker list is replaced, as brokers always
+        return all of them.
+
+        Arguments:
+            metadata (MetadataResponse): response to a request for specific
+                topics.
+        """
+        brokers = {}
+        for broker in metadata.brokers:
+            if metadata.API_VERSION == 0:
+                node_id, host, port = broker
+                rack = None
+            else:
+                node_id, host, port, rack = broker
+            brokers[node_id] = BrokerMetadata(node_id, host, port, rack)
+        if metadata.API_VERSION == 0:
+            controller = self.controller
+        else:
+            controller = brokers.get(metadata.controller_id)
+
+        updated = {}
+        removed = set()
+        unauthorized = set()
+        internal = set()
+        for topic_data in metadata.topics:
+            if metadata.API_VERSION == 0:
+                error_code, topic, partitions = topic_data
+                is_internal = False
+            else:
+                error_code, topic, is_internal, partitions = topic_data
+            if is_internal:
+                internal.add(topic)
+            error_type = Errors.for_code(error_code)
+            if error_type is Errors.NoError:
+                updated[topic] = {
+                    partition: PartitionMetadata(
+                        topic=topic, partition=partition, leader=leader,
+                        replicas=replicas, isr=isr, error=p_error)
+                    for p_error, partition, leader, replicas, isr
+                    in partitions}
+            elif error_type is Errors.UnknownTopicOrPartitionError:
+                log.error("Topic %s not found in cluster metadata", topic)
+                removed.add(topic)
+            elif error_type is Errors.TopicAuthorizationFailedError:
+                log.error("Topic %s is not authorized for this client", topic)
+                unauthorized.add(topic)
+                removed.add(topic)
+            else:
+                # Keep the last known state, like LeaderNotAvailable during
+                # topic creation.
+                log.warning("Error fetching metadata for topic %s: %s",
+                            topic, error_type)
+
+        changed = set(updated) | removed
+        with self._lock:
+            self._brokers = brokers
+            self.controller = controller
+            for topic in removed:
+                self._partitions.pop(topic, None)
+            self._partitions.update(updated)
+            broker_partitions = collections.defaultdict(set)
+            for node_id, tps in self._broker_partitions.items():
+                kept = {tp for tp in tps if tp.topic not in changed}
+                if kept:
+                    broker_partitions[node_id] = kept
+            for topic, partitions in updated.items():
+                for partition, meta in partitions.items():
+                    if meta.leader != -1:
+                        broker_partitions[meta.leader].add(
+                            TopicPartition(topic, partition))
+            self._broker_partitions = broker_partitions
+            self.unauthorized_topics = \
+                (self.unauthorized_topics - changed) | unauthorized
+            self.internal_topics = (self.internal_topics - changed) | internal
+
+        log.debug("Merged metadata of topics %s into %s", sorted(changed),
+                  self)
+        for listener in self._listeners:
+            listener(self)
+
+    def metadata_fields(self):
+        """ Return current state as [brokers, controller_id, topics] fields
+        of a v1 MetadataResponse, that can be fed back into
+        ``update_metadata()``. Only topics with known partitions are
+        included.
+        """
+        with self._lock:
+            brokers = [
+                [b.nodeId, b.host, b.port, b.rack]
+                for b in self._brokers.values()]
+            controller_id = \
+                self.controller.nodeId if self.controller else -1
+            topics = []
+            for topic, partitions in self._partitions.items():
+                topics.append([
+                    Errors.NoError.errno, topic,
+                    topic in self.internal_topics,
+                    [[meta.error, partition, meta.leader,
+                      list(meta.replicas), list(meta.isr)]
+                     for partition, meta in sorted(partitions.items())]])
+        return [brokers, controller_id, topics]
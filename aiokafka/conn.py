@@ -1,4 +1,6 @@
 import asyncio
+import collections
+import socket
 import struct
 import logging
 
@@ -7,12 +9,16 @@ from kafka.protocol.commit import (
     GroupCoordinatorResponse_v0 as GroupCoordinatorResponse)
 
 import aiokafka.errors as Errors
+from aiokafka.metrics import Metrics
 from aiokafka.util import ensure_future, create_future
 
 __all__ = ['AIOKafkaConnection', 'create_conn']
 
 
 READER_LIMIT = 2 ** 16
+# Wait for the write buffer to drain on requests without response only if
+# it grew above this size, same as default high-water mark of transports.
+DRAIN_THRESHOLD = 2 ** 16
 
 
 class CloseReason:
@@ -28,7 +34,8 @@ class CloseReason:
 def create_conn(host, port, *, loop=None, client_id='aiokafka',
                 request_timeout_ms=40000, api_version=(0, 8, 2),
                 ssl_context=None, security_protocol="PLAINTEXT",
-                max_idle_ms=None, on_close=None):
+                max_idle_ms=None, on_close=None, metrics=None,
+                node_id=None, request_tracer=None, socket_options=None):
     if loop is None:
         loop = asyncio.get_event_loop()
     conn = AIOKafkaConnection(
@@ -36,7 +43,9 @@ def create_conn(host, port, *, loop=None, client_id='aiokafka',
         request_timeout_ms=request_timeout_ms,
         api_version=api_version,
         ssl_context=ssl_context, security_protocol=security_protocol,
-        max_idle_ms=max_idle_ms, on_close=on_close)
+        max_idle_ms=max_idle_ms, on_close=on_close, metrics=metrics,
+        node_id=node_id, request_tracer=request_tracer,
+        socket_options=socket_options)
     yield from conn.connect()
     return conn
 
@@ -63,8 +72,10 @@ class AIOKafkaConnection:
     def __init__(self, host, port, *, loop, client_id='aiokafka',
                  request_timeout_ms=40000, api_version=(0, 8, 2),
                  ssl_context=None, security_protocol="PLAINTEXT",
-                 max_idle_ms=None, on_close=None):
+                 max_idle_ms=None, on_close=None, metrics=None,
+                 node_id=None, request_tracer=None, socket_options=None):
         self._loop = loop
+        self._node_id = node_id
         self._host = host
         self._port = port
         self._request_timeout = request_timeout_ms / 1000
@@ -72,9 +83,12 @@ class AIOKafkaConnection:
         self._client_id = client_id
         self._ssl_context = ssl_context
         self._secutity_protocol = security_protocol
+        self._socket_options = socket_options or {}
 
         self._reader = self._writer = self._protocol = None
-        self._requests = []
+        # Pending requests in send order, so also in order of deadlines
+        self._requests = collections.deque()
+        self._sweep_handle = None
         self._read_task = None
         self._correlation_id = 0
         self._closed_fut = None
@@ -84,6 +98,21 @@ class AIOKafkaConnection:
         self._idle_handle = None
 
         self._on_close_cb = on_close
+        self._tracer = request_tracer
+
+        if metrics is None:
+            metrics = Metrics(enabled=False)
+        metrics = metrics.with_tags(broker="{}:{}".format(host, port))
+        self._metrics = metrics
+        self._requests_sensor = metrics.counter(
+            "aiokafka_connection_requests_total", "Requests sent")
+        self._bytes_sent_sensor = metrics.counter(
+            "aiokafka_connection_sent_bytes_total", "Bytes sent")
+        self._bytes_received_sensor = metrics.counter(
+            "aiokafka_connection_received_bytes_total", "Bytes received")
+        self._latency_sensor = metrics.histogram(
+            "aiokafka_connection_request_latency_seconds",
+            "Time from sending a request to receiving the response")
 
     @asyncio.coroutine
     def connect(self):
@@ -102,6 +131,7 @@ class AIOKafkaConnection:
             loop.create_connection(
                 lambda: protocol, self.host, self.port, ssl=ssl),
             loop=loop, timeout=self._request_timeout)
+        self._set_socket_options(transport.get_extra_info("socket"))
         writer = asyncio.StreamWriter(transport, protocol, reader, loop)
         self._reader, self._writer, self._protocol = reader, writer, protocol
         # Start reader task.
@@ -112,6 +142,23 @@ class AIOKafkaConnection:
             self._idle_handle = self._loop.call_soon(self._idle_check)
         return reader, writer
 
+    def _set_socket_options(self, sock):
+        options = self._socket_options
+        if sock is None or not options:
+            return
+        if options.get("tcp_nodelay") is not None:
+            sock.setsockopt(
+                socket.IPPROTO_TCP, socket.TCP_NODELAY,
+                int(options["tcp_nodelay"]))
+        if options.get("send_buffer_bytes") is not None:
+            sock.setsockopt(
+                socket.SOL_SOCKET, socket.SO_SNDBUF,
+                options["send_buffer_bytes"])
+        if options.get("receive_buffer_bytes") is not None:
+            sock.setsockopt(
+                socket.SOL_SOCKET, socket.SO_RCVBUF,
+                options["receive_buffer_bytes"])
+
     def _on_read_task_error(self, read_task):
         try:
             read_task.result()
@@ -120,8 +167,9 @@ class AIOKafkaConnection:
                 "Connection at {0}:{1} broken".format(self._host, self._port))
             conn_exc.__cause__ = exc
             conn_exc.__context__ = exc
-            for _, _, fut in self._requests:
-                fut.set_exception(conn_exc)
+            for _, _, fut, _, _ in self._requests:
+                if not fut.done():
+                    fut.set_exception(conn_exc)
             self.close(reason=CloseReason.CONNECTION_BROKEN)
 
     def _idle_check(self):
@@ -171,12 +219,44 @@ class AIOKafkaConnection:
             raise Errors.ConnectionError(
                 "Connection at {0}:{1} broken: {2}".format(
                     self._host, self._port, err))
+        if self._metrics.enabled:
+            self._requests_sensor.inc()
+            self._bytes_sent_sensor.inc(len(message) + 4)
+
+        trace_cb = None
+        if self._tracer is not None:
+            trace_cb = self._trace_request(request, correlation_id, message)
 
         if not expect_response:
-            return self._writer.drain()
+            if self._writer.transport.get_write_buffer_size() > \
+                    DRAIN_THRESHOLD:
+                return self._writer.drain()
+            fut = create_future(loop=self._loop)
+            fut.set_result(None)
+            return fut
         fut = create_future(loop=self._loop)
-        self._requests.append((correlation_id, request.RESPONSE_TYPE, fut))
-        return asyncio.wait_for(fut, self._request_timeout, loop=self._loop)
+        sent_at = self._loop.time()
+        self._requests.append((
+            correlation_id, request.RESPONSE_TYPE, fut, sent_at, trace_cb))
+        if self._sweep_handle is None:
+            self._sweep_handle = self._loop.call_at(
+                sent_at + self._request_timeout, self._sweep_timeouts)
+        return fut
+
+    def _sweep_timeouts(self):
+        """ Fail requests, that got no response in `request_timeout_ms`.
+        Requests stay in the queue, as responses are matched by order.
+        """
+        self._sweep_handle = None
+        deadline = self._loop.time() - self._request_timeout
+        for _, _, fut, sent_at, _ in self._requests:
+            if fut.done():
+                continue
+            if sent_at > deadline:
+                self._sweep_handle = self._loop.call_at(
+                    sent_at + self._request_timeout, self._sweep_timeouts)
+                break
+            fut.set_exception(asyncio.TimeoutError())
 
     def connected(self):
         return bool(self._reader is not None and not self._reader.at_eof())
@@ -188,13 +268,16 @@ class AIOKafkaConnection:
             self._writer = self._reader = None
             self._read_task.cancel()
             self._read_task = None
-            for _, _, fut in self._requests:
+            for _, _, fut, _, _ in self._requests:
                 if not fut.done():
                     error = Errors.ConnectionError(
                         "Connection at {0}:{1} closed".format(
                             self._host, self._port))
                     fut.set_exception(error)
-            self._requests = []
+            self._requests.clear()
+            if self._sweep_handle is not None:
+                self._sweep_handle.cancel()
+                self._sweep_handle = None
             if self._on_close_cb is not None:
                 self._on_close_cb(self, reason)
                 self._on_close_cb = None
@@ -213,10 +296,13 @@ class AIOKafkaConnection:
                 size, = self.HEADER.unpack(resp)
 
                 resp = yield from self._reader.readexactly(size)
+                if self._metrics.enabled:
+                    self._bytes_received_sensor.inc(size + 4)
 
                 recv_correlation_id, = self.HEADER.unpack(resp[:4])
 
-                correlation_id, resp_type, fut = self._requests.pop(0)
+                correlation_id, resp_type, fut, sent_at, trace_cb = \
+                    self._requests.popleft()
                 if (self._api_version == (0, 8, 2) and
                         resp_type is GroupCoordinatorResponse and
                         correlation_id != 0 and recv_correlation_id == 0):
@@ -242,18 +328,42 @@ class AIOKafkaConnection:
                     fut.set_result(response)
                 # Update idle timer.
                 self._last_action = self._loop.time()
+                if self._metrics.enabled:
+                    self._latency_sensor.record(self._last_action - sent_at)
+                if trace_cb is not None:
+                    self._trace_response(
+                        trace_cb, size + 4, self._last_action - sent_at)
         except (OSError, EOFError, ConnectionError) as exc:
-            for _, _, fut in self._requests:
+            for _, _, fut, _, _ in self._requests:
                 conn_exc = Errors.ConnectionError(
                     "Connection at {0}:{1} broken"
                     .format(self._host, self._port))
                 conn_exc.__cause__ = exc
                 conn_exc.__context__ = exc
-                fut.set_exception(conn_exc)
+                if not fut.done():
+                    fut.set_exception(conn_exc)
             self.close(reason=CloseReason.CONNECTION_BROKEN)
         except asyncio.CancelledError:
             pass
 
+    def _trace_request(self, request, correlation_id, message):
+        node = self._node_id
+        if node is None:
+            node = "{}:{}".format(self._host, self._port)
+        try:
+            return self._tracer.on_request(
+                node, request.API_KEY, request.API_VERSION, correlation_id,
+                len(message) + 4)
+        except Exception:
+            self.log.exception("Error in request tracer %r", self._tracer)
+            return None
+
+    def _trace_response(self, trace_cb, response_bytes, latency):
+        try:
+            trace_cb(response_bytes, latency)
+        except Exception:
+            self.log.exception("Error in request tracer %r", self._tracer)
+
     def _next_correlation_id(self):
         self._correlation_id = (self._correlation_id + 1) % 2**31
         return self._correlation_id
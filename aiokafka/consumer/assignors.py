@@ -0,0 +1,334 @@
+import collections
+import heapq
+import logging
+from io import BytesIO
+
+from kafka.coordinator.assignors.abstract import AbstractPartitionAssignor
+from kafka.coordinator.protocol import (
+    ConsumerProtocolMemberAssignment, ConsumerProtocolMemberMetadata)
+from kafka.protocol.struct import Struct
+from kafka.protocol.types import Array, Int32, Schema, String
+
+from aiokafka.structs import TopicPartition
+
+log = logging.getLogger(__name__)
+
+
+class StickyAssignorUserData(Struct):
+    """ Member metadata user data of ``StickyPartitionAssignor``. Same layout
+    as version 1 of Java client ``StickyAssignor`` user data.
+    """
+    SCHEMA = Schema(
+        ('previous_assignment', Array(
+            ('topic', String('utf-8')),
+            ('partitions', Array(Int32)))),
+        ('generation', Int32))
+
+
+class StickyPartitionAssignor(AbstractPartitionAssignor):
+    """ Assignor, that keeps partitions with their previous owners as much as
+    possible, while keeping the assignment balanced.
+
+    With RoundRobin assignment almost every partition changes its owner when
+    a member joins or leaves the group. This assignor only moves partitions
+    of members that left and the partitions needed to even out the load, so
+    consumers keep their local state and committed offset caches.
+
+    Each member sends partitions it owns in the user data of its JoinGroup
+    metadata and the leader starts from those, dropping partitions of topics
+    the member is no longer subscribed to. If several members claim the same
+    partition (for example a member, that was kicked out of the group, did
+    not notice it yet) the one with the latest assignment wins. Then:
+
+    * Unowned partitions are given to the least loaded subscribed members,
+      partitions of topics with fewest subscribers first.
+    * Partitions are moved from the most loaded members to the least loaded
+      subscribed members, until no move can reduce the difference.
+
+    If all members have the same subscription, partition counts of members
+    differ by at most 1. Assignment takes O(P log M) time for P partitions
+    and M members, so it scales to groups with tens of thousands of
+    partitions.
+
+    Use it as::
+
+        consumer = AIOKafkaConsumer(
+            "my_topic", group_id="my_group",
+            partition_assignment_strategy=[StickyPartitionAssignor()])
+
+    Note:
+        The assignor keeps the assignment of its consumer, so do not share
+        one instance between several consumers. If the class is passed to
+        ``AIOKafkaConsumer`` an instance is created for it.
+    """
+
+    name = 'sticky'
+    version = 0
+
+    def __init__(self):
+        self._member_assignment = []
+        self._generation = -1
+
+    def metadata(self, topics):
+        owned = collections.defaultdict(list)
+        for tp in self._member_assignment:
+            owned[tp.topic].append(tp.partition)
+        user_data = StickyAssignorUserData(
+            sorted(owned.items()), self._generation)
+        return ConsumerProtocolMemberMetadata(
+            self.version, sorted(topics), user_data.encode())
+
+    def on_assignment(self, assignment):
+        self._member_assignment = assignment.partitions()
+        if assignment.user_data and len(assignment.user_data) == 4:
+            self._generation = Int32.decode(BytesIO(assignment.user_data))
+
+    @staticmethod
+    def _decode_user_data(user_data):
+        if not user_data:
+            return None
+        try:
+            return StickyAssignorUserData.decode(user_data)
+        except Exception as err:
+            log.warning("Ignoring malformed sticky assignor user data: %s",
+                        err)
+            return None
+
+    def _member_user_data(self, member_metadata):
+        """ Return {member_id: StickyAssignorUserData} of members, that sent
+        valid user data, and the latest assignment generation.
+        """
+        user_data = {}
+        generation = self._generation
+        for member_id, metadata in member_metadata.items():
+            member_data = self._decode_user_data(metadata.user_data)
+            if member_data is not None:
+                user_data[member_id] = member_data
+                generation = max(generation, member_data.generation)
+        return user_data, generation
+
+    def _sticky_assignment(self, cluster, member_metadata, user_data):
+        """ Return {member_id: {topic: set(partitions)}} """
+        subscriptions = {}
+        partitions_per_topic = {}
+        for member_id, metadata in member_metadata.items():
+            subscriptions[member_id] = frozenset(metadata.subscription)
+            for topic in metadata.subscription:
+                if topic in partitions_per_topic:
+                    continue
+                partitions = cluster.partitions_for_topic(topic)
+                if partitions is None:
+                    log.warning('No partition metadata for topic %s', topic)
+                    partitions = set()
+                partitions_per_topic[topic] = partitions
+
+        assignment = self._previous_assignment(
+            user_data, subscriptions, partitions_per_topic)
+
+        balancer = _Balancer(subscriptions, assignment)
+        owned = set()
+        for member_id, topics in assignment.items():
+            for topic, partitions in topics.items():
+                owned.update(
+                    TopicPartition(topic, partition)
+                    for partition in partitions)
+        unowned = [
+            TopicPartition(topic, partition)
+            for topic, partitions in partitions_per_topic.items()
+            for partition in partitions
+            if TopicPartition(topic, partition) not in owned]
+        unowned.sort(key=lambda tp: (balancer.subscriber_count(tp.topic), tp))
+        for tp in unowned:
+            balancer.add(tp)
+        balancer.balance()
+        return assignment
+
+    def _protocol_assignment(self, assignment, generation):
+        assignment_data = Int32.encode(generation)
+        protocol_assignment = {}
+        for member_id, topics in assignment.items():
+            protocol_assignment[member_id] = ConsumerProtocolMemberAssignment(
+                self.version,
+                sorted(
+                    (topic, sorted(partitions))
+                    for topic, partitions in topics.items()
+                    if partitions),
+                assignment_data)
+        return protocol_assignment
+
+    def assign(self, cluster, member_metadata):
+        user_data, generation = self._member_user_data(member_metadata)
+        assignment = self._sticky_assignment(
+            cluster, member_metadata, user_data)
+        return self._protocol_assignment(assignment, generation + 1)
+
+    def _previous_assignment(self, user_data, subscriptions,
+                             partitions_per_topic):
+        """ Return {member_id: {topic: set(partitions)}} of partitions, that
+        members still can own.
+        """
+        owner = {}
+        for member_id in sorted(user_data):
+            generation = user_data[member_id].generation
+            topics = subscriptions[member_id]
+            for topic, partitions in user_data[member_id].previous_assignment:
+                if topic not in topics:
+                    continue
+                existing = partitions_per_topic[topic]
+                for partition in partitions:
+                    if partition not in existing:
+                        continue
+                    tp = TopicPartition(topic, partition)
+                    if tp in owner and owner[tp][0] >= generation:
+                        continue
+                    owner[tp] = (generation, member_id)
+
+        assignment = {
+            member_id: collections.defaultdict(set)
+            for member_id in subscriptions}
+        for tp, (_, member_id) in owner.items():
+            assignment[member_id][tp.topic].add(tp.partition)
+        return assignment
+
+
+class CooperativeStickyPartitionAssignor(StickyPartitionAssignor):
+    """ ``StickyPartitionAssignor`` for the cooperative rebalance protocol
+    (KIP-429).
+
+    With the default (eager) protocol every member revokes all its
+    partitions and stops consumption before rejoining the group. If all
+    assignors of a consumer are cooperative, it keeps consuming during the
+    rebalance instead and only revokes partitions, that the new assignment
+    moves to other members. To avoid two members consuming the same
+    partition, the leader does not give a partition to its new owner while
+    another member still owns it. The previous owner revokes it and rejoins,
+    and the partition is assigned in the follow-up rebalance.
+
+    Rebalance listeners of cooperative consumers get only the revoked
+    partitions in ``on_partitions_revoked()`` and only the newly added ones
+    in ``on_partitions_assigned()``.
+
+    To switch a running group from an eager assignor, first deploy
+    consumers with both assignors, for example
+    ``[CooperativeStickyPartitionAssignor(), RoundRobinPartitionAssignor]``,
+    then remove the eager one. Consumers with an eager assignor in the list
+    use the eager protocol.
+    """
+
+    name = 'cooperative-sticky'
+    cooperative = True
+
+    def assign(self, cluster, member_metadata):
+        user_data, generation = self._member_user_data(member_metadata)
+        assignment = self._sticky_assignment(
+            cluster, member_metadata, user_data)
+
+        owners = collections.defaultdict(set)
+        for member_id, member_data in user_data.items():
+            for topic, partitions in member_data.previous_assignment:
+                for partition in partitions:
+                    owners[TopicPartition(topic, partition)].add(member_id)
+        # Partitions still owned by other members are withheld until those
+        # revoke them and rejoin
+        for member_id, topics in assignment.items():
+            for topic, partitions in topics.items():
+                for partition in list(partitions):
+                    tp_owners = owners.get(TopicPartition(topic, partition))
+                    if tp_owners and tp_owners != {member_id}:
+                        partitions.remove(partition)
+        return self._protocol_assignment(assignment, generation + 1)
+
+
+class _Balancer:
+    """ Tracks partition counts of members to find the least and the most
+    loaded ones. Members with the same subscription share a heap, so lookups
+    cost O(log M) per distinct subscription containing the topic.
+    """
+
+    def __init__(self, subscriptions, assignment):
+        self._subscriptions = subscriptions
+        self._assignment = assignment
+        self._counts = {
+            member_id: sum(len(partitions) for partitions in topics.values())
+            for member_id, topics in assignment.items()}
+
+        self._heaps = collections.defaultdict(list)
+        self._topic_heaps = collections.defaultdict(list)
+        self._topic_subscribers = collections.Counter()
+        for member_id, topics in subscriptions.items():
+            heap = self._heaps[topics]
+            if not heap:
+                for topic in topics:
+                    self._topic_heaps[topic].append(heap)
+            heap.append((self._counts[member_id], member_id))
+            self._topic_subscribers.update(topics)
+        for heap in self._heaps.values():
+            heapq.heapify(heap)
+
+    def subscriber_count(self, topic):
+        return self._topic_subscribers[topic]
+
+    def _push(self, member_id):
+        heapq.heappush(
+            self._heaps[self._subscriptions[member_id]],
+            (self._counts[member_id], member_id))
+
+    def _least_loaded_in(self, heap):
+        # Drop entries with outdated counts
+        while heap[0][0] != self._counts[heap[0][1]]:
+            heapq.heappop(heap)
+        return heap[0]
+
+    def _least_loaded(self, topic):
+        return min(
+            self._least_loaded_in(heap) for heap in self._topic_heaps[topic])
+
+    def add(self, tp):
+        _, member_id = self._least_loaded(tp.topic)
+        self._assignment[member_id][tp.topic].add(tp.partition)
+        self._counts[member_id] += 1
+        self._push(member_id)
+
+    def _move(self, topic, src, dst):
+        partition = self._assignment[src][topic].pop()
+        self._assignment[dst][topic].add(partition)
+        self._counts[src] -= 1
+        self._counts[dst] += 1
+        self._push(src)
+        self._push(dst)
+
+    def _min_count(self):
+        return min(
+            self._least_loaded_in(heap)[0] for heap in self._heaps.values())
+
+    def _balance_pass(self):
+        moved = False
+        max_heap = [(-count, member_id)
+                    for member_id, count in self._counts.items()]
+        heapq.heapify(max_heap)
+        while max_heap:
+            neg_count, member_id = heapq.heappop(max_heap)
+            count = self._counts[member_id]
+            if -neg_count != count:
+                continue
+            if self._min_count() >= count - 1:
+                break
+            for topic, partitions in self._assignment[member_id].items():
+                if not partitions:
+                    continue
+                target_count, target = self._least_loaded(topic)
+                if target_count < count - 1:
+                    self._move(topic, member_id, target)
+                    heapq.heappush(max_heap, (-count + 1, member_id))
+                    heapq.heappush(max_heap, (-target_count - 1, target))
+                    moved = True
+                    break
+        return moved
+
+    def balance(self):
+        # Each move lowers the sum of squared counts, so this terminates
+        while self._balance_pass():
+            pass
+
+
+__all__ = ["StickyPartitionAssignor", "CooperativeStickyPartitionAssignor"]
@@ -3,9 +3,10 @@ import logging
 import re
 
 from kafka.coordinator.assignors.roundrobin import RoundRobinPartitionAssignor
+from kafka.protocol.offset import OffsetRequest
 
 from aiokafka.abc import ConsumerRebalanceListener
-from aiokafka.client import AIOKafkaClient
+from aiokafka.client import AIOKafkaClient, ConnectionGroup, SharedClient
 from aiokafka.errors import (
     TopicAuthorizationFailedError, OffsetOutOfRangeError,
     ConsumerStoppedError, IllegalOperation, UnsupportedVersionError,
@@ -13,9 +14,10 @@ from aiokafka.errors import (
     CorruptRecordException
 )
 from aiokafka.structs import TopicPartition, OffsetAndMetadata
-from aiokafka.util import PY_35
+from aiokafka.util import PY_35, ensure_future
 from aiokafka import __version__
 
+from .assignors import StickyPartitionAssignor
 from .fetcher import Fetcher, OffsetResetStrategy
 from .group_coordinator import GroupCoordinator, NoGroupCoordinator
 from .subscription_state import SubscriptionState
@@ -57,6 +59,14 @@ class AIOKafkaConsumer(object):
             committing offsets. If None, auto-partition assignment (via
             group coordinator) and offset commits are disabled.
             Default: None
+        group_instance_id (str or None): unique identifier of this consumer
+            instance within the group. If set, the consumer is a static
+            member: it does not leave the group on ``stop()`` and, if
+            restarted within ``session_timeout_ms``, gets its previous
+            assignment back without a group rebalance. Each instance must
+            use its own id, an instance fenced by another one with the same
+            id raises ``FencedInstanceIdError``. Requires Kafka 2.3+.
+            Default: None
         key_deserializer (callable): Any callable that takes a
             raw message key and returns a deserialized key.
         value_deserializer (callable, optional): Any callable that takes a
@@ -106,7 +116,13 @@ class AIOKafkaConsumer(object):
             enable support both for the old assignment strategy and the new
             one. The coordinator will choose the old assignment strategy until
             all members have been updated. Then it will choose the new
-            strategy. Default: [RoundRobinPartitionAssignor]
+            strategy. ``StickyPartitionAssignor`` from
+            ``aiokafka.consumer.assignors`` keeps partitions with their
+            previous owners on rebalance. With
+            ``CooperativeStickyPartitionAssignor`` the consumer keeps
+            consuming during rebalance and only revokes partitions, that
+            move to other members.
+            Default: [RoundRobinPartitionAssignor]
         heartbeat_interval_ms (int): The expected time in milliseconds
             between heartbeats to the consumer coordinator when using
             Kafka's group management feature. Heartbeats are used to ensure
@@ -138,6 +154,45 @@ class AIOKafkaConsumer(object):
         connections_max_idle_ms (int): Close idle connections after the number
             of milliseconds specified by this config. Specifying `None` will
             disable idle checks. Default: 540000 (9hours).
+        partition_drain_policy (AbstractDrainPolicy): defines in which order
+            prefetched data of different partitions is returned by
+            ``getone()`` and ``getmany()``. Available policies are
+            ``RoundRobinDrainPolicy``, ``LagWeightedDrainPolicy`` and
+            ``PriorityDrainPolicy`` from ``aiokafka.consumer.drain_policy``.
+            Default: RoundRobinDrainPolicy()
+        offset_store (AbstractOffsetStore): storage of committed offsets, used
+            by ``commit()`` and to find positions of newly assigned
+            partitions. Available stores are ``KafkaOffsetStore`` and
+            ``LocalOffsetStore`` from ``aiokafka.consumer.offset_store``.
+            Only used if ``group_id`` is set. Default: KafkaOffsetStore()
+        metrics (Metrics): registry to record consumer metrics in, see
+            :class:`aiokafka.metrics.Metrics`. Metrics are not collected by
+            default. Default: None
+        request_tracer (AbstractRequestTracer): hook called on each request
+            sent to brokers and each response received, see
+            :mod:`aiokafka.tracing`. Default: None
+        watchdog (LoopWatchdog): detector of event loop stalls, that times
+            decompression and deserialization of fetched batches, see
+            :mod:`aiokafka.watchdog`. Default: None
+        connections_per_broker (int): number of connections to open to each
+            broker for fetch requests. Fetch responses use connections
+            separate from metadata and group coordination requests.
+            Default: 1
+        socket_options (dict): {ConnectionGroup: dict} socket options per
+            traffic class, see :class:`aiokafka.AIOKafkaClient`.
+            Default: None
+        metadata_cache (MetadataCache): on-disk cache of broker version and
+            cluster metadata for faster startup, see
+            :class:`aiokafka.metadata_cache.MetadataCache`. Default: None
+        warm_up_connections (bool): open fetch connections to leaders of
+            topics passed to the constructor in ``start()``, so the first
+            fetches don't wait for connection handshakes. Default: False
+        client (AIOKafkaClient): existing client to share broker
+            connections and cluster metadata with other consumers and
+            producers. Connection related options of this consumer
+            (``bootstrap_servers``, ``client_id``, ``metrics``,
+            ``connections_per_broker`` etc.) are ignored in that case, the
+            client's configuration is used. Default: None
 
     Note:
         Many configuration parameters are taken from Java Client:
@@ -148,6 +203,7 @@ class AIOKafkaConsumer(object):
                  bootstrap_servers='localhost',
                  client_id='aiokafka-' + __version__,
                  group_id=None,
+                 group_instance_id=None,
                  key_deserializer=None, value_deserializer=None,
                  fetch_max_wait_ms=500,
                  fetch_min_bytes=1,
@@ -168,24 +224,47 @@ class AIOKafkaConsumer(object):
                  security_protocol='PLAINTEXT',
                  api_version='auto',
                  exclude_internal_topics=True,
-                 connections_max_idle_ms=540000):
+                 connections_max_idle_ms=540000,
+                 partition_drain_policy=None,
+                 offset_store=None,
+                 metrics=None,
+                 request_tracer=None,
+                 watchdog=None,
+                 connections_per_broker=1,
+                 socket_options=None,
+                 metadata_cache=None,
+                 warm_up_connections=False,
+                 client=None):
         if api_version not in ('auto', '0.9', '0.10'):
             raise ValueError("Unsupported Kafka API version")
-        self._client = AIOKafkaClient(
-            loop=loop, bootstrap_servers=bootstrap_servers,
-            client_id=client_id, metadata_max_age_ms=metadata_max_age_ms,
-            request_timeout_ms=request_timeout_ms,
-            retry_backoff_ms=retry_backoff_ms,
-            api_version=api_version,
-            ssl_context=ssl_context,
-            security_protocol=security_protocol,
-            connections_max_idle_ms=connections_max_idle_ms)
+        if client is not None:
+            if client._loop is not loop:
+                raise ValueError("Shared client should use the same loop")
+            self._client = SharedClient(client)
+        else:
+            self._client = AIOKafkaClient(
+                loop=loop, bootstrap_servers=bootstrap_servers,
+                client_id=client_id, metadata_max_age_ms=metadata_max_age_ms,
+                request_timeout_ms=request_timeout_ms,
+                retry_backoff_ms=retry_backoff_ms,
+                api_version=api_version,
+                ssl_context=ssl_context,
+                security_protocol=security_protocol,
+                connections_max_idle_ms=connections_max_idle_ms,
+                metrics=metrics,
+                request_tracer=request_tracer,
+                watchdog=watchdog,
+                connections_per_broker={
+                    ConnectionGroup.FETCH: connections_per_broker},
+                socket_options=socket_options,
+                metadata_cache=metadata_cache)
 
         if max_poll_records is not None and (
                 not isinstance(max_poll_records, int) or max_poll_records < 1):
             raise ValueError("`max_poll_records` should be positive Integer")
 
         self._group_id = group_id
+        self._group_instance_id = group_instance_id
         self._heartbeat_interval_ms = heartbeat_interval_ms
         self._session_timeout_ms = session_timeout_ms
         self._retry_backoff_ms = retry_backoff_ms
@@ -193,7 +272,11 @@ class AIOKafkaConsumer(object):
         self._request_timeout_ms = request_timeout_ms
         self._enable_auto_commit = enable_auto_commit
         self._auto_commit_interval_ms = auto_commit_interval_ms
-        self._partition_assignment_strategy = partition_assignment_strategy
+        # Sticky assignors keep the assignment of their consumer
+        self._partition_assignment_strategy = tuple(
+            assignor() if isinstance(assignor, type) and
+            issubclass(assignor, StickyPartitionAssignor) else assignor
+            for assignor in partition_assignment_strategy)
         self._key_deserializer = key_deserializer
         self._value_deserializer = value_deserializer
         self._fetch_min_bytes = fetch_min_bytes
@@ -203,6 +286,9 @@ class AIOKafkaConsumer(object):
         self._max_poll_records = max_poll_records
         self._consumer_timeout = consumer_timeout_ms / 1000
         self._check_crcs = check_crcs
+        self._partition_drain_policy = partition_drain_policy
+        self._offset_store = offset_store
+        self._warm_up_connections = warm_up_connections
         self._subscription = SubscriptionState(loop=loop)
         self._fetcher = None
         self._coordinator = None
@@ -224,6 +310,11 @@ class AIOKafkaConsumer(object):
         """
         yield from self._client.bootstrap()
         yield from self._wait_topics()
+        if self._warm_up_connections and \
+                self._subscription.subscription is not None:
+            yield from self._client.warm_up_connections(
+                self._subscription.subscription.topics,
+                group=ConnectionGroup.FETCH)
 
         if self._client.api_version < (0, 9):
             raise ValueError("Unsupported Kafka version: {}".format(
@@ -239,7 +330,8 @@ class AIOKafkaConsumer(object):
             check_crcs=self._check_crcs,
             fetcher_timeout=self._consumer_timeout,
             retry_backoff_ms=self._retry_backoff_ms,
-            auto_offset_reset=self._auto_offset_reset)
+            auto_offset_reset=self._auto_offset_reset,
+            drain_policy=self._partition_drain_policy)
 
         if self._group_id is not None:
             # using group coordinator for automatic partitions assignment
@@ -252,7 +344,10 @@ class AIOKafkaConsumer(object):
                 enable_auto_commit=self._enable_auto_commit,
                 auto_commit_interval_ms=self._auto_commit_interval_ms,
                 assignors=self._partition_assignment_strategy,
-                exclude_internal_topics=self._exclude_internal_topics)
+                exclude_internal_topics=self._exclude_internal_topics,
+                offset_store=self._offset_store,
+                group_instance_id=self._group_instance_id,
+                on_fatal_error=self._fetcher.abort)
             # In case we provided topics to constructor we better wait for
             # initial group join
             if self._subscription.subscription is not None:
@@ -269,6 +364,15 @@ class AIOKafkaConsumer(object):
                 yield from self._client.force_metadata_update()
                 self._coordinator.assign_all_partitions(check_unknown=True)
 
+    def _check_offsets_by_time_support(self, api_name):
+        # Lookup by timestamp was added in ListOffsets v1
+        try:
+            self._client.pick_version(OffsetRequest[0].API_KEY, (1, 1))
+        except UnsupportedVersionError:
+            raise UnsupportedVersionError(
+                "{} API not supported for cluster version {}".format(
+                    api_name, self._client.api_version))
+
     @asyncio.coroutine
     def _wait_topics(self):
         if self._subscription.subscription is not None:
@@ -347,12 +451,11 @@ class AIOKafkaConsumer(object):
     def commit(self, offsets=None):
         """ Commit offsets to Kafka.
 
-        This commits offsets only to Kafka. The offsets committed using this
-        API will be used on the first fetch after every rebalance and also on
-        startup. As such, if you need to store offsets in anything other than
-        Kafka, this API should not be used.
-
-        Currently only supports kafka-topic offset storage (not zookeeper)
+        This commits offsets to the configured ``offset_store``, Kafka by
+        default. The offsets committed using this API will be used on the
+        first fetch after every rebalance and also on startup. To store
+        offsets in anything other than Kafka, pass a custom
+        ``AbstractOffsetStore`` implementation as ``offset_store``.
 
         When explicitly passing ``offsets`` use either offset of next record,
         or tuple of offset and metadata::
@@ -364,11 +467,11 @@ class AIOKafkaConsumer(object):
             # Or position directly
             await consumer.commit({tp: (msg.offset + 1, metadata)})
 
-        .. note:: If you want `fire and forget` commit, like ``commit_async()``
-            in *kafka-python*, just run it in a task. Something like::
+        Calls made while another commit is in progress are merged into a
+        single request, that holds the highest offset of each partition.
 
-                fut = loop.create_task(consumer.commit())
-                fut.add_done_callback(on_commit_done)
+        .. note:: If you want `fire and forget` commit, like ``commit_async()``
+            in *kafka-python*, use :meth:`commit_nowait`.
 
         Arguments:
             offsets (dict, optional): {TopicPartition: (offset, metadata)} dict
@@ -392,6 +495,33 @@ class AIOKafkaConsumer(object):
             Will now raise ``CommitFailedError`` in case membership changed,
             as (posibly) this partition is handled by another consumer.
         """
+        assignment, offsets = self._prepare_commit(offsets)
+        yield from self._coordinator.commit_offsets(assignment, offsets)
+
+    def commit_nowait(self, offsets=None):
+        """ Start committing offsets to Kafka without waiting for the result.
+        Takes the same ``offsets`` as :meth:`commit`. Commit errors are
+        logged, but can also be retrieved from the returned future.
+
+        Returns:
+            asyncio.Future: resolved once the offsets are committed.
+        Raises:
+            IllegalOperation: If used with ``group_id == None``.
+            IllegalStateError: If partitions not assigned.
+            ValueError: If offsets is of wrong format.
+        """
+        assignment, offsets = self._prepare_commit(offsets)
+        fut = ensure_future(
+            self._coordinator.commit_offsets(assignment, offsets),
+            loop=self._loop)
+        fut.add_done_callback(self._on_commit_nowait_done)
+        return fut
+
+    def _on_commit_nowait_done(self, fut):
+        if not fut.cancelled() and fut.exception() is not None:
+            log.error("Failed to commit offsets: %r", fut.exception())
+
+    def _prepare_commit(self, offsets):
         if self._group_id is None:
             raise IllegalOperation("Requires group_id")
 
@@ -432,8 +562,7 @@ class AIOKafkaConsumer(object):
                 formatted_offsets[tp] = OffsetAndMetadata(offset, metadata)
 
             offsets = formatted_offsets
-
-        yield from self._coordinator.commit_offsets(assignment, offsets)
+        return assignment, offsets
 
     @asyncio.coroutine
     def committed(self, partition):
@@ -736,10 +865,7 @@ class AIOKafkaConsumer(object):
         .. versionadded:: 0.3.0
 
         """
-        if self._client.api_version <= (0, 10, 0):
-            raise UnsupportedVersionError(
-                "offsets_for_times API not supported for cluster version {}"
-                .format(self._client.api_version))
+        self._check_offsets_by_time_support("offsets_for_times")
         for tp, ts in timestamps.items():
             timestamps[tp] = int(ts)
             if ts < 0:
@@ -776,10 +902,7 @@ class AIOKafkaConsumer(object):
         .. versionadded:: 0.3.0
 
         """
-        if self._client.api_version <= (0, 10, 0):
-            raise UnsupportedVersionError(
-                "offsets_for_times API not supported for cluster version {}"
-                .format(self._client.api_version))
+        self._check_offsets_by_time_support("beginning_offsets")
         offsets = yield from self._fetcher.beginning_offsets(
             partitions, self._request_timeout_ms)
         return offsets
@@ -812,10 +935,7 @@ class AIOKafkaConsumer(object):
         .. versionadded:: 0.3.0
 
         """
-        if self._client.api_version <= (0, 10, 0):
-            raise UnsupportedVersionError(
-                "offsets_for_times API not supported for cluster version {}"
-                .format(self._client.api_version))
+        self._check_offsets_by_time_support("end_offsets")
         offsets = yield from self._fetcher.end_offsets(
             partitions, self._request_timeout_ms)
         return offsets
@@ -0,0 +1,183 @@
+import abc
+import collections
+import heapq
+import itertools
+
+
+class AbstractDrainPolicy(metaclass=abc.ABCMeta):
+    """ Queue of partitions with buffered data, that decides in which order
+    the Fetcher returns records of different partitions from ``getone()`` and
+    ``getmany()`` calls.
+
+    The Fetcher pushes a partition once a fetch response for it is buffered
+    and pushes it again if it was served, but still has buffered records.
+    A partition is never pushed twice without a ``pop()`` or ``remove()`` in
+    between.
+
+    Note:
+        The policy keeps per-consumer state, so do not share one instance
+        between several consumers.
+    """
+
+    @abc.abstractmethod
+    def push(self, tp, assignment):
+        """ Add a partition with buffered data to the queue.
+
+        Arguments:
+            tp (TopicPartition): partition with buffered data.
+            assignment (Assignment or None): current assignment, can be used
+                to look up positions and highwater marks.
+        """
+        pass
+
+    @abc.abstractmethod
+    def pop(self):
+        """ Remove and return the next partition to drain.
+
+        Raises:
+            IndexError: if the queue is empty.
+        """
+        pass
+
+    @abc.abstractmethod
+    def remove(self, tp):
+        """ Remove a queued partition. Called if buffered data of the
+        partition is dropped, for example on seek.
+        """
+        pass
+
+    @abc.abstractmethod
+    def clear(self):
+        """ Remove all partitions from the queue. Called on assignment
+        change.
+        """
+        pass
+
+    @abc.abstractmethod
+    def __len__(self):
+        pass
+
+
+class RoundRobinDrainPolicy(AbstractDrainPolicy):
+    """ Drain partitions one after another. A partition, that was served on
+    the last call, goes to the end of the queue, so with ``max_records`` set
+    each partition with buffered data is served at least once every N calls,
+    where N is the number of such partitions.
+    """
+
+    def __init__(self):
+        self._queue = collections.deque()
+
+    def push(self, tp, assignment):
+        self._queue.append(tp)
+
+    def pop(self):
+        return self._queue.popleft()
+
+    def remove(self, tp):
+        self._queue.remove(tp)
+
+    def clear(self):
+        self._queue.clear()
+
+    def __len__(self):
+        return len(self._queue)
+
+
+class _HeapDrainPolicy(AbstractDrainPolicy):
+    """ Base for policies that drain partitions with the highest weight
+    first. Partitions with equal weight are drained in round-robin order.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        # tp => heap entry. Removed entries stay in the heap with ``None``
+        # instead of the partition and are skipped on ``pop()``.
+        self._entries = {}
+
+    @abc.abstractmethod
+    def _weight(self, tp, assignment):
+        """ Return the drain weight of a partition, higher goes first. """
+        pass
+
+    def push(self, tp, assignment):
+        entry = [-self._weight(tp, assignment), next(self._counter), tp]
+        self._entries[tp] = entry
+        heapq.heappush(self._heap, entry)
+
+    def pop(self):
+        while True:
+            tp = heapq.heappop(self._heap)[-1]
+            if tp is not None:
+                del self._entries[tp]
+                return tp
+
+    def remove(self, tp):
+        entry = self._entries.pop(tp)
+        entry[-1] = None
+
+    def clear(self):
+        self._heap.clear()
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class LagWeightedDrainPolicy(_HeapDrainPolicy):
+    """ Drain partitions with the biggest lag first. Lag is calculated as
+    ``highwater - position`` at the time the partition is queued, ie. after a
+    fetch response is buffered or after the partition was partially drained.
+    Partitions with equal lag are drained in round-robin order.
+    """
+
+    def _weight(self, tp, assignment):
+        if assignment is None:
+            return 0
+        tp_state = assignment.state_value(tp)
+        if tp_state is None or tp_state.highwater is None or \
+                not tp_state.has_valid_position:
+            return 0
+        return max(0, tp_state.highwater - tp_state.position)
+
+
+class PriorityDrainPolicy(_HeapDrainPolicy):
+    """ Drain partitions with higher user-defined priority first. Partitions
+    with equal priority are drained in round-robin order.
+
+    Note:
+        Partitions with lower priority will only be served if higher priority
+        partitions have no buffered data left.
+
+    Arguments:
+        priorities (dict or callable): either a mapping of
+            ``TopicPartition`` or topic name to an integer priority, or a
+            callable, that takes a ``TopicPartition`` and returns the
+            priority. Higher values are drained first.
+        default (int): priority of partitions not found in ``priorities``
+            mapping. Default: 0
+    """
+
+    def __init__(self, priorities, *, default=0):
+        super().__init__()
+        if callable(priorities):
+            self._priority = priorities
+        else:
+            priorities = dict(priorities)
+
+            def _priority(tp):
+                try:
+                    return priorities[tp]
+                except KeyError:
+                    return priorities.get(tp.topic, default)
+            self._priority = _priority
+
+    def _weight(self, tp, assignment):
+        return self._priority(tp)
+
+
+__all__ = [
+    "AbstractDrainPolicy", "RoundRobinDrainPolicy", "LagWeightedDrainPolicy",
+    "PriorityDrainPolicy"
+]
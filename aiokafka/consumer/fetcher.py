@@ -1,11 +1,13 @@
 import asyncio
 import collections
+import itertools
 import logging
 import random
-from itertools import chain
 
 from kafka.protocol.offset import OffsetRequest
 
+from aiokafka.client import ConnectionGroup
+from aiokafka.consumer.drain_policy import RoundRobinDrainPolicy
 from aiokafka.consumer.fetch import FetchRequest
 import aiokafka.errors as Errors
 from aiokafka.errors import (
@@ -18,6 +20,10 @@ log = logging.getLogger(__name__)
 
 UNKNOWN_OFFSET = -1
 
+# Fetch v3 limit of the whole response. Set to the max, so only
+# `max_partition_fetch_bytes` limits responses, like in older versions.
+_FETCH_MAX_BYTES = 2 ** 31 - 1
+
 
 class OffsetResetStrategy:
     LATEST = -1
@@ -61,7 +67,9 @@ class FetchResult:
         self._backoff = backoff
         self._loop = loop
 
-        self._assignment = assignment
+        # State may move over to the next assignment, if the partition stays
+        # assigned after rebalance
+        self._tp_state = assignment.state_value(tp)
         # There are cases where the returned offset from broker differs from
         # what was requested. This would not be much of an issue if the user
         # could not seek to a different position between yielding results,
@@ -75,11 +83,10 @@ class FetchResult:
         return 0
 
     def check_assignment(self, tp):
-        assignment = self._assignment
+        tp_state = self._tp_state
         return_result = True
-        if assignment.active:
-            tp = self._topic_partition
-            position = assignment.state_value(tp).position
+        if tp_state.assignment.active:
+            position = tp_state.position
             if position != self._expected_position:
                 return_result = False
         else:
@@ -96,8 +103,7 @@ class FetchResult:
 
     def _consume_offset(self, offset):
         position = self._expected_position = offset + 1
-        state = self._assignment.state_value(self._topic_partition)
-        state.consumed_to(position)
+        self._tp_state.consumed_to(position)
 
     def getone(self):
         tp = self._topic_partition
@@ -175,7 +181,38 @@ class FetchError:
         return "<FetchError error={!r}>".format(self._error)
 
 
+class _NodeFetchState:
+    """ Partitions led by a single node and a waiter to wake up the node's
+    fetch routine.
+    """
+
+    def __init__(self, node_id, *, loop):
+        self.node_id = node_id
+        self.tps = set()
+        self.task = None
+        self.closed = False
+        # Loop time until which the broker asked us to hold off fetching
+        self.throttled_until = 0
+        self._loop = loop
+        self.waiter = create_future(loop=loop)
+
+    def reset_waiter(self):
+        if self.waiter.done():
+            self.waiter = create_future(loop=self._loop)
+
+    def wakeup(self):
+        if not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def close(self):
+        self.closed = True
+        self.wakeup()
+
+
 class Fetcher:
+    # Number of records unpacked per timed span if a watchdog is set
+    _WATCHED_CHUNK_SIZE = 100
+
     def __init__(self, client, subscriptions, *, loop,
                  key_deserializer=None,
                  value_deserializer=None,
@@ -186,7 +223,8 @@ class Fetcher:
                  fetcher_timeout=0.2,
                  prefetch_backoff=0.1,
                  retry_backoff_ms=100,
-                 auto_offset_reset='latest'):
+                 auto_offset_reset='latest',
+                 drain_policy=None):
         """Initialize a Kafka Message Fetcher.
 
         Parameters:
@@ -226,6 +264,9 @@ class Fetcher:
                 OffsetOutOfRange errors: 'earliest' will move to the oldest
                 available message, 'latest' will move to the most recent. Any
                 ofther value will raise the exception. Default: 'latest'.
+            drain_policy (AbstractDrainPolicy): defines the order in which
+                buffered data of different partitions is returned to the user.
+                Default: RoundRobinDrainPolicy()
         """
         self._client = client
         self._loop = loop
@@ -241,25 +282,80 @@ class Fetcher:
         self._subscriptions = subscriptions
         self._default_reset_strategy = OffsetResetStrategy.from_str(
             auto_offset_reset)
+        if drain_policy is None:
+            drain_policy = RoundRobinDrainPolicy()
+        self._drain_policy = drain_policy
+
+        self._records = {}
+        # Partitions with buffered data in ``self._records`` in drain order.
+        # ``_queued`` tracks partitions in the drain policy to avoid
+        # duplicates. Dropped data removes the partition from both, so it is
+        # queued again with fresh weight once new data is buffered.
+        self._queued = set()
+
+        # Assignment, that node fetch routines are started for
+        self._assignment = None
+        # Fetch state per leader node, only nodes leading at least 1 assigned
+        # partition are present.
+        self._nodes = {}
+        self._tp_nodes = {}
+        # Removed nodes, which tasks are cancelled, but not finished yet
+        self._closing_nodes = set()
+        self._no_leader_tps = set()
 
-        self._records = collections.OrderedDict()
-        self._in_flight = set()
-        self._pending_tasks = set()
-
-        self._wait_consume_future = None
         self._fetch_waiters = set()
 
-        req_version = 2 if client.api_version >= (0, 10) else 1
-        self._fetch_request_class = FetchRequest[req_version]
-
         self._fetch_task = ensure_future(
             self._fetch_requests_routine(), loop=loop)
+        client.cluster.add_listener(self._handle_metadata_update)
+
+        metrics = self._metrics = client.metrics
+        self._fetch_latency_sensor = metrics.histogram(
+            "aiokafka_consumer_fetch_latency_seconds",
+            "Time to send a fetch request and receive the response")
+        self._fetch_bytes_sensor = metrics.counter(
+            "aiokafka_consumer_fetch_bytes_total", "Bytes of fetched records")
+        self._records_sensor = metrics.counter(
+            "aiokafka_consumer_records_total", "Records returned to the user")
+        self._record_rate_sensor = metrics.rate(
+            "aiokafka_consumer_records_consumed_rate",
+            "Records returned to the user per second")
+        self._fetch_throttle_sensor = metrics.histogram(
+            "aiokafka_consumer_fetch_throttle_time_seconds",
+            "Time fetch requests were throttled by the broker due to quotas")
+        metrics.gauge(
+            "aiokafka_consumer_records_lag_max", self._records_lag_max,
+            "Maximum lag in records over assigned partitions")
 
         self._closed = False
+        # Error, that stopped fetching for good, see ``abort()``
+        self._fatal_error = None
+
+    def abort(self, err):
+        """ Stop fetching, as the consumer can not continue. Pending and
+        further ``next_record()`` and ``fetched_records()`` calls will raise
+        ``err``.
+        """
+        self._fatal_error = err
+        self._assignment = None
+        self._fetch_task.cancel()
+        # Node routines are awaited in ``close()``
+        for node in self._nodes.values():
+            node.close()
+            node.task.cancel()
+            self._closing_nodes.add(node)
+            node.task.add_done_callback(
+                lambda _, node=node: self._closing_nodes.discard(node))
+        self._nodes.clear()
+        self._tp_nodes.clear()
+        for waiter in self._fetch_waiters:
+            self._notify(waiter)
 
     @asyncio.coroutine
     def close(self):
         self._closed = True
+        self._client.cluster.remove_listener(self._handle_metadata_update)
+        self._client.metrics.remove("aiokafka_consumer_records_lag_max")
 
         self._fetch_task.cancel()
         try:
@@ -271,14 +367,26 @@ class Fetcher:
         for waiter in self._fetch_waiters:
             self._notify(waiter)
 
-        for x in self._pending_tasks:
-            x.cancel()
-            yield from x
+        yield from self._stop_node_routines()
 
     def _notify(self, future):
         if future is not None and not future.done():
             future.set_result(None)
 
+    def _records_lag_max(self):
+        assignment = self._assignment
+        if assignment is None or not assignment.active:
+            return None
+        lag = None
+        for tp in assignment.tps:
+            tp_state = assignment.state_value(tp)
+            if tp_state.highwater is None or not tp_state.has_valid_position:
+                continue
+            tp_lag = max(0, tp_state.highwater - tp_state.position)
+            if lag is None or tp_lag > lag:
+                lag = tp_lag
+        return lag
+
     def _create_fetch_waiter(self):
         fut = create_future(loop=self._loop)
         self._fetch_waiters.add(fut)
@@ -293,10 +401,10 @@ class Fetcher:
         ``getall/getone`` calls from actual calls to broker. This way we don't
         need to think of what happens if user calls get in 2 tasks, etc.
 
-            The loop is quite complicated due to a large set of events that
-        can allow new fetches to be send. Those include previous fetches,
-        offset resets, metadata updates to discover new leaders for partitions,
-        data consumed for partition.
+            Fetching itself is done by a separate task per leader node (see
+        ``_node_fetch_routine``), so this routine only tracks assignment
+        changes and refreshes metadata for partitions without a known leader.
+        Leader changes are applied incrementally from a metadata listener.
 
             Previously the offset reset was performed separately, but it did
         not perform too reliably. In ``kafka-python`` and Java client the reset
@@ -306,158 +414,254 @@ class Fetcher:
         """
         try:
             assignment = None
-
-            def start_pending_task(coro, node_id, self=self):
-                task = ensure_future(coro, loop=self._loop)
-                self._pending_tasks.add(task)
-                self._in_flight.add(node_id)
-
-                def on_done(fut, self=self):
-                    self._in_flight.discard(node_id)
-                task.add_done_callback(on_done)
-
             while True:
-                # If we lose assignment we just cancel all current tasks,
-                # wait for new assignment and restart the loop
+                # If we lose assignment, node tasks idle until the new one
+                # arrives. They are not restarted, so fetches in progress are
+                # kept for partitions, that stay assigned.
                 if assignment is None or not assignment.active:
-                    for task in self._pending_tasks:
-                        # Those tasks should have proper handling for
-                        # cancellation
-                        if not task.done():
-                            task.cancel()
-                        yield from task
-                    self._pending_tasks.clear()
-                    self._records.clear()
+                    self._assignment = None
 
                     subscription = self._subscriptions.subscription
                     if subscription is None or \
                             subscription.assignment is None:
                         yield from self._subscriptions.wait_for_assignment()
                     assignment = self._subscriptions.subscription.assignment
+                    self._assignment = assignment
+                    self._retain_buffered(assignment)
+                    self._update_leaders()
+                    for node in self._nodes.values():
+                        node.wakeup()
                 assert assignment is not None and assignment.active
 
-                # Reset consuming signal future.
-                self._wait_consume_future = create_future(loop=self._loop)
-                # Determine what action to take per node
-                fetch_requests, reset_requests, timeout, invalid_metadata = \
-                    self._get_actions_per_node(assignment)
-                # Start fetch tasks
-                for node_id, request in fetch_requests:
-                    start_pending_task(
-                        self._proc_fetch_request(assignment, node_id, request),
-                        node_id=node_id)
-                # Start update position tasks
-                for node_id, tps in reset_requests.items():
-                    start_pending_task(
-                        self._update_fetch_positions(assignment, node_id, tps),
-                        node_id=node_id)
-                # Apart from pending requests we also need to react to other
-                # events to send new fetches as soon as possible
-                other_futs = [self._wait_consume_future,
-                              assignment.unassign_future]
-                if invalid_metadata:
-                    fut = self._client.force_metadata_update()
-                    other_futs.append(fut)
-
-                done_set, _ = yield from asyncio.wait(
-                    chain(self._pending_tasks, other_futs),
-                    loop=self._loop,
-                    timeout=timeout,
-                    return_when=asyncio.FIRST_COMPLETED)
-
-                # Process fetch tasks results if any
-                done_pending = self._pending_tasks.intersection(done_set)
-                if done_pending:
-                    has_new_data = any(fut.result() for fut in done_pending)
-                    if has_new_data:
-                        for waiter in self._fetch_waiters:
-                            # we added some messages to self._records,
-                            # wake up waiters
-                            self._notify(waiter)
-                    self._pending_tasks -= done_pending
+                futs = [assignment.unassign_future]
+                if self._no_leader_tps:
+                    log.debug("No leader found for partitions %s."
+                              " Waiting metadata update", self._no_leader_tps)
+                    futs.append(self._client.force_metadata_update(
+                        {tp.topic for tp in self._no_leader_tps}))
+                yield from asyncio.wait(
+                    futs, loop=self._loop, return_when=asyncio.FIRST_COMPLETED)
         except asyncio.CancelledError:
             pass
         except Exception:  # pragma: no cover
             log.error("Unexpected error in fetcher routine", exc_info=True)
 
-    def _get_actions_per_node(self, assignment):
-        """ For each assigned partition determine the action needed to be
-        performed and group those by leader node id.
+    def _retain_buffered(self, assignment):
+        """ Drop buffered data of the previous assignment, except records of
+        partitions, which states were moved over to ``assignment``. Those are
+        returned without fetching them again.
         """
-        # create the fetch info as a dict of lists of partition info tuples
-        # which can be passed to FetchRequest() via .items()
-        fetchable = collections.defaultdict(list)
-        awaiting_reset = collections.defaultdict(list)
-        backoff_by_nodes = collections.defaultdict(list)
-        invalid_metadata = False
-
+        retained = []
+        for tp, res_or_error in list(self._records.items()):
+            if type(res_or_error) == FetchResult and \
+                    res_or_error._tp_state is assignment.state_value(tp):
+                retained.append(tp)
+            else:
+                del self._records[tp]
+        self._queued.clear()
+        self._drain_policy.clear()
+        for tp in retained:
+            self._mark_ready(tp)
+        if retained:
+            log.debug("Retained buffered records of partitions %s after"
+                      " rebalance", retained)
+
+    def _handle_metadata_update(self, cluster):
+        if self._assignment is not None and self._assignment.active:
+            self._update_leaders()
+
+    def _update_leaders(self):
+        """ Move assigned partitions between per-node fetch states according to
+        current cluster metadata. Only nodes, that gained or lost partitions,
+        are woken up.
+        """
+        assignment = self._assignment
+        cluster = self._client.cluster
+        # Partitions, that are no longer assigned, are dropped
+        for tp in list(self._tp_nodes):
+            if tp not in assignment.tps:
+                node = self._tp_nodes.pop(tp)
+                node.tps.discard(tp)
+                node.wakeup()
+
+        no_leader_tps = set()
         for tp in assignment.tps:
-            tp_state = assignment.state_value(tp)
-            node_id = self._client.cluster.leader_for_partition(tp)
-            backoff = 0
+            node_id = cluster.leader_for_partition(tp)
+            if node_id == -1:
+                node_id = None
+            if node_id is None:
+                no_leader_tps.add(tp)
+
+            old_node = self._tp_nodes.get(tp)
+            if old_node is not None:
+                if old_node.node_id == node_id:
+                    continue
+                old_node.tps.discard(tp)
+                old_node.wakeup()
+                del self._tp_nodes[tp]
+            if node_id is not None:
+                node = self._nodes.get(node_id)
+                if node is None:
+                    node = self._nodes[node_id] = _NodeFetchState(
+                        node_id, loop=self._loop)
+                    node.task = ensure_future(
+                        self._node_fetch_routine(node),
+                        loop=self._loop)
+                node.tps.add(tp)
+                node.wakeup()
+                self._tp_nodes[tp] = node
+        self._no_leader_tps = no_leader_tps
+
+        # Nodes, that don't lead any of our partitions anymore, are stopped.
+        # The result of their current request (if any) is of no interest, as
+        # partitions are fetched from the new leaders.
+        for node_id, node in list(self._nodes.items()):
+            if not node.tps:
+                node.close()
+                node.task.cancel()
+                del self._nodes[node_id]
+                self._closing_nodes.add(node)
+                node.task.add_done_callback(
+                    lambda _, node=node: self._closing_nodes.discard(node))
+
+    @asyncio.coroutine
+    def _stop_node_routines(self):
+        nodes = list(self._nodes.values()) + list(self._closing_nodes)
+        self._nodes.clear()
+        self._tp_nodes.clear()
+        self._no_leader_tps = set()
+        for node in nodes:
+            node.close()
+            # Requests should have proper handling for cancellation
+            node.task.cancel()
+        if nodes:
+            yield from asyncio.wait(
+                [node.task for node in nodes], loop=self._loop)
+
+    def _wakeup_node(self, tp):
+        """ Called if partition became fetchable, ie. buffered data was
+        consumed or position changed.
+        """
+        node = self._tp_nodes.get(tp)
+        if node is not None:
+            node.wakeup()
+
+    @asyncio.coroutine
+    def _node_fetch_routine(self, node):
+        """ Background task, that sends fetch and offset reset requests to a
+        single leader node. It only wakes up if the node's partition set has
+        changed, one of it's partitions was consumed or sought, or a
+        prefetch backoff has passed. The task outlives assignment changes as
+        long as the node leads any of the assigned partitions.
+        """
+        node_id = node.node_id
+        try:
+            while not node.closed:
+                # Any event after this point will trigger another iteration
+                node.reset_waiter()
+                assignment = self._assignment
+                if assignment is None or not assignment.active:
+                    # Woken up once the new assignment arrives
+                    yield from asyncio.wait([node.waiter], loop=self._loop)
+                    continue
+                request, reset_tps, timeout = \
+                    self._get_node_actions(assignment, node)
+                if reset_tps:
+                    has_new_data = yield from self._update_fetch_positions(
+                        assignment, node_id, reset_tps)
+                elif request is not None:
+                    has_new_data = yield from self._proc_fetch_request(
+                        assignment, node_id, request)
+                else:
+                    yield from asyncio.wait(
+                        [node.waiter], timeout=timeout, loop=self._loop)
+                    continue
+
+                if has_new_data:
+                    for waiter in self._fetch_waiters:
+                        # we added some messages to self._records,
+                        # wake up waiters
+                        self._notify(waiter)
+        except asyncio.CancelledError:
+            pass
+        except Exception:  # pragma: no cover
+            log.error("Unexpected error in fetcher routine for node %s",
+                      node_id, exc_info=True)
+
+    def _get_node_actions(self, assignment, node):
+        """ Determine the action needed to be performed for partitions led by
+        a node. Returns a tuple of fetch request (or None), list of
+        partitions awaiting reset and the time to wait until next check if
+        there's nothing to do.
+        """
+        fetchable = []
+        awaiting_reset = []
+        backoff = 0
+
+        for tp in node.tps:
             if tp in self._records:
                 # We have data still not consumed by user. In this case we
                 # usually wait for the user to finish consumption, but to avoid
                 # blocking other partitions we have a timeout here.
-                record = self._records[tp]
-                backoff = record.calculate_backoff()
-                if backoff:
-                    backoff_by_nodes[node_id].append(backoff)
-            elif node_id in self._in_flight:
-                # We have in-flight fetches to this node
+                backoff = max(backoff, self._records[tp].calculate_backoff())
                 continue
-            elif node_id is None or node_id == -1:
-                log.debug("No leader found for partition %s."
-                          " Waiting metadata update", tp)
-                invalid_metadata = True
-            elif not tp_state.has_valid_position:
-                awaiting_reset[node_id].append(tp)
+            tp_state = assignment.state_value(tp)
+            if not tp_state.has_valid_position:
+                awaiting_reset.append(tp)
             else:
-                position = tp_state.position
-                fetchable[node_id].append((tp, position))
-                log.debug(
-                    "Adding fetch request for partition %s at offset %d",
-                    tp, position)
-
-        fetch_requests = []
-        for node_id, partition_data in fetchable.items():
-            if node_id in backoff_by_nodes:
-                # At least one partition is still waiting to be consumed
-                continue
-            if node_id in awaiting_reset:
-                # First we need to reset offset for some partitions, then we
-                # will fetch next page of results
-                continue
-
-            # Shuffle partition data to help get more equal consumption
-            random.shuffle(partition_data)  # shuffle topics
-            # Create fetch request
-            by_topics = collections.defaultdict(list)
-            for tp, position in partition_data:
-                by_topics[tp.topic].append((
-                    tp.partition,
-                    position,
-                    self._max_partition_fetch_bytes))
-            req = self._fetch_request_class(
+                fetchable.append((tp, tp_state.position))
+
+        if awaiting_reset:
+            # First we need to reset offset for some partitions, then we
+            # will fetch next page of results
+            return None, awaiting_reset, None
+        if backoff:
+            # At least one partition is still waiting to be consumed
+            return None, [], backoff
+        if not fetchable:
+            return None, [], self._fetcher_timeout
+        throttle = node.throttled_until - self._loop.time()
+        if throttle > 0:
+            # Broker asked us to back off due to quota violation
+            return None, [], throttle
+
+        # Shuffle partition data to help get more equal consumption
+        random.shuffle(fetchable)
+        # Create fetch request
+        by_topics = collections.defaultdict(list)
+        for tp, position in fetchable:
+            log.debug(
+                "Adding fetch request for partition %s at offset %d",
+                tp, position)
+            by_topics[tp.topic].append((
+                tp.partition,
+                position,
+                self._max_partition_fetch_bytes))
+        # Versions 4+ require message format v2
+        version = self._client.pick_version(
+            FetchRequest[0].API_KEY, (0, 3), node.node_id)
+        if version >= 3:
+            req = FetchRequest[version](
                 -1,  # replica_id
                 self._fetch_max_wait_ms,
                 self._fetch_min_bytes,
+                _FETCH_MAX_BYTES,
                 list(by_topics.items()))
-            fetch_requests.append((node_id, req))
-
-        if backoff_by_nodes:
-            # Return min time till any node will be ready to send event
-            # (max of it's backoffs)
-            backoff = min(map(max, backoff_by_nodes.values()))
         else:
-            backoff = self._fetcher_timeout
-        return fetch_requests, awaiting_reset, backoff, invalid_metadata
+            req = FetchRequest[version](
+                -1,  # replica_id
+                self._fetch_max_wait_ms,
+                self._fetch_min_bytes,
+                list(by_topics.items()))
+        return req, [], None
 
     @asyncio.coroutine
     def _proc_fetch_request(self, assignment, node_id, request):
         needs_wakeup = False
+        t0 = self._loop.time()
         try:
-            response = yield from self._client.send(node_id, request)
+            response = yield from self._client.send(
+                node_id, request, group=ConnectionGroup.FETCH)
         except Errors.KafkaError as err:
             log.error("Failed fetch messages from %s: %s", node_id, err)
             return False
@@ -465,12 +669,19 @@ class Fetcher:
             # Either `close()` or partition unassigned. Either way the result
             # is no longer of interest.
             return False
+        self._fetch_latency_sensor.record(self._loop.time() - t0)
+        if response.API_VERSION >= 1:
+            self._handle_throttle(node_id, response.throttle_time_ms)
 
         if not assignment.active:
-            log.debug(
-                "Discarding fetch response since the assignment changed during"
-                " fetch")
-            return False
+            # Partitions, that stay assigned, keep their states, so their data
+            # is still used if the fetch offset matches the current position
+            assignment = self._assignment
+            if assignment is None or not assignment.active:
+                log.debug(
+                    "Discarding fetch response since the assignment changed"
+                    " during fetch")
+                return False
 
         fetch_offsets = {}
         for topic, partitions in request.topics:
@@ -482,6 +693,8 @@ class Fetcher:
                 tp = TopicPartition(topic, partition)
                 error_type = Errors.for_code(error_code)
                 fetch_offset = fetch_offsets[tp]
+                if tp not in assignment.tps:
+                    continue
                 tp_state = assignment.state_value(tp)
                 if not tp_state.has_valid_position or \
                         tp_state.position != fetch_offset:
@@ -495,6 +708,7 @@ class Fetcher:
                     tp_state.highwater = highwater
 
                     records = MemoryRecords(raw_batch)
+                    self._fetch_bytes_sensor.inc(records.size_in_bytes())
                     if records.has_next():
                         log.debug(
                             "Adding fetched record for partition %s with"
@@ -502,12 +716,12 @@ class Fetcher:
                             tp, fetch_offset)
 
                         message_iterator = self._unpack_records(tp, records)
-                        self._records[tp] = FetchResult(
+                        self._add_buffered(tp, FetchResult(
                             tp, message_iterator=message_iterator,
                             assignment=assignment,
                             backoff=self._prefetch_backoff,
                             fetch_offset=fetch_offset,
-                            loop=self._loop)
+                            loop=self._loop))
 
                         # We added at least 1 successful record
                         needs_wakeup = True
@@ -528,7 +742,7 @@ class Fetcher:
 
                 elif error_type in (Errors.NotLeaderForPartitionError,
                                     Errors.UnknownTopicOrPartitionError):
-                    self._client.force_metadata_update()
+                    self._client.force_metadata_update([tp.topic])
                 elif error_type is Errors.OffsetOutOfRangeError:
                     if self._default_reset_strategy != \
                             OffsetResetStrategy.NONE:
@@ -550,10 +764,79 @@ class Fetcher:
                              error_type.__name__)
         return needs_wakeup
 
+    def _handle_throttle(self, node_id, throttle_time_ms):
+        """ Delay the next fetch request to the node if the broker throttled
+        the response due to a quota violation.
+        """
+        if throttle_time_ms <= 0:
+            return
+        throttle = throttle_time_ms / 1000
+        self._fetch_throttle_sensor.record(throttle)
+        log.info(
+            "Fetch request to node %s was throttled by %d ms",
+            node_id, throttle_time_ms)
+        node = self._nodes.get(node_id)
+        if node is not None:
+            node.throttled_until = self._loop.time() + throttle
+
     def _set_error(self, tp, error):
         assert tp not in self._records, self._records[tp]
-        self._records[tp] = FetchError(
-            error=error, backoff=self._prefetch_backoff, loop=self._loop)
+        self._add_buffered(tp, FetchError(
+            error=error, backoff=self._prefetch_backoff, loop=self._loop))
+
+    def _add_buffered(self, tp, res_or_error):
+        self._records[tp] = res_or_error
+        self._mark_ready(tp)
+
+    def _drop_buffered(self, tp):
+        """ Remove buffered data (if any) and let the leader node fetch the
+        partition again.
+        """
+        self._records.pop(tp, None)
+        if tp in self._queued:
+            self._queued.discard(tp)
+            self._drain_policy.remove(tp)
+        self._wakeup_node(tp)
+
+    def _mark_ready(self, tp):
+        """ Put partition into the ready queue, unless it's already there.
+        """
+        if tp not in self._queued:
+            self._queued.add(tp)
+            subscription = self._subscriptions.subscription
+            if subscription is not None:
+                assignment = subscription.assignment
+            else:
+                assignment = None
+            self._drain_policy.push(tp, assignment)
+
+    def _pop_ready(self):
+        """ Return the next partition with buffered data or None. Entries of
+        partitions, that were removed from ``self._records`` (by seek, drain,
+        etc.) are skipped here.
+        """
+        drain_policy = self._drain_policy
+        while len(drain_policy):
+            tp = drain_policy.pop()
+            self._queued.discard(tp)
+            if tp in self._records:
+                return tp
+        return None
+
+    def _ready_partitions(self, partitions):
+        """ Yield partitions with buffered data in drain order. If
+        ``partitions`` are given, only those are checked without touching the
+        ready queue.
+        """
+        if partitions:
+            for tp in partitions:
+                if tp in self._records:
+                    yield tp
+        else:
+            tp = self._pop_ready()
+            while tp is not None:
+                yield tp
+                tp = self._pop_ready()
 
     @asyncio.coroutine
     def _update_fetch_positions(self, assignment, node_id, tps):
@@ -575,9 +858,15 @@ class Fetcher:
             # None means the Coordinator has yet to update the offset
             if committed is None:
                 try:
-                    yield from tp_state.wait_for_committed()
+                    yield from asyncio.wait(
+                        [tp_state.wait_for_committed(),
+                         assignment.unassign_future],
+                        return_when=asyncio.FIRST_COMPLETED, loop=self._loop)
                 except asyncio.CancelledError:
                     return needs_wakeup
+                # Node task is not stopped if assignment changes
+                if not assignment.active:
+                    return needs_wakeup
                 committed = tp_state.committed
             assert committed is not None
 
@@ -674,7 +963,8 @@ class Fetcher:
                 if not error.retriable:
                     raise error
                 if error.invalid_metadata:
-                    self._client.force_metadata_update()
+                    self._client.force_metadata_update(
+                        {tp.topic for tp in timestamps})
                 elapsed = self._loop.time() - start_time
                 remaining = max(0, remaining - elapsed)
                 if remaining < self._retry_backoff:
@@ -735,13 +1025,12 @@ class Fetcher:
 
     @asyncio.coroutine
     def _proc_offset_request(self, node_id, topic_data):
-        if self._client.api_version < (0, 10, 1):
-            version = 0
+        version = self._client.pick_version(
+            OffsetRequest[0].API_KEY, (0, 1), node_id)
+        if version == 0:
             # Version 0 had another field `max_offsets`, set it to `1`
             for topic, part_data in topic_data.items():
                 topic_data[topic] = [(part, ts, 1) for part, ts in part_data]
-        else:
-            version = 1
         request = OffsetRequest[version](-1, list(topic_data.items()))
 
         response = yield from self._client.send(node_id, request)
@@ -810,6 +1099,8 @@ class Fetcher:
         while True:
             if self._closed:
                 raise ConsumerStoppedError()
+            if self._fatal_error is not None:
+                raise self._fatal_error
 
             # While the background routine will fetch new records up till new
             # assignment is finished, we don't want to return records, that may
@@ -817,25 +1108,23 @@ class Fetcher:
             if self._subscriptions.reassignment_in_progress:
                 yield from self._subscriptions.wait_for_assignment()
 
-            for tp in list(self._records.keys()):
-                if partitions and tp not in partitions:
-                    # Cleanup results for unassigned partitons
-                    if not self._subscriptions.is_assigned(tp):
-                        del self._records[tp]
-                    continue
+            for tp in self._ready_partitions(partitions):
                 res_or_error = self._records[tp]
                 if type(res_or_error) == FetchResult:
                     message = res_or_error.getone()
                     if message is None:
                         # We already processed all messages, request new ones
-                        del self._records[tp]
-                        self._notify(self._wait_consume_future)
+                        self._drop_buffered(tp)
                     else:
+                        # Let other partitions go first on the next call
+                        self._mark_ready(tp)
+                        if self._metrics.enabled:
+                            self._records_sensor.inc()
+                            self._record_rate_sensor.record()
                         return message
                 else:
                     # Remove error, so we can fetch on partition again
-                    del self._records[tp]
-                    self._notify(self._wait_consume_future)
+                    self._drop_buffered(tp)
                     res_or_error.check_raise()
 
             # No messages ready. Wait for some to arrive
@@ -847,6 +1136,9 @@ class Fetcher:
         """ Returns previously fetched records and updates consumed offsets.
         """
         while True:
+            if self._fatal_error is not None:
+                raise self._fatal_error
+
             # While the background routine will fetch new records up till new
             # assignment is finished, we don't want to return records, that may
             # not belong to this instance after rebalance.
@@ -855,22 +1147,24 @@ class Fetcher:
 
             start_time = self._loop.time()
             drained = {}
-            for tp in list(self._records.keys()):
-                if partitions and tp not in partitions:
-                    # Cleanup results for unassigned partitons
-                    if not self._subscriptions.is_assigned(tp):
-                        del self._records[tp]
-                    continue
+            for tp in self._ready_partitions(partitions):
                 res_or_error = self._records[tp]
                 if type(res_or_error) == FetchResult:
                     records = res_or_error.getall(max_records)
                     if not res_or_error.has_more():
                         # We processed all messages - request new ones
-                        del self._records[tp]
-                        self._notify(self._wait_consume_future)
+                        self._drop_buffered(tp)
+                    else:
+                        # Only possible if `max_records` limit is reached, so
+                        # this is the last iteration. Let other partitions go
+                        # first on the next call.
+                        self._mark_ready(tp)
                     if not records:
                         continue
                     drained[tp] = records
+                    if self._metrics.enabled:
+                        self._records_sensor.inc(len(records))
+                        self._record_rate_sensor.record(len(records))
                     if max_records is not None:
                         max_records -= len(drained[tp])
                         assert max_records >= 0  # Just in case
@@ -880,11 +1174,11 @@ class Fetcher:
                     # We already got some messages from another partition -
                     # return them. We will raise this error on next call
                     if drained:
+                        self._mark_ready(tp)
                         return drained
                     else:
                         # Remove error, so we can fetch on partition again
-                        del self._records[tp]
-                        self._notify(self._wait_consume_future)
+                        self._drop_buffered(tp)
                         res_or_error.check_raise()
 
             if drained or not timeout:
@@ -894,6 +1188,8 @@ class Fetcher:
             done, _ = yield from asyncio.wait(
                 [waiter], timeout=timeout, loop=self._loop)
 
+            if self._fatal_error is not None:
+                raise self._fatal_error
             if not done or self._closed:
                 return {}
 
@@ -944,12 +1240,7 @@ class Fetcher:
             tp_state.await_reset(strategy)
             waiters.append(tp_state.wait_for_position())
             # Invalidate previous fetch result
-            if tp in self._records:
-                del self._records[tp]
-
-        # XXX: Maybe we should use a different future or rename? Not really
-        # describing the purpose.
-        self._notify(self._wait_consume_future)
+            self._drop_buffered(tp)
 
         yield from asyncio.wait(
             [asyncio.gather(*waiters, loop=self._loop),
@@ -963,17 +1254,13 @@ class Fetcher:
         `Consumer.seek()` API.
         """
         self._subscriptions.seek(tp, offset)
-        if tp in self._records:
-            del self._records[tp]
-
-        # XXX: Maybe we should use a different future or rename? Not really
-        # describing the purpose.
-        self._notify(self._wait_consume_future)
+        self._drop_buffered(tp)
 
     def _unpack_records(self, tp, records):
         # NOTE: if the batch is not compressed it's equal to 1 record in
         #       v0 and v1.
-        deserialize = self._deserialize
+        watchdog = self._client.watchdog
+        consumer_record = self._consumer_record
         check_crcs = self._check_crcs
         while records.has_next():
             next_batch = records.next_batch()
@@ -981,16 +1268,38 @@ class Fetcher:
                 # This iterator will be closed after the exception, so we don't
                 # try to drain other batches here. They will be refetched.
                 raise Errors.CorruptRecordException("Invalid CRC")
-            for record in next_batch:
-                # Save encoded sizes
-                key_size = len(record.key) if record.key is not None else -1
-                value_size = \
-                    len(record.value) if record.value is not None else -1
-                key, value = deserialize(record)
-                yield ConsumerRecord(
-                    tp.topic, tp.partition, record.offset, record.timestamp,
-                    record.timestamp_type, key, value, record.checksum,
-                    key_size, value_size)
+            if watchdog is None:
+                for record in next_batch:
+                    yield consumer_record(tp, record)
+            else:
+                yield from self._unpack_batch_watched(watchdog, tp, next_batch)
+
+    def _unpack_batch_watched(self, watchdog, tp, batch):
+        # Records are unpacked in chunks to time decompression and
+        # deserialization separately, while still consuming the batch lazily
+        records = iter(batch)
+        chunk_size = self._WATCHED_CHUNK_SIZE
+        while True:
+            with watchdog.span("decompress") as span:
+                chunk = list(itertools.islice(records, chunk_size))
+                span.size = sum(
+                    len(record.value or b"") + len(record.key or b"")
+                    for record in chunk)
+            with watchdog.span("deserialize", span.size):
+                chunk = [self._consumer_record(tp, record) for record in chunk]
+            yield from chunk
+            if len(chunk) < chunk_size:
+                break
+
+    def _consumer_record(self, tp, record):
+        # Save encoded sizes
+        key_size = len(record.key) if record.key is not None else -1
+        value_size = len(record.value) if record.value is not None else -1
+        key, value = self._deserialize(record)
+        return ConsumerRecord(
+            tp.topic, tp.partition, record.offset, record.timestamp,
+            record.timestamp_type, key, value, record.checksum,
+            key_size, value_size)
 
     def _deserialize(self, msg):
         if self._key_deserializer:
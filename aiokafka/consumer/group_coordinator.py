@@ -17,6 +17,8 @@ from kafka.protocol.group import (
 import aiokafka.errors as Errors
 from aiokafka.structs import OffsetAndMetadata, TopicPartition
 from aiokafka.client import ConnectionGroup
+from aiokafka.consumer import group_protocol as GroupProtocol
+from aiokafka.consumer.offset_store import KafkaOffsetStore
 from aiokafka.util import ensure_future, create_future
 
 log = logging.getLogger(__name__)
@@ -115,7 +117,11 @@ class NoGroupCoordinator(BaseCoordinator):
 
     @asyncio.coroutine
     def close(self):
-        pass
+        # Metadata can be shared with other consumers of the client
+        try:
+            self._cluster.remove_listener(self._handle_metadata_update)
+        except KeyError:
+            pass  # Already closed
 
 
 class GroupCoordinator(BaseCoordinator):
@@ -158,7 +164,10 @@ class GroupCoordinator(BaseCoordinator):
                  retry_backoff_ms=100,
                  enable_auto_commit=True, auto_commit_interval_ms=5000,
                  assignors=(RoundRobinPartitionAssignor,),
-                 exclude_internal_topics=True
+                 exclude_internal_topics=True,
+                 offset_store=None,
+                 group_instance_id=None,
+                 on_fatal_error=None
                  ):
         """Initialize the coordination manager.
 
@@ -189,6 +198,16 @@ class GroupCoordinator(BaseCoordinator):
                 using Kafka's group managementment facilities. Default: 30000
             retry_backoff_ms (int): Milliseconds to backoff when retrying on
                 errors. Default: 100.
+            offset_store (AbstractOffsetStore): storage of committed offsets.
+                Default: KafkaOffsetStore()
+            group_instance_id (str): unique identifier of this consumer
+                instance, that makes it a static member of the group. Static
+                members do not leave the group on close and keep their
+                assignment if they rejoin within ``session_timeout_ms``.
+                Requires Kafka 2.3+. Default: None
+            on_fatal_error (callable): called with the error, that ended
+                group membership for good, like ``FencedInstanceIdError``.
+                Default: None
         """
         # Leader node will keep track of the whole group's metadata.
         self._group_subscription = None
@@ -201,13 +220,41 @@ class GroupCoordinator(BaseCoordinator):
         self._heartbeat_interval_ms = heartbeat_interval_ms
         self._retry_backoff_ms = retry_backoff_ms
         self._assignors = assignors
+        # Cooperative rebalance is used only if all assignors support it
+        self._cooperative = all(
+            getattr(assignor, "cooperative", False) for assignor in assignors)
+        # (generation, member_id) the previous assignment was received with,
+        # if it was still valid before rejoin
+        self._prepared_generation = None
         self._enable_auto_commit = enable_auto_commit
         self._auto_commit_interval_ms = auto_commit_interval_ms
 
         self.generation = OffsetCommitRequest.DEFAULT_GENERATION_ID
         self.member_id = JoinGroupRequest.UNKNOWN_MEMBER_ID
         self.group_id = group_id
+        self.group_instance_id = group_instance_id
         self.coordinator_id = None
+        # Error, that ended group membership, see ``check_errors()``
+        self._fatal_error = None
+        self._fatal_error_fut = create_future(loop=loop)
+        self._on_fatal_error_cb = on_fatal_error
+
+        metrics = client.metrics.with_tags(group_id=group_id)
+        self._rebalance_latency_sensor = metrics.histogram(
+            "aiokafka_consumer_rebalance_latency_seconds",
+            "Time to join the group and receive an assignment")
+        self._rebalance_sensor = metrics.counter(
+            "aiokafka_consumer_rebalances_total", "Group rebalances")
+        self._commit_latency_sensor = metrics.histogram(
+            "aiokafka_consumer_commit_latency_seconds",
+            "Time to store committed offsets")
+        self._commit_error_sensor = metrics.counter(
+            "aiokafka_consumer_commit_errors_total", "Failed commits")
+
+        if offset_store is None:
+            offset_store = KafkaOffsetStore()
+        self._offset_store = offset_store
+        offset_store.start(self)
 
         # Coordination flags and futures
         self._rejoin_needed_fut = create_future(loop=loop)
@@ -232,6 +279,11 @@ class GroupCoordinator(BaseCoordinator):
         # Will synchronize edits to TopicPartitionState.committed, as it may be
         # changed from user code by calling ``commit()``.
         self._commit_lock = asyncio.Lock(loop=loop)
+        # Offsets of ``commit_offsets()`` calls, that wait for the lock. Those
+        # are sent as one request once the lock is free.
+        self._pending_commit = None
+        # Tasks sending merged commits, awaited on close
+        self._commit_tasks = set()
 
         self._next_autocommit_deadline = \
             loop.time() + auto_commit_interval_ms / 1000
@@ -242,6 +294,37 @@ class GroupCoordinator(BaseCoordinator):
     def _on_metadata_change(self):
         self.request_rejoin()
 
+    def check_errors(self):
+        """ Raise the error, that ended group membership of this consumer, if
+        any. The consumer can not recover from those and should be closed.
+        """
+        if self._fatal_error is not None:
+            raise self._fatal_error
+
+    def _on_fatal_error(self, err):
+        """ Stop coordination and heartbeats, all further calls of the
+        consumer will raise ``err``.
+        """
+        if self._fatal_error is not None:
+            return
+        log.error(
+            "Consumer of group %s stopped due to fatal error: %r",
+            self.group_id, err)
+        self._fatal_error = err
+        self._fatal_error_fut.set_result(None)
+        if self._on_fatal_error_cb is not None:
+            self._on_fatal_error_cb(err)
+        self._subscription.abort_waiters(err)
+
+    def _static_request_type(self, request_types, supported_range):
+        """ Pick the request version for a static member. Only versions with
+        group_instance_id field can be used, so older brokers raise
+        UnsupportedVersionError.
+        """
+        version = self._client.pick_version(
+            request_types[0].API_KEY, supported_range, self.coordinator_id)
+        return request_types[version]
+
     @asyncio.coroutine
     def _send_req(self, request):
         """ Send request to coordinator node. In case the coordinator is not
@@ -269,10 +352,15 @@ class GroupCoordinator(BaseCoordinator):
             return
 
         self._closing.set_result(None)
+        self._cluster.remove_listener(self._handle_metadata_update)
         # We must let the coordination task properly finish all pending work
         yield from self._coordination_task
         yield from self._stop_heartbeat_task()
         yield from self._stop_commit_offsets_refresh_task()
+        # Let commits in progress finish before leaving the group
+        if self._commit_tasks:
+            yield from asyncio.wait(self._commit_tasks, loop=self._loop)
+        yield from self._offset_store.close()
 
         yield from self._maybe_leave_group()
 
@@ -282,7 +370,9 @@ class GroupCoordinator(BaseCoordinator):
 
     @asyncio.coroutine
     def _maybe_leave_group(self):
-        if self.generation > 0:
+        # Static members stay in the group until the session times out, so a
+        # restarted instance gets its assignment back without a rebalance
+        if self.generation > 0 and self.group_instance_id is None:
             # this is a minimal effort attempt to leave the group. we do not
             # attempt any resending if the request fails or times out.
             request = LeaveGroupRequest(self.group_id, self.member_id)
@@ -302,8 +392,24 @@ class GroupCoordinator(BaseCoordinator):
 
     @asyncio.coroutine
     def _on_join_prepare(self, previous_assignment):
-        self._subscription.begin_reassignment()
+        # With cooperative protocol we keep consuming during rebalance and
+        # only revoke partitions, that move to other members, once the new
+        # assignment is known. Unless the partitions could be already given
+        # to others: if the subscription changed or we were kicked out.
+        keep_assignment = (
+            self._cooperative and
+            previous_assignment is not None and
+            previous_assignment.active and
+            self.generation != OffsetCommitRequest.DEFAULT_GENERATION_ID)
+        if not keep_assignment:
+            self._subscription.begin_reassignment()
         self._group_subscription = None
+        if previous_assignment is not None and previous_assignment.active \
+                and self.generation != \
+                OffsetCommitRequest.DEFAULT_GENERATION_ID:
+            self._prepared_generation = (self.generation, self.member_id)
+        else:
+            self._prepared_generation = None
 
         # commit offsets prior to rebalance if auto-commit enabled
         if previous_assignment is not None:
@@ -316,6 +422,18 @@ class GroupCoordinator(BaseCoordinator):
         else:
             revoked = set([])
 
+        if keep_assignment:
+            return True
+        if self._cooperative:
+            # Don't claim partitions we no longer own in JoinGroup metadata
+            empty = ConsumerProtocol.ASSIGNMENT(0, [], b"")
+            for assignor in self._assignors:
+                assignor.on_assignment(empty)
+        yield from self._on_partitions_revoked(revoked)
+        return False
+
+    @asyncio.coroutine
+    def _on_partitions_revoked(self, revoked):
         # execute the user's callback before rebalance
         log.info("Revoking previously assigned partitions %s for group %s",
                  revoked, self.group_id)
@@ -378,9 +496,33 @@ class GroupCoordinator(BaseCoordinator):
 
         assignment = ConsumerProtocol.ASSIGNMENT.decode(
             member_assignment_bytes)
+        partitions = set(assignment.partitions())
+
+        # With cooperative protocol we still own the previous assignment
+        incremental = self._cooperative and \
+            not self._subscription.reassignment_in_progress
+        revoked = set()
+        if incremental:
+            previous = self._subscription.subscription.assignment
+            revoked = previous.tps - partitions
+            assigned = partitions - previous.tps
+            if revoked:
+                # Stop returning records, so the listener can commit final
+                # positions of revoked partitions
+                self._subscription.begin_reassignment()
+                yield from self._revoke_incrementally(previous, revoked)
+        else:
+            assigned = partitions
+
+        # With eager protocol partitions, that stay with us, keep positions
+        # and buffered records too, if no other member could get them
+        # meanwhile, ie. the group did not complete a generation without us.
+        keep_states = incremental or \
+            self._prepared_generation == (generation - 1, member_id)
 
         # update partition assignment
-        self._subscription.assign_from_subscribed(assignment.partitions())
+        self._subscription.assign_from_subscribed(
+            partitions, keep_states=keep_states)
 
         # give the assignor a chance to update internal state
         # based on the received assignment
@@ -393,7 +535,6 @@ class GroupCoordinator(BaseCoordinator):
         self.start_commit_offsets_refresh_task(
             self._subscription.subscription.assignment)
 
-        assigned = set(self._subscription.assigned_partitions())
         log.info("Setting newly assigned partitions %s for group %s",
                  assigned, self.group_id)
 
@@ -410,6 +551,24 @@ class GroupCoordinator(BaseCoordinator):
                               self._subscription.listener, self.group_id,
                               assigned)
 
+        if revoked:
+            # New owners of revoked partitions get them on the next rebalance
+            self.request_rejoin()
+
+    @asyncio.coroutine
+    def _revoke_incrementally(self, assignment, revoked):
+        if self._enable_auto_commit:
+            offsets = {
+                tp: offset
+                for tp, offset in assignment.all_consumed_offsets().items()
+                if tp in revoked}
+            try:
+                yield from self.commit_offsets(assignment, offsets)
+            except Errors.KafkaError as err:
+                log.error("OffsetCommit of revoked partitions failed,"
+                          " ignoring: %s", err)
+        yield from self._on_partitions_revoked(revoked)
+
     def coordinator_dead(self):
         """ Mark the current coordinator as dead.
         NOTE: this will not force a group rejoin. If new coordinator is able to
@@ -502,7 +661,7 @@ class GroupCoordinator(BaseCoordinator):
         subscription = self._subscription.subscription
         assignment = None
         performed_join_prepare = False
-        while not self._closing.done():
+        while not self._closing.done() and self._fatal_error is None:
             # Check if there was a change to subscription
             if subscription is not None and not subscription.active:
                 # The subscription can change few times, so we can not rely on
@@ -516,7 +675,7 @@ class GroupCoordinator(BaseCoordinator):
                     [self._subscription.wait_for_subscription(),
                      self._closing],
                     return_when=asyncio.FIRST_COMPLETED, loop=self._loop)
-                if self._closing.done():
+                if self._closing.done() or self._fatal_error is not None:
                     break
                 subscription = self._subscription.subscription
             assert subscription is not None and subscription.active
@@ -540,8 +699,10 @@ class GroupCoordinator(BaseCoordinator):
 
                 if not performed_join_prepare:
                     # NOTE: We pass the previously used assignment here.
-                    yield from self._on_join_prepare(assignment)
-                    performed_join_prepare = True
+                    kept = yield from self._on_join_prepare(assignment)
+                    # A kept assignment is checked again if rejoin fails, as
+                    # the subscription may change meanwhile
+                    performed_join_prepare = not kept
 
                 # NOTE: we did not stop heartbeat task before to keep the
                 # member alive during the callback, as it can commit offsets.
@@ -556,7 +717,11 @@ class GroupCoordinator(BaseCoordinator):
                 # subscription change and coordinator failure by itself and
                 # this way we don't need to worry about racing or cancellation
                 # issues that could occur if re-join were to be a task.
-                success = yield from self._do_rejoin_group(subscription)
+                try:
+                    success = yield from self._do_rejoin_group(subscription)
+                except Errors.FencedInstanceIdError as err:
+                    self._on_fatal_error(err)
+                    break
                 if success:
                     performed_join_prepare = False
                     assignment = subscription.assignment
@@ -577,6 +742,7 @@ class GroupCoordinator(BaseCoordinator):
 
             futures = [
                 self._closing,  # Will exit fast if close() called
+                self._fatal_error_fut,
                 self._coordinator_dead_fut,
                 subscription.unsubscribe_future]
             # In case of manual assignment this future will be always set and
@@ -590,8 +756,9 @@ class GroupCoordinator(BaseCoordinator):
                 futures, timeout=wait_timeout, loop=self._loop,
                 return_when=asyncio.FIRST_COMPLETED)
 
-        # Closing finallization
-        if assignment is not None:
+        # Closing finallization. Offsets can not be committed after a fatal
+        # error.
+        if assignment is not None and self._fatal_error is None:
             try:
                 yield from self._maybe_do_last_autocommit(assignment)
             except Errors.KafkaError as err:
@@ -619,7 +786,7 @@ class GroupCoordinator(BaseCoordinator):
         retry_backoff = self._retry_backoff_ms / 1000
         sleep_time = hb_interval
 
-        while True:
+        while self._fatal_error is None:
             try:
                 yield from asyncio.sleep(sleep_time, loop=self._loop)
                 yield from self.ensure_coordinator_known()
@@ -646,8 +813,15 @@ class GroupCoordinator(BaseCoordinator):
 
     @asyncio.coroutine
     def _do_heartbeat(self):
-        request = HeartbeatRequest(
-            self.group_id, self.generation, self.member_id)
+        if self.group_instance_id is None:
+            request = HeartbeatRequest(
+                self.group_id, self.generation, self.member_id)
+        else:
+            request_type = self._static_request_type(
+                GroupProtocol.HeartbeatRequest, (3, 3))
+            request = request_type(
+                self.group_id, self.generation, self.member_id,
+                self.group_instance_id)
         log.debug("Heartbeat: %s[%s] %s",
                   self.group_id, self.generation, self.member_id)
 
@@ -687,6 +861,12 @@ class GroupCoordinator(BaseCoordinator):
                 "Heartbeat failed: local member_id was not recognized;"
                 " resetting and re-joining group")
             self.reset_generation()
+        elif error_type is Errors.FencedInstanceIdError:
+            # Rejoining would fence the other instance in turn
+            log.error(
+                "Heartbeat failed: another consumer with group_instance_id"
+                " %s joined group %s", self.group_instance_id, self.group_id)
+            self._on_fatal_error(error_type())
         else:
             err = error_type()
             log.error("Heartbeat failed: %r", err)
@@ -745,11 +925,15 @@ class GroupCoordinator(BaseCoordinator):
 
     @asyncio.coroutine
     def _do_rejoin_group(self, subscription):
+        t0 = self._loop.time()
         rebalance = CoordinatorGroupRebalance(
             self, self.group_id, self.coordinator_id,
             subscription, self._assignors, self._session_timeout_ms,
-            self._retry_backoff_ms, loop=self._loop)
+            self._retry_backoff_ms, loop=self._loop,
+            group_instance_id=self.group_instance_id)
         assignment = yield from rebalance.perform_group_join()
+        self._rebalance_sensor.inc()
+        self._rebalance_latency_sensor.record(self._loop.time() - t0)
 
         if not subscription.active:
             log.debug("Subscription changed during rebalance from %s to %s. "
@@ -810,12 +994,10 @@ class GroupCoordinator(BaseCoordinator):
         Raises KafkaError on failure
         """
         while True:
+            self.check_errors()
             yield from self.ensure_coordinator_known()
             try:
-                with (yield from self._commit_lock):
-                    yield from asyncio.shield(
-                        self._do_commit_offsets(assignment, offsets),
-                        loop=self._loop)
+                yield from self._coalesced_commit_offsets(assignment, offsets)
             except (Errors.UnknownMemberIdError,
                     Errors.IllegalGenerationError,
                     Errors.RebalanceInProgressError) as err:
@@ -833,6 +1015,41 @@ class GroupCoordinator(BaseCoordinator):
             else:
                 break
 
+    @asyncio.coroutine
+    def _coalesced_commit_offsets(self, assignment, offsets):
+        """ Commit offsets merged with offsets of other calls, that arrive
+        while another commit is in progress. Only the highest offset per
+        partition is sent. All merged calls get the result of the combined
+        request.
+        """
+        batch = self._pending_commit
+        if batch is not None and batch.assignment is assignment:
+            batch.merge(offsets)
+        else:
+            batch = self._pending_commit = _CommitBatch(
+                assignment, offsets, loop=self._loop)
+            # Send in a separate task, so cancelling the first caller will
+            # not affect other calls merged into this batch.
+            task = ensure_future(
+                self._send_commit_batch(batch), loop=self._loop)
+            self._commit_tasks.add(task)
+            task.add_done_callback(self._commit_tasks.discard)
+        yield from asyncio.shield(batch.future, loop=self._loop)
+
+    @asyncio.coroutine
+    def _send_commit_batch(self, batch):
+        with (yield from self._commit_lock):
+            # Calls after this point will be merged into the next request
+            if self._pending_commit is batch:
+                self._pending_commit = None
+            try:
+                yield from self._do_commit_offsets(
+                    batch.assignment, batch.offsets)
+            except Exception as err:
+                batch.future.set_exception(err)
+            else:
+                batch.future.set_result(None)
+
     @asyncio.coroutine
     def _do_commit_offsets(self, assignment, offsets):
         # Fast return if nothing to commit
@@ -845,6 +1062,20 @@ class GroupCoordinator(BaseCoordinator):
             tp_state = assignment.state_value(tp)
             tp_state.begin_commit()
 
+        t0 = self._loop.time()
+        try:
+            yield from self._offset_store.commit_offsets(offsets)
+        except Exception:
+            self._commit_error_sensor.inc()
+            raise
+        self._commit_latency_sensor.record(self._loop.time() - t0)
+
+        for tp, offset in offsets.items():
+            tp_state = assignment.state_value(tp)
+            tp_state.update_committed(offset)
+
+    @asyncio.coroutine
+    def _send_offset_commit_request(self, offsets):
         # create the offset commit request
         offset_data = collections.defaultdict(list)
         for tp, offset in offsets.items():
@@ -853,13 +1084,27 @@ class GroupCoordinator(BaseCoordinator):
                  offset.offset,
                  offset.metadata))
 
-        request = OffsetCommitRequest(
-            self.group_id,
-            self.generation,
-            self.member_id,
-            OffsetCommitRequest.DEFAULT_RETENTION_TIME,
-            [(topic, tp_offsets) for topic, tp_offsets in offset_data.items()]
-        )
+        if self.group_instance_id is None:
+            request = OffsetCommitRequest(
+                self.group_id,
+                self.generation,
+                self.member_id,
+                OffsetCommitRequest.DEFAULT_RETENTION_TIME,
+                [(topic, tp_offsets)
+                 for topic, tp_offsets in offset_data.items()]
+            )
+        else:
+            request_type = self._static_request_type(
+                GroupProtocol.OffsetCommitRequest, (7, 7))
+            request = request_type(
+                self.group_id,
+                self.generation,
+                self.member_id,
+                self.group_instance_id,
+                [(topic, [(partition, offset, -1, metadata)
+                          for partition, offset, metadata in tp_offsets])
+                 for topic, tp_offsets in offset_data.items()]
+            )
 
         log.debug("Sending offset-commit request with %s for group %s to %s",
                   offsets, self.group_id, self.coordinator_id)
@@ -874,10 +1119,10 @@ class GroupCoordinator(BaseCoordinator):
                 error_type = Errors.for_code(error_code)
                 if error_type is Errors.NoError:
                     log.debug(
-                        "Committed offset %s for partition %s", offset, tp)
-                    offset = offsets[tp]
-                    tp_state = assignment.state_value(tp)
-                    tp_state.update_committed(offset)
+                        "Committed offset %s for partition %s",
+                        offsets[tp], tp)
+                    # Update commit cache even if other partitions failed
+                    self._update_committed(tp, offsets[tp])
                 elif error_type is Errors.GroupAuthorizationFailedError:
                     log.error("OffsetCommit failed for group %s - %s",
                               self.group_id, error_type.__name__)
@@ -925,11 +1170,14 @@ class GroupCoordinator(BaseCoordinator):
                         "OffsetCommit failed for group %s due to group"
                         " error (%s), will rejoin", self.group_id, error)
                     errored[tp] = error
-
+                elif error_type is Errors.FencedInstanceIdError:
+                    error = error_type()
+                    self._on_fatal_error(error)
+                    errored[tp] = error
                 else:
                     log.error(
                         "OffsetCommit failed for group %s on partition %s"
-                        " with offset %s: %s", self.group_id, tp, offset,
+                        " with offset %s: %s", self.group_id, tp, offsets[tp],
                         error_type.__name__)
                     errored[tp] = error_type()
 
@@ -941,13 +1189,21 @@ class GroupCoordinator(BaseCoordinator):
                       unauthorized_topics)
             raise Errors.TopicAuthorizationFailedError(unauthorized_topics)
 
+    def _update_committed(self, tp, offset):
+        subscription = self._subscription.subscription
+        if subscription is None or subscription.assignment is None:
+            return
+        assignment = subscription.assignment
+        if tp in assignment.tps:
+            assignment.state_value(tp).update_committed(offset)
+
     @asyncio.coroutine
     def _maybe_refresh_commit_offsets(self, assignment):
         with (yield from self._commit_lock):
             need_update = assignment.missing_commit_cache()
             if need_update:
                 try:
-                    offsets = yield from self._do_fetch_commit_offsets(
+                    offsets = yield from self._offset_store.fetch_offsets(
                         need_update)
                 except Errors.KafkaError as err:
                     if not err.retriable:
@@ -980,7 +1236,8 @@ class GroupCoordinator(BaseCoordinator):
         while True:
             yield from self.ensure_coordinator_known()
             try:
-                offsets = yield from self._do_fetch_commit_offsets(partitions)
+                offsets = yield from self._offset_store.fetch_offsets(
+                    partitions)
             except Errors.KafkaError as err:
                 if not err.retriable:
                     raise err
@@ -1036,6 +1293,27 @@ class GroupCoordinator(BaseCoordinator):
         return offsets
 
 
+class _CommitBatch:
+
+    def __init__(self, assignment, offsets, *, loop):
+        self.assignment = assignment
+        self.offsets = dict(offsets)
+        self.future = create_future(loop=loop)
+        # All callers may be cancelled, don't warn about unretrieved error
+        self.future.add_done_callback(self._retrieve_exception)
+
+    @staticmethod
+    def _retrieve_exception(fut):
+        if not fut.cancelled():
+            fut.exception()
+
+    def merge(self, offsets):
+        for tp, offset in offsets.items():
+            current = self.offsets.get(tp)
+            if current is None or offset.offset >= current.offset:
+                self.offsets[tp] = offset
+
+
 class CoordinatorGroupRebalance:
     """ An adapter, that encapsulates rebalance logic and will have a copy of
         assigned topics, so we can detect assignment changes. This includes
@@ -1046,9 +1324,11 @@ class CoordinatorGroupRebalance:
     """
 
     def __init__(self, coordinator, group_id, coordinator_id, subscription,
-                 assignors, session_timeout_ms, retry_backoff_ms, *, loop):
+                 assignors, session_timeout_ms, retry_backoff_ms, *, loop,
+                 group_instance_id=None):
         self._coordinator = coordinator
         self.group_id = group_id
+        self.group_instance_id = group_instance_id
         self.coordinator_id = coordinator_id
         self._loop = loop
 
@@ -1078,12 +1358,25 @@ class CoordinatorGroupRebalance:
             group_protocol = (assignor.name, metadata)
             metadata_list.append(group_protocol)
 
-        request = JoinGroupRequest(
-            self.group_id,
-            self._session_timeout_ms,
-            self._coordinator.member_id,
-            ConsumerProtocol.PROTOCOL_TYPE,
-            metadata_list)
+        if self.group_instance_id is None:
+            request = JoinGroupRequest(
+                self.group_id,
+                self._session_timeout_ms,
+                self._coordinator.member_id,
+                ConsumerProtocol.PROTOCOL_TYPE,
+                metadata_list)
+        else:
+            # Static membership was added in JoinGroup v5 (Kafka 2.3)
+            request_type = self._coordinator._static_request_type(
+                GroupProtocol.JoinGroupRequest, (5, 5))
+            request = request_type(
+                self.group_id,
+                self._session_timeout_ms,
+                self._session_timeout_ms,
+                self._coordinator.member_id,
+                self.group_instance_id,
+                ConsumerProtocol.PROTOCOL_TYPE,
+                metadata_list)
 
         # create the request for the coordinator
         log.debug("Sending JoinGroup (%s) to coordinator %s",
@@ -1131,6 +1424,12 @@ class CoordinatorGroupRebalance:
             log.debug(
                 "Attempt to join group %s failed due to unknown member id",
                 self.group_id)
+        elif error_type is Errors.MemberIdRequiredError:
+            # retry immediately with the member id given by the broker
+            self._coordinator.member_id = response.member_id
+            log.debug(
+                "Attempt to join group %s failed, as member id is required."
+                " Retrying with %s", self.group_id, response.member_id)
         elif error_type in (Errors.GroupCoordinatorNotAvailableError,
                             Errors.NotCoordinatorForGroupError):
             # Coordinator changed we should be able to find it immediately
@@ -1141,7 +1440,8 @@ class CoordinatorGroupRebalance:
                       err)
         elif error_type in (Errors.InconsistentGroupProtocolError,
                             Errors.InvalidSessionTimeoutError,
-                            Errors.InvalidGroupIdError):
+                            Errors.InvalidGroupIdError,
+                            Errors.FencedInstanceIdError):
             err = error_type()
             log.error(
                 "Attempt to join group failed due to fatal error: %s", err)
@@ -1157,11 +1457,7 @@ class CoordinatorGroupRebalance:
     @asyncio.coroutine
     def _on_join_follower(self):
         # send follower's sync group with an empty assignment
-        request = SyncGroupRequest(
-            self.group_id,
-            self._coordinator.generation,
-            self._coordinator.member_id,
-            {})
+        request = self._sync_group_request({})
         log.debug(
             "Sending follower SyncGroup for group %s to coordinator %s: %s",
             self.group_id, self.coordinator_id, request)
@@ -1179,12 +1475,14 @@ class CoordinatorGroupRebalance:
         Returns:
             Future: resolves to member assignment encoded-bytes
         """
+        # Members of JoinGroup v5+ also have group_instance_id
+        members = [(member[0], member[-1]) for member in response.members]
         try:
             group_assignment = \
                 yield from self._coordinator._perform_assignment(
                     response.leader_id,
                     response.group_protocol,
-                    response.members)
+                    members)
         except Exception as e:
             raise Errors.KafkaError(repr(e))
 
@@ -1194,17 +1492,29 @@ class CoordinatorGroupRebalance:
                 assignment = assignment.encode()
             assignment_req.append((member_id, assignment))
 
-        request = SyncGroupRequest(
-            self.group_id,
-            self._coordinator.generation,
-            self._coordinator.member_id,
-            assignment_req)
+        request = self._sync_group_request(assignment_req)
 
         log.debug(
             "Sending leader SyncGroup for group %s to coordinator %s: %s",
             self.group_id, self.coordinator_id, request)
         return (yield from self._send_sync_group_request(request))
 
+    def _sync_group_request(self, group_assignment):
+        if self.group_instance_id is None:
+            return SyncGroupRequest(
+                self.group_id,
+                self._coordinator.generation,
+                self._coordinator.member_id,
+                group_assignment)
+        request_type = self._coordinator._static_request_type(
+            GroupProtocol.SyncGroupRequest, (3, 3))
+        return request_type(
+            self.group_id,
+            self._coordinator.generation,
+            self._coordinator.member_id,
+            self.group_instance_id,
+            group_assignment)
+
     @asyncio.coroutine
     def _send_sync_group_request(self, request):
         # We need to reset the rejoin future right after the assignment to
@@ -1243,6 +1553,8 @@ class CoordinatorGroupRebalance:
             log.debug("SyncGroup for group %s failed due to %s",
                       self.group_id, err)
             self._coordinator.coordinator_dead()
+        elif error_type is Errors.FencedInstanceIdError:
+            raise error_type()
         else:
             err = error_type()
             log.error("Unexpected error from SyncGroup: %s", err)
@@ -0,0 +1,331 @@
+import abc
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import zlib
+
+import aiokafka.errors as Errors
+from aiokafka.structs import OffsetAndMetadata, TopicPartition
+from aiokafka.util import ensure_future
+
+log = logging.getLogger(__name__)
+
+
+class AbstractOffsetStore(metaclass=abc.ABCMeta):
+    """ Storage of committed offsets, used by the consumer for ``commit()``
+    calls and to find the starting position of newly assigned partitions.
+
+    A store is bound to one consumer on ``start()`` and can not be shared
+    between several consumers.
+    """
+
+    def start(self, coordinator):
+        """ Called by the group coordinator on consumer start. Subclasses
+        overriding this method should call ``super().start(coordinator)``.
+
+        Arguments:
+            coordinator (GroupCoordinator): coordinator of the consumer group
+        """
+        self._coordinator = coordinator
+
+    @asyncio.coroutine
+    def close(self):
+        """ Called by the group coordinator on consumer stop, before leaving
+        the group.
+        """
+        pass
+
+    @abc.abstractmethod
+    def commit_offsets(self, offsets):
+        """ Coroutine, that stores offsets.
+
+        Arguments:
+            offsets (dict): {TopicPartition: OffsetAndMetadata} to store
+
+        Raises:
+            KafkaError: if offsets could not be stored. Retriable errors
+                will be retried by the consumer.
+        """
+        pass
+
+    @abc.abstractmethod
+    def fetch_offsets(self, partitions):
+        """ Coroutine, that returns last stored offsets.
+
+        Arguments:
+            partitions (list of TopicPartition): partitions to look up
+
+        Returns:
+            dict: {TopicPartition: OffsetAndMetadata}, partitions without
+                stored offsets are left out.
+        """
+        pass
+
+
+class KafkaOffsetStore(AbstractOffsetStore):
+    """ Store offsets in Kafka using the group coordinator. This is the
+    default store.
+    """
+
+    @asyncio.coroutine
+    def commit_offsets(self, offsets):
+        yield from self._coordinator._send_offset_commit_request(offsets)
+
+    @asyncio.coroutine
+    def fetch_offsets(self, partitions):
+        return (yield from self._coordinator._do_fetch_commit_offsets(
+            partitions))
+
+
+class LocalOffsetStore(AbstractOffsetStore):
+    """ Store offsets in a local append-only file mapped into memory. Commits
+    do not do any network round-trips, so offsets can be committed together
+    with local state changes without slowing down processing.
+
+    Each commit appends an entry to the file. Once the file is full it is
+    rewritten with only the last offset of each partition, and grown if
+    needed. Entries are checksummed, so an entry torn by a crash is ignored
+    on the next start.
+
+    Note:
+        Offsets stored here are only visible to consumers on the same host,
+        so other group members will not see them after a rebalance, unless
+        ``kafka_flush_interval_ms`` is set. Use it with a static assignment
+        or with state that is kept per host.
+
+    Arguments:
+        path (str): path of the file to store offsets in. Created if it does
+            not exist. Use a separate file for each consumer group.
+        fsync (bool): flush the file to disk on each commit. Without it
+            committed offsets survive a process crash, but not a crash of
+            the OS. Default: False
+        kafka_flush_interval_ms (int): if set, offsets of assigned partitions
+            are also committed to Kafka in the background with this interval,
+            so tools, that monitor consumer lag, can see them. Offsets of
+            partitions missing in the file are then fetched from Kafka, so
+            partitions moved from other members continue from offsets their
+            previous owner flushed. Default: None
+        initial_size (int): initial size of the file in bytes.
+            Default: 65536
+    """
+
+    _MAGIC = b"AKOS\x00\x00\x00\x01"
+    _HEADER = struct.Struct(">II")  # length, crc32 of payload
+    _ENTRY = struct.Struct(">iqHH")  # partition, offset, topic, metadata
+
+    def __init__(self, path, *, fsync=False, kafka_flush_interval_ms=None,
+                 initial_size=65536):
+        if initial_size < len(self._MAGIC) + self._HEADER.size:
+            raise ValueError("initial_size is too small")
+        self._path = path
+        self._fsync = fsync
+        self._kafka_flush_interval_ms = kafka_flush_interval_ms
+        self._initial_size = initial_size
+
+        self._offsets = {}
+        self._unflushed = set()
+        self._fd = None
+        self._mmap = None
+        self._write_pos = 0
+        self._flush_task = None
+
+    def start(self, coordinator):
+        super().start(coordinator)
+        self._open()
+        if self._kafka_flush_interval_ms is not None:
+            self._flush_task = ensure_future(
+                self._kafka_flush_routine(), loop=coordinator._loop)
+
+    @asyncio.coroutine
+    def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            yield from self._flush_task
+            self._flush_task = None
+            yield from self._flush_to_kafka()
+        if self._mmap is not None:
+            self._mmap.flush()
+            self._mmap.close()
+            os.close(self._fd)
+            self._mmap = self._fd = None
+
+    @asyncio.coroutine
+    def commit_offsets(self, offsets):
+        for tp, offset in offsets.items():
+            # Update memory first, so compaction triggered by this append
+            # keeps entries already appended in this call
+            self._offsets[tp] = offset
+            self._append(tp, offset)
+        if self._fsync:
+            self._mmap.flush()
+        self._unflushed.update(offsets)
+
+    @asyncio.coroutine
+    def fetch_offsets(self, partitions):
+        offsets = {
+            tp: self._offsets[tp] for tp in partitions if tp in self._offsets
+        }
+        missing = [tp for tp in partitions if tp not in offsets]
+        if missing and self._kafka_flush_interval_ms is not None:
+            # Partition could be flushed by another member before rebalance
+            kafka_offsets = yield from \
+                self._coordinator._do_fetch_commit_offsets(missing)
+            offsets.update(kafka_offsets)
+        return offsets
+
+    # File handling
+
+    def _open(self):
+        self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = os.fstat(self._fd).st_size
+        if size == 0:
+            os.ftruncate(self._fd, self._initial_size)
+            size = self._initial_size
+        self._mmap = mmap.mmap(self._fd, size)
+        magic_size = len(self._MAGIC)
+        magic = self._mmap[:magic_size]
+        if magic == bytes(magic_size):
+            self._mmap[:magic_size] = self._MAGIC
+        elif magic != self._MAGIC:
+            self._mmap.close()
+            os.close(self._fd)
+            self._mmap = self._fd = None
+            raise ValueError(
+                "{} is not an offset store file".format(self._path))
+        self._offsets = self._replay()
+
+    def _replay(self):
+        buf = self._mmap
+        header = self._HEADER
+        pos = len(self._MAGIC)
+        offsets = {}
+        while pos + header.size <= len(buf):
+            length, crc = header.unpack_from(buf, pos)
+            if length == 0:
+                break
+            start = pos + header.size
+            payload = buf[start:start + length]
+            if len(payload) != length or zlib.crc32(payload) != crc:
+                # Entry torn by a crash. Clear the rest of the file, so it
+                # won't be mixed with entries written later.
+                log.warning(
+                    "Ignoring corrupted entry in offset store %s at %d",
+                    self._path, pos)
+                buf[pos:] = bytes(len(buf) - pos)
+                break
+            tp, offset = self._decode_entry(payload)
+            offsets[tp] = offset
+            pos = start + length
+        self._write_pos = pos
+        return offsets
+
+    def _encode_entry(self, tp, offset):
+        topic = tp.topic.encode("utf-8")
+        metadata = offset.metadata.encode("utf-8")
+        payload = self._ENTRY.pack(
+            tp.partition, offset.offset, len(topic), len(metadata)
+        ) + topic + metadata
+        return self._HEADER.pack(len(payload), zlib.crc32(payload)), payload
+
+    def _decode_entry(self, payload):
+        entry = self._ENTRY
+        partition, offset, topic_len, metadata_len = entry.unpack_from(payload)
+        pos = entry.size
+        topic = payload[pos:pos + topic_len].decode("utf-8")
+        pos += topic_len
+        metadata = payload[pos:pos + metadata_len].decode("utf-8")
+        return (
+            TopicPartition(topic, partition),
+            OffsetAndMetadata(offset, metadata)
+        )
+
+    def _append(self, tp, offset):
+        header, payload = self._encode_entry(tp, offset)
+        entry_size = len(header) + len(payload)
+        if self._write_pos + entry_size > len(self._mmap):
+            self._compact(extra=entry_size)
+        pos = self._write_pos
+        start = pos + len(header)
+        # Write the header last, so a torn entry is never read as valid
+        self._mmap[start:start + len(payload)] = payload
+        self._mmap[pos:start] = header
+        self._write_pos = start + len(payload)
+
+    def _compact(self, extra):
+        """ Rewrite the file with only the last offset of each partition.
+        The new file is written aside and renamed, so a crash will leave
+        either the old or the new file.
+        """
+        data = [self._MAGIC]
+        for tp, offset in self._offsets.items():
+            data.extend(self._encode_entry(tp, offset))
+        data = b"".join(data)
+        size = len(self._mmap)
+        while len(data) + extra > size // 2:
+            size *= 2
+        log.debug("Compacting offset store %s to %d bytes", self._path, size)
+
+        tmp_path = self._path + ".tmp"
+        fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            view = memoryview(data)
+            while view:
+                # Writes may be short, a truncated file must not replace the
+                # only good copy
+                written = os.write(fd, view)
+                view = view[written:]
+            os.fsync(fd)
+            os.replace(tmp_path, self._path)
+        except Exception:
+            os.close(fd)
+            raise
+        self._mmap.close()
+        os.close(self._fd)
+        self._fd = fd
+        self._mmap = mmap.mmap(fd, size)
+        self._write_pos = len(data)
+
+    # Lazy flush to Kafka
+
+    @asyncio.coroutine
+    def _kafka_flush_routine(self):
+        interval = self._kafka_flush_interval_ms / 1000
+        loop = self._coordinator._loop
+        try:
+            while True:
+                yield from asyncio.sleep(interval, loop=loop)
+                yield from self._flush_to_kafka()
+        except asyncio.CancelledError:
+            pass
+
+    @asyncio.coroutine
+    def _flush_to_kafka(self):
+        # Don't interleave with user commits and commit cache refreshes
+        with (yield from self._coordinator._commit_lock):
+            yield from self._do_flush_to_kafka()
+
+    @asyncio.coroutine
+    def _do_flush_to_kafka(self):
+        subscription = self._coordinator._subscription.subscription
+        if subscription is None or subscription.assignment is None:
+            return
+        # Partitions, that are not assigned anymore, are committed by their
+        # new owner
+        self._unflushed &= subscription.assignment.tps
+        if not self._unflushed:
+            return
+        offsets = {tp: self._offsets[tp] for tp in self._unflushed}
+        try:
+            yield from self._coordinator._send_offset_commit_request(offsets)
+        except Errors.KafkaError as err:
+            log.warning("Failed to flush offsets to Kafka: %r", err)
+            return
+        for tp, offset in offsets.items():
+            if self._offsets[tp] == offset:
+                self._unflushed.discard(tp)
+
+
+__all__ = ["AbstractOffsetStore", "KafkaOffsetStore", "LocalOffsetStore"]
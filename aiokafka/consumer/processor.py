@@ -0,0 +1,518 @@
+import asyncio
+import collections
+import functools
+import logging
+
+from aiokafka.abc import ConsumerRebalanceListener
+from aiokafka.errors import KafkaError, IllegalOperation, ConsumerStoppedError
+from aiokafka.util import ensure_future, create_future
+
+log = logging.getLogger(__name__)
+
+
+class OffsetTracker:
+    """ Keeps offsets of records of a single partition, that are still
+    being processed, and calculates the offset, that is safe to commit: all
+    records before it are processed.
+
+    Only offsets passed to ``add()`` and not yet ``done()`` are stored, so
+    memory usage does not depend on how far processing got.
+
+    Offsets processed out of order can be encoded as a run-length string
+    using ``encode()`` and stored in commit metadata, so those records can be
+    skipped after restart or rebalance.
+    """
+
+    _rle_prefix = "rle:"
+
+    def __init__(self):
+        self._pending = collections.deque()
+        self._done = set()
+        self._committable = None
+
+    def add(self, offset):
+        """ Register a record passed to processing. Offsets should be added in
+        increasing order.
+        """
+        self._pending.append(offset)
+
+    def done(self, offset):
+        """ Mark a record as processed.
+        """
+        pending = self._pending
+        done = self._done
+        done.add(offset)
+        while pending and pending[0] in done:
+            offset = pending.popleft()
+            done.discard(offset)
+            self._committable = offset + 1
+
+    @property
+    def committable(self):
+        """ Offset of the first record, that is not processed yet, ie. the
+        offset to commit. None if no records were processed.
+        """
+        if self._done:
+            # Records after the first pending one are processed, so it's
+            # position should be committed with sparse metadata.
+            return self._pending[0]
+        return self._committable
+
+    def encode(self, max_size=None):
+        """ Encode offsets processed after ``committable`` as alternating
+        lengths of unprocessed and processed offset ranges, for example
+        ``"rle:1,2,3,1"`` for base offset 10 means offsets 11, 12 and 16
+        are processed.
+
+        Arguments:
+            max_size (int): maximum length of the result. Ranges, that do not
+                fit are left out, so those records will be processed again.
+
+        Returns:
+            str: encoded offsets or an empty string if there are none.
+        """
+        if not self._done:
+            return ""
+        ranges = []
+        start = end = None
+        for offset in sorted(self._done):
+            if offset != end:
+                if end is not None:
+                    ranges.append((start, end))
+                start = offset
+            end = offset + 1
+        ranges.append((start, end))
+
+        parts = []
+        size = len(self._rle_prefix) - 1
+        position = self._pending[0]
+        for start, end in ranges:
+            part = "{},{}".format(start - position, end - start)
+            size += len(part) + 1
+            if max_size is not None and size > max_size:
+                break
+            parts.append(part)
+            position = end
+        if not parts:
+            return ""
+        return self._rle_prefix + ",".join(parts)
+
+    @classmethod
+    def decode(cls, base, metadata):
+        """ Decode metadata string written by ``encode()``.
+
+        Arguments:
+            base (int): committed offset, that metadata was stored with.
+            metadata (str): commit metadata.
+
+        Returns:
+            list: sorted ``(start, end)`` ranges of processed offsets. Empty
+                if metadata was not written by ``encode()``.
+        """
+        if not metadata or not metadata.startswith(cls._rle_prefix):
+            return []
+        try:
+            lengths = [int(x) for x in
+                       metadata[len(cls._rle_prefix):].split(",")]
+        except ValueError:
+            return []
+        if len(lengths) % 2 or any(x < 0 for x in lengths):
+            return []
+        ranges = []
+        position = base
+        for skip, length in zip(lengths[::2], lengths[1::2]):
+            start = position + skip
+            position = start + length
+            ranges.append((start, position))
+        return ranges
+
+    def __len__(self):
+        return len(self._pending)
+
+
+class _PartitionState:
+
+    def __init__(self, tp, skip_ranges=()):
+        self.tp = tp
+        self.tracker = OffsetTracker()
+        # Queues of records, that should be processed one after another.
+        # Each queue is handled by at most 1 worker at a time.
+        self.lanes = {}
+        self.in_flight = set()
+        self.committed = None
+        # Offsets processed before last commit, but after committed offset
+        self.skip_ranges = collections.deque(skip_ranges)
+
+    def already_processed(self, offset):
+        ranges = self.skip_ranges
+        while ranges and ranges[0][1] <= offset:
+            ranges.popleft()
+        return bool(ranges) and ranges[0][0] <= offset
+
+
+class ParallelProcessor:
+    """ Process records of a consumer concurrently using a bounded pool of
+    worker coroutines, committing only offsets, that have all previous
+    records processed.
+
+    Records are fetched using ``getmany()`` of the consumer and passed to
+    the ``handler`` coroutine. Processed offsets are committed every
+    ``commit_interval_ms``, on rebalance and on stop.
+
+    If records are processed out of order, offsets processed after the
+    committed one are stored in commit metadata. Those records are skipped
+    if fetched again, for example after a rebalance.
+
+    Example usage:
+
+    .. code:: python
+
+        @asyncio.coroutine
+        def handle(record):
+            ...
+
+        consumer = AIOKafkaConsumer(
+            loop=loop, group_id="my_group", enable_auto_commit=False)
+        processor = ParallelProcessor(consumer, handle, concurrency=20)
+        consumer.subscribe(
+            ["my_topic"], listener=processor.rebalance_listener())
+        yield from consumer.start()
+        task = loop.create_task(processor.run())
+        ...
+        processor.stop()
+        yield from task
+
+    Arguments:
+        consumer (AIOKafkaConsumer): consumer instance. It should not be
+            used to get records by anything else, while the processor is
+            running. If ``group_id`` is set ``enable_auto_commit`` should
+            be disabled.
+        handler (coroutine function): called with each ``ConsumerRecord``.
+            If it raises an exception the processor stops and ``run()``
+            raises it.
+        concurrency (int): maximum number of records processed at the
+            same time. Default: 10
+        ordering (str): ``'partition'`` - records of a partition are
+            processed one after another in offset order, ``'key'`` - records
+            with the same key (and partition) are processed one after
+            another, records with different keys - at the same time,
+            ``'none'`` - any records may be processed at the same time.
+            Default: 'partition'
+        max_pending_records (int): maximum number of fetched records, that
+            are not yet processed. The consumer is not polled while this
+            limit is reached. Default: 1000
+        commit_interval_ms (int): interval between commits of processed
+            offsets. Default: 5000
+        cancel_on_revoke (bool): if True, handlers processing records of
+            revoked partitions are cancelled on rebalance, otherwise the
+            rebalance waits for them to finish. Default: False
+
+    Raises:
+        IllegalOperation: if consumer has ``enable_auto_commit`` set.
+    """
+
+    _orderings = ("partition", "key", "none")
+    # Default of ``offset.metadata.max.bytes`` broker config
+    _max_metadata_size = 4096
+
+    def __init__(self, consumer, handler, *, concurrency=10,
+                 ordering="partition", max_pending_records=1000,
+                 commit_interval_ms=5000, cancel_on_revoke=False):
+        if consumer._group_id is not None and consumer._enable_auto_commit:
+            raise IllegalOperation(
+                "ParallelProcessor requires enable_auto_commit=False")
+        if ordering not in self._orderings:
+            raise ValueError(
+                "ordering should be one of {!r}".format(self._orderings))
+        if concurrency < 1:
+            raise ValueError("concurrency should be a positive integer")
+
+        self._consumer = consumer
+        self._loop = consumer._loop
+        self._handler = handler
+        self._concurrency = concurrency
+        self._ordering = ordering
+        self._max_pending = max(max_pending_records, 1)
+        self._commit_interval = commit_interval_ms / 1000
+        self._cancel_on_revoke = cancel_on_revoke
+
+        self._partitions = {}
+        self._ready = None
+        self._pending_count = 0
+        self._wakeup_fut = create_future(loop=self._loop)
+        self._closing = False
+        self._error = None
+
+    def rebalance_listener(self, listener=None):
+        """ Return a listener, that should be passed to
+        ``AIOKafkaConsumer.subscribe()``. On rebalance it waits for (or
+        cancels) processing of revoked partitions and commits their offsets
+        before calling ``listener`` (if any).
+
+        Arguments:
+            listener (ConsumerRebalanceListener): optional user listener.
+        """
+        return _ProcessorRebalanceListener(self, listener)
+
+    def stop(self):
+        """ Stop fetching new records. ``run()`` will return after records,
+        that are being processed, are finished and offsets committed. The
+        processor can not be started again.
+        """
+        self._closing = True
+        self._wakeup()
+
+    @asyncio.coroutine
+    def run(self):
+        """ Fetch and process records until ``stop()`` is called.
+
+        Raises:
+            Exception: the first exception raised by ``handler``.
+        """
+        loop = self._loop
+        self._ready = asyncio.Queue(loop=loop)
+        workers = [
+            ensure_future(self._worker_routine(), loop=loop)
+            for _ in range(self._concurrency)]
+        next_commit = loop.time() + self._commit_interval
+        try:
+            while not self._closing:
+                capacity = self._max_pending - self._pending_count
+                if capacity > 0:
+                    timeout = max(next_commit - loop.time(), 0)
+                    records = yield from self._getmany(timeout, capacity)
+                    self._dispatch(records)
+                else:
+                    yield from asyncio.wait(
+                        [self._wakeup_fut], loop=loop,
+                        timeout=max(next_commit - loop.time(), 0))
+                    if self._wakeup_fut.done():
+                        self._wakeup_fut = create_future(loop=loop)
+
+                if loop.time() >= next_commit:
+                    yield from self.commit()
+                    next_commit = loop.time() + self._commit_interval
+        except ConsumerStoppedError:
+            pass
+        except asyncio.CancelledError:
+            for state in self._partitions.values():
+                for fut in state.in_flight:
+                    fut.cancel()
+            raise
+        finally:
+            # Records, that are not started yet, will not be processed
+            for state in self._partitions.values():
+                self._drop_queued(state)
+            in_flight = [
+                fut for state in self._partitions.values()
+                for fut in state.in_flight]
+            if in_flight:
+                yield from asyncio.wait(in_flight, loop=loop)
+            for worker in workers:
+                worker.cancel()
+            yield from asyncio.wait(workers, loop=loop)
+            yield from self.commit()
+            self._partitions.clear()
+
+        if self._error is not None:
+            raise self._error
+
+    @asyncio.coroutine
+    def _getmany(self, timeout, max_records):
+        fetch = ensure_future(self._consumer.getmany(
+            timeout_ms=int(timeout * 1000), max_records=max_records),
+            loop=self._loop)
+        yield from asyncio.wait(
+            [fetch, self._wakeup_fut], loop=self._loop,
+            return_when=asyncio.FIRST_COMPLETED)
+        if self._wakeup_fut.done():
+            self._wakeup_fut = create_future(loop=self._loop)
+        if not fetch.done():
+            fetch.cancel()
+            yield from asyncio.wait([fetch], loop=self._loop)
+        if fetch.cancelled():
+            return {}
+        return fetch.result()
+
+    def _wakeup(self):
+        if not self._wakeup_fut.done():
+            self._wakeup_fut.set_result(None)
+
+    def _lane_key(self, record):
+        if self._ordering == "partition":
+            return None
+        if self._ordering == "key":
+            return record.key
+        return record.offset
+
+    def _skip_ranges(self, tp):
+        """ Offsets processed before the last commit, read from committed
+        metadata.
+        """
+        subscription = self._consumer._subscription.subscription
+        if subscription is None or subscription.assignment is None:
+            return []
+        tp_state = subscription.assignment.state_value(tp)
+        if tp_state is None or tp_state.committed is None:
+            return []
+        committed = tp_state.committed
+        return OffsetTracker.decode(committed.offset, committed.metadata)
+
+    def _dispatch(self, records):
+        ready = self._ready
+        for tp, messages in records.items():
+            state = self._partitions.get(tp)
+            if state is None:
+                state = self._partitions[tp] = _PartitionState(
+                    tp, self._skip_ranges(tp))
+            tracker = state.tracker
+            lanes = state.lanes
+            for record in messages:
+                tracker.add(record.offset)
+                if state.skip_ranges and \
+                        state.already_processed(record.offset):
+                    tracker.done(record.offset)
+                    continue
+                key = self._lane_key(record)
+                lane = lanes.get(key)
+                if lane is None:
+                    lane = lanes[key] = collections.deque()
+                    ready.put_nowait((state, key, lane))
+                lane.append(record)
+                self._pending_count += 1
+
+    def _drop_queued(self, state):
+        for lane in state.lanes.values():
+            self._pending_count -= len(lane)
+        state.lanes.clear()
+
+    @asyncio.coroutine
+    def _worker_routine(self):
+        ready = self._ready
+        while True:
+            state, key, lane = yield from ready.get()
+            # Lane could be dropped on revoke. Also no new records are
+            # started after stop() or a handler failure.
+            if state.lanes.get(key) is not lane or self._closing:
+                continue
+            record = lane.popleft()
+
+            fut = ensure_future(self._handle(record), loop=self._loop)
+            state.in_flight.add(fut)
+            fut.add_done_callback(
+                functools.partial(self._on_handled, state, record))
+            yield from asyncio.wait([fut], loop=self._loop)
+
+            if state.lanes.get(key) is lane:
+                if lane:
+                    ready.put_nowait((state, key, lane))
+                else:
+                    del state.lanes[key]
+
+    @asyncio.coroutine
+    def _handle(self, record):
+        res = self._handler(record)
+        if asyncio.iscoroutine(res):
+            yield from res
+
+    def _on_handled(self, state, record, fut):
+        state.in_flight.discard(fut)
+        self._pending_count -= 1
+        if fut.cancelled():
+            pass
+        elif fut.exception() is not None:
+            if self._error is None:
+                log.error(
+                    "Processing of record at offset %s of %s failed",
+                    record.offset, state.tp, exc_info=fut.exception())
+                self._error = fut.exception()
+            self._closing = True
+        else:
+            state.tracker.done(record.offset)
+        # Only wake up `run()` if it waits for capacity or should stop
+        if self._closing or self._pending_count == self._max_pending - 1:
+            self._wakeup()
+
+    @asyncio.coroutine
+    def commit(self, partitions=None):
+        """ Commit offsets of processed records. Errors are logged, as the
+        offsets will be committed again on the next try.
+
+        Arguments:
+            partitions (list of TopicPartition): partitions to commit.
+                Default: all partitions being processed.
+        """
+        if partitions is None:
+            states = list(self._partitions.values())
+        else:
+            states = [self._partitions[tp] for tp in partitions
+                      if tp in self._partitions]
+        yield from self._commit_states(states)
+
+    @asyncio.coroutine
+    def _commit_states(self, states):
+        offsets = {}
+        for state in states:
+            tracker = state.tracker
+            committable = tracker.committable
+            if committable is None:
+                continue
+            offset = (committable, tracker.encode(self._max_metadata_size))
+            if offset != state.committed:
+                offsets[state.tp] = offset
+        if not offsets or self._consumer._group_id is None:
+            return
+
+        try:
+            yield from self._consumer.commit(offsets)
+        except KafkaError as err:
+            log.error("Failed to commit processed offsets %s: %s",
+                      offsets, err)
+            return
+        for state in states:
+            if state.tp in offsets:
+                state.committed = offsets[state.tp]
+
+    @asyncio.coroutine
+    def _revoke(self, revoked):
+        states = []
+        for tp in revoked:
+            state = self._partitions.pop(tp, None)
+            if state is not None:
+                self._drop_queued(state)
+                states.append(state)
+
+        in_flight = [fut for state in states for fut in state.in_flight]
+        if in_flight:
+            if self._cancel_on_revoke:
+                for fut in in_flight:
+                    fut.cancel()
+            yield from asyncio.wait(in_flight, loop=self._loop)
+        self._wakeup()
+
+        yield from self._commit_states(states)
+
+
+class _ProcessorRebalanceListener(ConsumerRebalanceListener):
+
+    def __init__(self, processor, listener):
+        self._processor = processor
+        self._listener = listener
+
+    @asyncio.coroutine
+    def on_partitions_revoked(self, revoked):
+        yield from self._processor._revoke(revoked)
+        if self._listener is not None:
+            res = self._listener.on_partitions_revoked(revoked)
+            if asyncio.iscoroutine(res):
+                yield from res
+
+    @asyncio.coroutine
+    def on_partitions_assigned(self, assigned):
+        if self._listener is not None:
+            res = self._listener.on_partitions_assigned(assigned)
+            if asyncio.iscoroutine(res):
+                yield from res
+
+
+__all__ = ["ParallelProcessor", "OffsetTracker"]
@@ -118,6 +118,16 @@ class SubscriptionState:
                 waiter.set_result(None)
         self._assignment_waiters.clear()
 
+    def abort_waiters(self, exc):
+        """ Fail all pending assignment waiters with ``exc``. Called by
+        Coordinator if no new assignment will come, as the consumer can not
+        continue.
+        """
+        for waiter in self._assignment_waiters:
+            if not waiter.done():
+                waiter.set_exception(exc)
+        self._assignment_waiters.clear()
+
     # Consumer callable API:
 
     def subscribe(self, topics: Set[str], listener=None):
@@ -192,8 +202,11 @@ class SubscriptionState:
         assert self._subscription_type == SubscriptionType.AUTO_PATTERN
         self._change_subscription(Subscription(topics, loop=self._loop))
 
-    def assign_from_subscribed(self, assignment: Set[TopicPartition]):
-        """ Set assignment if automatic assignment is used.
+    def assign_from_subscribed(self, assignment: Set[TopicPartition], *,
+                               keep_states: bool=False):
+        """ Set assignment if automatic assignment is used. If `keep_states`
+        partitions, that stay assigned, keep their positions, highwater marks
+        and committed offsets.
 
         Caller: Coordinator
         Affects: SubscriptionState.subscription.assignment
@@ -201,7 +214,7 @@ class SubscriptionState:
         assert self._subscription_type in [
             SubscriptionType.AUTO_PATTERN, SubscriptionType.AUTO_TOPICS]
 
-        self._subscription._assign(assignment)
+        self._subscription._assign(assignment, keep_states=keep_states)
         self._notify_assignment_waiters()
 
     def begin_reassignment(self):
@@ -272,15 +285,19 @@ class Subscription:
     def assignment(self):
         return self._assignment
 
-    def _assign(self, topic_partitions: Set[TopicPartition]):
+    def _assign(self, topic_partitions: Set[TopicPartition], *,
+                keep_states: bool=False):
         for tp in topic_partitions:
             assert tp.topic in self._topics, \
                 "Received an assignment for unsubscribed topic: %s" % (tp, )
 
-        if self._assignment is not None:
-            self._assignment._unassign()
+        previous = self._assignment
+        if previous is not None:
+            previous._unassign()
 
-        self._assignment = Assignment(topic_partitions, loop=self._loop)
+        self._assignment = Assignment(
+            topic_partitions, loop=self._loop,
+            previous=previous if keep_states else None)
         self._reassignment_in_progress = False
 
     def _unsubscribe(self):
@@ -307,7 +324,8 @@ class ManualSubscription(Subscription):
         self.unsubscribe_future = create_future(loop)
 
     def _assign(
-            self, topic_partitions: Set[TopicPartition]):  # pragma: no cover
+            self, topic_partitions: Set[TopicPartition], *,
+            keep_states: bool=False):  # pragma: no cover
         assert False, "Should not be called"
 
     @property
@@ -320,21 +338,31 @@ class ManualSubscription(Subscription):
 
 class Assignment:
     """ Describes current partition assignment. New instance will be created
-    on each group rebalance if automatic assignment is used.
+    on each group rebalance if automatic assignment is used. States of
+    partitions present in the `previous` assignment are moved over to the new
+    one.
 
     States:
         * Assigned
         * Unassigned
     """
 
-    def __init__(self, topic_partitions: Set[TopicPartition], *, loop):
+    def __init__(self, topic_partitions: Set[TopicPartition], *, loop,
+                 previous: "Assignment"=None):
         assert isinstance(topic_partitions, (list, set, tuple))
 
         self._topic_partitions = frozenset(topic_partitions)
 
         self._tp_state = {}  # type: Dict[TopicPartition:TopicPartitionState]
         for tp in self._topic_partitions:
-            self._tp_state[tp] = TopicPartitionState(self, loop=loop)
+            tp_state = None
+            if previous is not None:
+                tp_state = previous.state_value(tp)
+            if tp_state is None:
+                tp_state = TopicPartitionState(self, loop=loop)
+            else:
+                tp_state._assignment = self
+            self._tp_state[tp] = tp_state
 
         self._loop = loop
         self.unassign_future = create_future(loop)
@@ -415,6 +443,13 @@ class TopicPartitionState(object):
         self._loop = loop
         self._assignment = assignment
 
+    @property
+    def assignment(self) -> "Assignment":
+        """ Assignment the partition belongs to. It changes if the state is
+        moved over to a new assignment.
+        """
+        return self._assignment
+
     @property
     def committed(self) -> OffsetAndMetadata:
         return self._committed
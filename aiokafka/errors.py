@@ -1,5 +1,7 @@
 from kafka.errors import *  # noqa
-from kafka.errors import KafkaError, InvalidMessageError
+from kafka.errors import (
+    BrokerResponseError, KafkaError, InvalidMessageError, kafka_errors,
+    UnknownError)
 
 __all__ = [
     # kafka-python errors
@@ -16,7 +18,9 @@ __all__ = [
     "UnsupportedVersionError", "CorruptRecordException", "InvalidMessageError",
     # aiokafka custom errors
     "ConsumerStoppedError", "NoOffsetForPartitionError", "RecordTooLargeError",
-    "ProducerClosed"
+    "ProducerClosed",
+    # broker errors missing in kafka-python
+    "MemberIdRequiredError", "FencedInstanceIdError"
 ]
 
 CorruptRecordException = InvalidMessageError
@@ -45,3 +49,30 @@ class RecordTooLargeError(KafkaError):
 
 class ProducerClosed(KafkaError):
     pass
+
+
+class MemberIdRequiredError(BrokerResponseError):
+    errno = 79
+    message = 'MEMBER_ID_REQUIRED'
+    description = ('The group member needs to have a valid member id before'
+                   ' actually entering a consumer group')
+
+
+class FencedInstanceIdError(BrokerResponseError):
+    errno = 82
+    message = 'FENCED_INSTANCE_ID'
+    description = ('The broker rejected this static consumer since another'
+                   ' consumer with the same group.instance.id has registered'
+                   ' with a different member.id')
+
+
+_aiokafka_errors = {
+    error.errno: error
+    for error in (MemberIdRequiredError, FencedInstanceIdError)}
+
+
+def for_code(error_code):
+    error_type = _aiokafka_errors.get(error_code)
+    if error_type is None:
+        error_type = kafka_errors.get(error_code, UnknownError)
+    return error_type
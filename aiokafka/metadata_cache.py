@@ -0,0 +1,133 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+__all__ = ["MetadataCache"]
+
+log = logging.getLogger(__name__)
+
+
+class MetadataCache:
+    """ On-disk cache of broker API version, broker list and topic
+    partition layout, that lets short-lived clients skip the startup
+    handshake. Pass an instance as ``metadata_cache`` to
+    ``AIOKafkaClient``, ``AIOKafkaProducer`` or ``AIOKafkaConsumer``.
+
+    A client with a fresh cache entry for its ``bootstrap_servers`` starts
+    from the cached state without any requests and validates it in the
+    background: metadata is refreshed right away and, for
+    ``api_version='auto'``, the broker version is checked again. If cached
+    brokers can not be reached the client bootstraps from
+    ``bootstrap_servers`` as usual. The entry is rewritten after full
+    metadata refreshes, unchanged metadata at most once a minute.
+
+    Each cluster is cached in a separate JSON file named after a hash of
+    its bootstrap servers, so one directory can be shared by clients of
+    different clusters and by several processes.
+
+    Arguments:
+        path (str): directory to keep cache files in. Created if it does not
+            exist.
+        max_age_ms (int): entries older than this are not used. Default:
+            3600000 (1 hour)
+    """
+
+    _FORMAT_VERSION = 1
+
+    def __init__(self, path, *, max_age_ms=3600000):
+        self._path = path
+        self._max_age = max_age_ms / 1000
+
+    def _entry_path(self, hosts):
+        key = ",".join(sorted(
+            "{}:{}".format(host, port) for host, port, _ in hosts))
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self._path, "aiokafka-{}.json".format(digest))
+
+    def load(self, hosts):
+        """ Return cached entry for a cluster or None if there is no usable
+        one.
+
+        Arguments:
+            hosts (list): ``(host, port, afi)`` bootstrap servers of the
+                cluster.
+
+        Returns:
+            dict: ``api_version`` (tuple) and ``metadata`` ([brokers,
+                controller_id, topics] fields of a v1 MetadataResponse)
+        """
+        path = self._entry_path(hosts)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as err:
+            log.warning("Ignoring unreadable metadata cache %s: %s",
+                        path, err)
+            return None
+
+        try:
+            if entry["format"] != self._FORMAT_VERSION:
+                return None
+            age = time.time() - entry["timestamp"]
+            if age > self._max_age or age < 0:
+                log.debug("Metadata cache %s is stale", path)
+                return None
+            brokers, controller_id, topics = entry["metadata"]
+            return {
+                "api_version": tuple(entry["api_version"]),
+                "metadata": [
+                    [tuple(broker) for broker in brokers],
+                    controller_id,
+                    [(error, topic, is_internal, [
+                        tuple(partition) for partition in partitions])
+                     for error, topic, is_internal, partitions in topics]],
+            }
+        except (KeyError, TypeError, ValueError) as err:
+            log.warning("Ignoring malformed metadata cache %s: %s",
+                        path, err)
+            return None
+
+    def save(self, hosts, api_version, metadata):
+        """ Replace cached entry of a cluster. The file is replaced
+        atomically, so concurrent readers never see a partial entry.
+
+        Arguments:
+            hosts (list): ``(host, port, afi)`` bootstrap servers.
+            api_version (tuple): detected broker version.
+            metadata (list): [brokers, controller_id, topics] fields of a
+                v1 MetadataResponse.
+        """
+        path = self._entry_path(hosts)
+        entry = {
+            "format": self._FORMAT_VERSION,
+            "timestamp": time.time(),
+            "api_version": list(api_version),
+            "metadata": metadata,
+        }
+        try:
+            os.makedirs(self._path, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(
+                dir=self._path, prefix=".aiokafka-", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(entry, f)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as err:
+            log.warning("Unable to write metadata cache %s: %s", path, err)
+
+    def invalidate(self, hosts):
+        """ Remove cached entry of a cluster """
+        try:
+            os.unlink(self._entry_path(hosts))
+        except FileNotFoundError:
+            pass
+        except OSError as err:
+            log.warning("Unable to remove metadata cache: %s", err)
@@ -0,0 +1,325 @@
+import bisect
+import collections
+import time
+
+__all__ = ["Metrics", "Counter", "Gauge", "Rate", "Histogram"]
+
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = tuple(2 ** i for i in range(6, 25, 2))  # 64 bytes to 16 Mb
+COUNT_BUCKETS = tuple(4 ** i for i in range(0, 9))  # 1 to 65536
+RATIO_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1)
+
+
+class Counter:
+    """ Monotonically increasing value """
+
+    kind = "counter"
+
+    def __init__(self):
+        self._value = 0
+
+    def inc(self, amount=1):
+        self._value += amount
+
+    def value(self):
+        return self._value
+
+
+class Gauge:
+    """ Value calculated by calling ``fn`` on collection. Use it for values,
+    that are expensive to track on each change, like queue sizes.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, fn):
+        self._fn = fn
+
+    def value(self):
+        return self._fn()
+
+
+class Rate:
+    """ Sum of recorded values per second over a sliding window. The window
+    is split into ``samples`` parts, the oldest part is dropped once a new
+    one starts.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, window, samples, time_fn):
+        self._window = window
+        self._sample_len = window / samples
+        self._samples = samples
+        self._time = time_fn
+        self._created = time_fn()
+        # [sample index, total]
+        self._totals = collections.deque()
+
+    def _rotate(self, now):
+        index = int(now / self._sample_len)
+        totals = self._totals
+        while totals and totals[0][0] <= index - self._samples:
+            totals.popleft()
+        return index
+
+    def record(self, value=1):
+        index = self._rotate(self._time())
+        totals = self._totals
+        if totals and totals[-1][0] == index:
+            totals[-1][1] += value
+        else:
+            totals.append([index, value])
+
+    def value(self):
+        now = self._time()
+        self._rotate(now)
+        elapsed = min(self._window, now - self._created)
+        if elapsed <= 0:
+            return 0.0
+        return sum(total for _, total in self._totals) / elapsed
+
+
+class Histogram:
+    """ Distribution of recorded values over fixed buckets. Memory usage does
+    not depend on the number of recorded values, quantiles are estimated by
+    interpolating inside a bucket.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        # Last one is for values above the highest bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+        self.max = None
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """ Estimate the value below which ``q`` (0..1) of recorded values
+        fall. Returns None if nothing was recorded.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if not count or seen + count < rank:
+                seen += count
+                continue
+            lower = self.buckets[i - 1] if i > 0 else 0
+            upper = self.buckets[i] if i < len(self.buckets) else self.max
+            upper = min(upper, self.max)
+            lower = min(lower, upper)
+            return lower + (upper - lower) * (rank - seen) / count
+        return self.max
+
+    def value(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+        }
+
+
+class _NoopInstrument:
+    """ Returned by disabled registry, so instrumented code does not need to
+    check whether metrics are enabled.
+    """
+
+    def inc(self, amount=1):
+        pass
+
+    def record(self, value=1):
+        pass
+
+
+_NOOP = _NoopInstrument()
+
+
+class Metrics:
+    """ Registry of client metrics. Pass the same instance as ``metrics`` to
+    producers and consumers to collect their metrics in one place::
+
+        metrics = Metrics()
+        producer = AIOKafkaProducer(loop=loop, metrics=metrics)
+        ...
+        print(metrics.to_prometheus())
+
+    Instruments are identified by name and tags. Requesting an instrument,
+    that already exists, returns the existing one.
+
+    Arguments:
+        enabled (bool): if False, no values are recorded and all instruments
+            are no-op objects. Default: True
+        rate_window_ms (int): length of the sliding window of rate metrics.
+            Default: 30000
+        rate_samples (int): number of parts the rate window is split into.
+            Default: 2
+        time_fn (callable): clock used by rate metrics.
+            Default: time.monotonic
+    """
+
+    def __init__(self, *, enabled=True, rate_window_ms=30000, rate_samples=2,
+                 time_fn=time.monotonic):
+        self.enabled = enabled
+        self._rate_window = rate_window_ms / 1000
+        self._rate_samples = rate_samples
+        self._time_fn = time_fn
+        self._tags = ()
+        # name => (kind, description)
+        self._families = collections.OrderedDict()
+        # (name, tags) => instrument
+        self._instruments = collections.OrderedDict()
+
+    def with_tags(self, **tags):
+        """ Return a view of this registry, that adds ``tags`` to all
+        instruments created through it.
+        """
+        view = object.__new__(Metrics)
+        view.__dict__.update(self.__dict__)
+        view._tags = self._merge_tags(tags)
+        return view
+
+    def _merge_tags(self, tags):
+        merged = dict(self._tags)
+        merged.update(tags)
+        return tuple(sorted(
+            (key, str(value)) for key, value in merged.items()))
+
+    def _get(self, kind, name, description, tags, factory, replace=False):
+        if not self.enabled:
+            return _NOOP
+        family = self._families.get(name)
+        if family is None:
+            self._families[name] = (kind, description)
+        elif family[0] != kind:
+            raise ValueError(
+                "Metric {} is already registered as {}".format(
+                    name, family[0]))
+        key = (name, self._merge_tags(tags))
+        instrument = self._instruments.get(key)
+        if instrument is None or replace:
+            instrument = self._instruments[key] = factory()
+        return instrument
+
+    def counter(self, name, description="", **tags):
+        """ Get or create a ``Counter``, use ``inc(amount)`` to increment.
+        """
+        return self._get("counter", name, description, tags, Counter)
+
+    def rate(self, name, description="", **tags):
+        """ Get or create a ``Rate``, use ``record(value)`` to add values.
+        """
+        return self._get(
+            "gauge", name, description, tags,
+            lambda: Rate(
+                self._rate_window, self._rate_samples, self._time_fn))
+
+    def histogram(self, name, description="", buckets=LATENCY_BUCKETS,
+                  **tags):
+        """ Get or create a ``Histogram``, use ``record(value)`` to add
+        values.
+        """
+        return self._get(
+            "histogram", name, description, tags,
+            lambda: Histogram(buckets))
+
+    def gauge(self, name, fn, description="", **tags):
+        """ Register a ``Gauge``, which value is ``fn()`` at collection time.
+        Replaces the previous gauge with the same name and tags.
+        """
+        return self._get(
+            "gauge", name, description, tags, lambda: Gauge(fn),
+            replace=True)
+
+    def remove(self, name, **tags):
+        """ Remove instrument, for example a gauge of a closed component.
+        """
+        self._instruments.pop((name, self._merge_tags(tags)), None)
+
+    def snapshot(self):
+        """ Return current values of all instruments.
+
+        Returns:
+            dict: {(name, tags): value}, where ``tags`` is a sorted tuple of
+                ``(key, value)`` pairs. Histogram values are dicts with
+                ``count``, ``sum``, ``max``, ``p50`` and ``p99`` keys.
+        """
+        return {
+            key: instrument.value()
+            for key, instrument in list(self._instruments.items())
+        }
+
+    def to_prometheus(self):
+        """ Format all instruments in Prometheus text exposition format.
+        """
+        by_name = collections.defaultdict(list)
+        for (name, tags), instrument in list(self._instruments.items()):
+            by_name[name].append((tags, instrument))
+
+        lines = []
+        for name, (kind, description) in self._families.items():
+            samples = []
+            for tags, instrument in by_name.get(name, ()):
+                if kind == "histogram":
+                    samples.extend(_format_histogram(name, tags, instrument))
+                    continue
+                value = instrument.value()
+                if value is not None:
+                    samples.append("{}{} {}".format(
+                        name, _format_tags(tags), _format_value(value)))
+            if not samples:
+                continue
+            if description:
+                lines.append("# HELP {} {}".format(
+                    name, description.replace("\\", "\\\\")
+                    .replace("\n", "\\n")))
+            lines.append("# TYPE {} {}".format(name, kind))
+            lines.extend(samples)
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+def _format_histogram(name, tags, histogram):
+    cumulative = 0
+    bounds = histogram.buckets + ("+Inf",)
+    for bound, count in zip(bounds, histogram.counts):
+        cumulative += count
+        yield "{}_bucket{} {}".format(
+            name, _format_tags(tags + (("le", _format_value(bound)),)),
+            cumulative)
+    yield "{}_sum{} {}".format(
+        name, _format_tags(tags), _format_value(histogram.sum))
+    yield "{}_count{} {}".format(
+        name, _format_tags(tags), histogram.count)
+
+
+def _format_value(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, float):
+        if value == float("inf"):
+            return "+Inf"
+        return repr(value)
+    return str(value)
+
+
+def _format_tags(tags):
+    if not tags:
+        return ""
+    return "{" + ",".join(
+        '{}="{}"'.format(key, value.replace("\\", "\\\\")
+                         .replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in tags) + "}"
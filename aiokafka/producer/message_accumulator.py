@@ -1,6 +1,8 @@
 import asyncio
 import collections
+import heapq
 import io
+import itertools
 import copy
 
 from kafka.protocol.types import Int32
@@ -9,6 +11,8 @@ from aiokafka.errors import (KafkaTimeoutError,
                              NotLeaderForPartitionError,
                              LeaderNotAvailableError,
                              ProducerClosed)
+from aiokafka.metrics import (
+    Metrics, SIZE_BUCKETS, COUNT_BUCKETS, RATIO_BUCKETS)
 from aiokafka.record.legacy_records import LegacyRecordBatchBuilder
 from aiokafka.structs import RecordMetadata
 from aiokafka.util import create_future
@@ -21,6 +25,7 @@ class BatchBuilder:
         self._relative_offset = 0
         self._buffer = None
         self._closed = False
+        self._uncompressed_size = None
 
     def append(self, *, timestamp, key, value):
         """Add a message to the batch.
@@ -67,6 +72,7 @@ class BatchBuilder:
         if self._closed:
             return
         self._closed = True
+        self._uncompressed_size = self._builder.size()
         data = self._builder.build()
         self._buffer = io.BytesIO(Int32.encode(len(data)) + data)
         del self._builder
@@ -87,6 +93,12 @@ class BatchBuilder:
         """Get the number of records in the batch."""
         return self._relative_offset
 
+    def compression_ratio(self):
+        """Get compressed to uncompressed size ratio of a closed batch."""
+        if not self._closed or not self._uncompressed_size:
+            return None
+        return self.size() / self._uncompressed_size
+
 
 class MessageBatch:
     """This class incapsulate operations with batch of produce messages"""
@@ -183,6 +195,10 @@ class MessageBatch:
         """Check that batch is expired or not"""
         return (self._loop.time() - self._ctime) > self._ttl
 
+    def deadline(self):
+        """Loop time after which the batch is expired"""
+        return self._ctime + self._ttl
+
     def drain_ready(self):
         """Compress batch to be ready for send"""
         if not self._drain_waiter.done():
@@ -199,8 +215,13 @@ class MessageAccumulator:
 
     Producer adds messages to this accumulator and a background send task
     gets batches per nodes to process it.
+
+    Partitions with pending batches are indexed by leader node, so draining
+    only touches nodes, that have data and are not ignored. The index is
+    rebuilt on cluster metadata updates.
     """
-    def __init__(self, cluster, batch_size, compression_type, batch_ttl, loop):
+    def __init__(self, cluster, batch_size, compression_type, batch_ttl, loop,
+                 *, metrics=None, watchdog=None):
         self._batches = collections.defaultdict(collections.deque)
         self._cluster = cluster
         self._batch_size = batch_size
@@ -210,6 +231,42 @@ class MessageAccumulator:
         self._wait_data_future = create_future(loop=loop)
         self._closed = False
         self._api_version = (0, 9)
+        self._watchdog = watchdog
+
+        # Leader node id => set of partitions with pending batches
+        self._ready_nodes = collections.defaultdict(set)
+        # Partitions with pending batches, but no known leader
+        self._no_leader_tps = set()
+        self._tp_leaders = {}
+        # Heap of (deadline, seq, tp) for first pending batches of partitions
+        # without leader. Entries are not removed if the partition gets a
+        # leader, those are just skipped.
+        self._expiry_heap = []
+        self._expiry_seq = itertools.count()
+
+        cluster.add_listener(self._handle_metadata_update)
+
+        if metrics is None:
+            metrics = Metrics(enabled=False)
+        self._metrics = metrics
+        self._batch_size_sensor = metrics.histogram(
+            "aiokafka_producer_batch_size_bytes", "Size of sent batches",
+            buckets=SIZE_BUCKETS)
+        self._batch_records_sensor = metrics.histogram(
+            "aiokafka_producer_batch_records", "Records in sent batches",
+            buckets=COUNT_BUCKETS)
+        self._compression_sensor = metrics.histogram(
+            "aiokafka_producer_compression_ratio",
+            "Compressed to uncompressed size ratio of sent batches",
+            buckets=RATIO_BUCKETS)
+        self._records_sensor = metrics.counter(
+            "aiokafka_producer_records_total", "Records sent")
+        self._record_rate_sensor = metrics.rate(
+            "aiokafka_producer_record_send_rate", "Records sent per second")
+        metrics.gauge(
+            "aiokafka_producer_buffered_batches",
+            lambda: sum(map(len, self._batches.values())),
+            "Batches waiting to be sent")
 
     def set_api_version(self, api_version):
         self._api_version = api_version
@@ -225,6 +282,8 @@ class MessageAccumulator:
     def close(self):
         self._closed = True
         yield from self.flush()
+        self._cluster.remove_listener(self._handle_metadata_update)
+        self._metrics.remove("aiokafka_producer_buffered_batches")
 
     @asyncio.coroutine
     def add_message(self, tp, key, value, timeout, timestamp_ms=None):
@@ -263,40 +322,100 @@ class MessageAccumulator:
         """
         return self._wait_data_future
 
+    def _handle_metadata_update(self, cluster):
+        self._tp_leaders.clear()
+        self._ready_nodes.clear()
+        self._no_leader_tps.clear()
+        for tp, batches in self._batches.items():
+            if batches:
+                self._add_ready_tp(tp)
+
+    def _add_ready_tp(self, tp):
+        """ Index partition, that has pending batches, by it's leader """
+        leader = self._tp_leaders.get(tp)
+        if leader is None:
+            leader = self._cluster.leader_for_partition(tp)
+            if leader is None or leader == -1:
+                self._no_leader_tps.add(tp)
+                self._push_deadline(tp)
+                return
+            self._tp_leaders[tp] = leader
+        self._ready_nodes[leader].add(tp)
+
+    def _push_deadline(self, tp):
+        heapq.heappush(self._expiry_heap, (
+            self._batches[tp][0].deadline(), next(self._expiry_seq), tp))
+
     def _pop_batch(self, tp):
         batch = self._batches[tp].popleft()
-        batch.drain_ready()
+        if self._watchdog is None:
+            batch.drain_ready()
+        else:
+            with self._watchdog.span("compress") as span:
+                batch.drain_ready()
+                span.size = batch._builder.size()
         if len(self._batches[tp]) == 0:
             del self._batches[tp]
+        elif tp in self._no_leader_tps:
+            self._push_deadline(tp)
         return batch
 
     def reenqueue(self, batch):
         tp = batch._tp
         self._batches[tp].appendleft(batch)
+        if len(self._batches[tp]) == 1:
+            self._add_ready_tp(tp)
+        elif tp in self._no_leader_tps:
+            self._push_deadline(tp)
+
+    def _expire_batches(self):
+        """ Fail expired batches of partitions without a leader """
+        heap = self._expiry_heap
+        now = self._loop.time()
+        while heap and heap[0][0] < now:
+            _, _, tp = heapq.heappop(heap)
+            if tp not in self._no_leader_tps:
+                continue
+            pending = self._batches.get(tp)
+            if not pending or not pending[0].expired():
+                continue
+            # batch is for partition is expired and still no leader,
+            # so set exception for batch and pop it
+            batch = self._pop_batch(tp)
+            if self._cluster.leader_for_partition(tp) is None:
+                err = NotLeaderForPartitionError()
+            else:
+                err = LeaderNotAvailableError()
+            batch.failure(exception=err)
+            if tp not in self._batches:
+                self._no_leader_tps.discard(tp)
 
     def drain_by_nodes(self, ignore_nodes):
         """ Group batches by leader to partiton nodes. """
-        nodes = collections.defaultdict(dict)
-        unknown_leaders_exist = False
-        for tp in list(self._batches.keys()):
+        # Leaders for those can be known without a metadata update (ie. if
+        # metadata was updated for another accumulator)
+        for tp in list(self._no_leader_tps):
             leader = self._cluster.leader_for_partition(tp)
-            if leader is None or leader == -1:
-                if self._batches[tp][0].expired():
-                    # batch is for partition is expired and still no leader,
-                    # so set exception for batch and pop it
-                    batch = self._pop_batch(tp)
-                    if leader is None:
-                        err = NotLeaderForPartitionError()
-                    else:
-                        err = LeaderNotAvailableError()
-                    batch.failure(exception=err)
-                unknown_leaders_exist = True
-                continue
-            elif ignore_nodes and leader in ignore_nodes:
-                continue
+            if leader is not None and leader != -1:
+                self._no_leader_tps.discard(tp)
+                self._tp_leaders[tp] = leader
+                self._ready_nodes[leader].add(tp)
+        self._expire_batches()
+        unknown_leaders_exist = bool(self._no_leader_tps)
 
-            batch = self._pop_batch(tp)
-            nodes[leader][tp] = batch
+        nodes = collections.defaultdict(dict)
+        for leader in list(self._ready_nodes):
+            if ignore_nodes and leader in ignore_nodes:
+                continue
+            node_batches = nodes[leader]
+            tps = self._ready_nodes.pop(leader)
+            for tp in tps:
+                batch = node_batches[tp] = self._pop_batch(tp)
+                if self._metrics.enabled:
+                    self._record_batch(batch._builder)
+            still_ready = {tp for tp in tps if self._batches.get(tp)}
+            if still_ready:
+                self._ready_nodes[leader] = still_ready
 
         # all batches are drained from accumulator
         # so create "wait data" future again for waiting new data in send
@@ -307,6 +426,16 @@ class MessageAccumulator:
 
         return nodes, unknown_leaders_exist
 
+    def _record_batch(self, builder):
+        count = builder.record_count()
+        self._records_sensor.inc(count)
+        self._record_rate_sensor.record(count)
+        self._batch_records_sensor.record(count)
+        self._batch_size_sensor.record(builder.size())
+        ratio = builder.compression_ratio()
+        if ratio is not None:
+            self._compression_sensor.record(ratio)
+
     def create_builder(self):
         magic = 0 if self._api_version < (0, 10) else 1
         return BatchBuilder(magic, self._batch_size, self._compression_type)
@@ -314,6 +443,8 @@ class MessageAccumulator:
     def _append_batch(self, builder, tp):
         batch = MessageBatch(tp, builder, self._batch_ttl, self._loop)
         self._batches[tp].append(batch)
+        if len(self._batches[tp]) == 1:
+            self._add_ready_tp(tp)
         if not self._wait_data_future.done():
             self._wait_data_future.set_result(None)
         return batch
@@ -7,7 +7,7 @@ from kafka.protocol.produce import ProduceRequest
 from kafka.codec import has_gzip, has_snappy, has_lz4
 
 import aiokafka.errors as Errors
-from aiokafka.client import AIOKafkaClient
+from aiokafka.client import AIOKafkaClient, ConnectionGroup, SharedClient
 from aiokafka.errors import (
     MessageSizeTooLargeError, KafkaError, UnknownTopicOrPartitionError)
 from aiokafka.record.legacy_records import LegacyRecordBatchBuilder
@@ -132,6 +132,35 @@ class AIOKafkaProducer(object):
         connections_max_idle_ms (int): Close idle connections after the number
             of milliseconds specified by this config. Specifying `None` will
             disable idle checks. Default: 540000 (9hours).
+        metrics (Metrics): registry to record producer metrics in, see
+            :class:`aiokafka.metrics.Metrics`. Metrics are not collected by
+            default. Default: None
+        request_tracer (AbstractRequestTracer): hook called on each request
+            sent to brokers and each response received, see
+            :mod:`aiokafka.tracing`. Default: None
+        watchdog (LoopWatchdog): detector of event loop stalls, that times
+            serialization and compression of batches, see
+            :mod:`aiokafka.watchdog`. Default: None
+        connections_per_broker (int): number of connections to open to each
+            broker for produce requests. Produce requests use connections
+            separate from metadata requests. Default: 1
+        socket_options (dict): {ConnectionGroup: dict} socket options per
+            traffic class, see :class:`aiokafka.AIOKafkaClient`.
+            Default: None
+        metadata_cache (MetadataCache): on-disk cache of broker version and
+            cluster metadata for faster startup, see
+            :class:`aiokafka.metadata_cache.MetadataCache`. Default: None
+        warm_up_connections (bool or list of str): open produce connections
+            in ``start()``, so the first batches don't wait for connection
+            handshakes. If True, connections to leaders of all topics known
+            after bootstrap are opened, if a list of topics is given, only
+            to their leaders. Default: False
+        client (AIOKafkaClient): existing client to share broker
+            connections and cluster metadata with other producers and
+            consumers. Connection related options of this producer
+            (``bootstrap_servers``, ``client_id``, ``metrics``,
+            ``connections_per_broker`` etc.) are ignored in that case, the
+            client's configuration is used. Default: None
 
     Note:
         Many configuration parameters are taken from the Java client:
@@ -154,7 +183,11 @@ class AIOKafkaProducer(object):
                  partitioner=DefaultPartitioner(), max_request_size=1048576,
                  linger_ms=0, send_backoff_ms=100,
                  retry_backoff_ms=100, security_protocol="PLAINTEXT",
-                 ssl_context=None, connections_max_idle_ms=540000):
+                 ssl_context=None, connections_max_idle_ms=540000,
+                 metrics=None, request_tracer=None, watchdog=None,
+                 connections_per_broker=1, socket_options=None,
+                 metadata_cache=None, warm_up_connections=False,
+                 client=None):
         if acks not in (0, 1, -1, 'all'):
             raise ValueError("Invalid ACKS parameter")
         if compression_type not in ('gzip', 'snappy', 'lz4', None):
@@ -185,19 +218,44 @@ class AIOKafkaProducer(object):
         self._partitioner = partitioner
         self._max_request_size = max_request_size
         self._request_timeout_ms = request_timeout_ms
+        self._warm_up_connections = warm_up_connections
 
-        self.client = AIOKafkaClient(
-            loop=loop, bootstrap_servers=bootstrap_servers,
-            client_id=client_id, metadata_max_age_ms=metadata_max_age_ms,
-            request_timeout_ms=request_timeout_ms,
-            retry_backoff_ms=retry_backoff_ms,
-            api_version=api_version, security_protocol=security_protocol,
-            ssl_context=ssl_context,
-            connections_max_idle_ms=connections_max_idle_ms)
+        if client is not None:
+            if client._loop is not loop:
+                raise ValueError("Shared client should use the same loop")
+            self.client = SharedClient(client)
+        else:
+            self.client = AIOKafkaClient(
+                loop=loop, bootstrap_servers=bootstrap_servers,
+                client_id=client_id, metadata_max_age_ms=metadata_max_age_ms,
+                request_timeout_ms=request_timeout_ms,
+                retry_backoff_ms=retry_backoff_ms,
+                api_version=api_version, security_protocol=security_protocol,
+                ssl_context=ssl_context,
+                connections_max_idle_ms=connections_max_idle_ms,
+                metrics=metrics,
+                request_tracer=request_tracer,
+                watchdog=watchdog,
+                connections_per_broker={
+                    ConnectionGroup.PRODUCE: connections_per_broker},
+                socket_options=socket_options,
+                metadata_cache=metadata_cache)
+        self._watchdog = self.client.watchdog
         self._metadata = self.client.cluster
         self._message_accumulator = MessageAccumulator(
             self._metadata, max_batch_size, compression_attrs,
-            self._request_timeout_ms / 1000, loop)
+            self._request_timeout_ms / 1000, loop,
+            metrics=self.client.metrics, watchdog=self._watchdog)
+        self._request_latency_sensor = self.client.metrics.histogram(
+            "aiokafka_producer_request_latency_seconds",
+            "Time to send a produce request and process the response")
+        self._error_sensor = self.client.metrics.counter(
+            "aiokafka_producer_errors_total", "Batches failed to be sent")
+        self._retry_sensor = self.client.metrics.counter(
+            "aiokafka_producer_retries_total", "Batches retried")
+        self._throttle_sensor = self.client.metrics.histogram(
+            "aiokafka_producer_throttle_time_seconds",
+            "Time produce requests were throttled by the broker due to quotas")
         self._sender_task = None
         self._in_flight = set()
         self._closed = False
@@ -220,8 +278,21 @@ class AIOKafkaProducer(object):
             self._sender_routine(), loop=self._loop)
         self._message_accumulator.set_api_version(self.client.api_version)
         self._producer_magic = 0 if self.client.api_version < (0, 10) else 1
+        if self._warm_up_connections:
+            yield from self._warm_up()
         log.debug("Kafka producer started")
 
+    @asyncio.coroutine
+    def _warm_up(self):
+        topics = None
+        if self._warm_up_connections is not True:
+            topics = list(self._warm_up_connections)
+            yield from asyncio.gather(*[
+                self.client._wait_on_metadata(topic) for topic in topics
+            ], loop=self._loop)
+        yield from self.client.warm_up_connections(
+            topics, group=ConnectionGroup.PRODUCE)
+
     @asyncio.coroutine
     def flush(self):
         """Wait untill all batches are Delivered and futures resolved"""
@@ -297,7 +368,12 @@ class AIOKafkaProducer(object):
         # first make sure the metadata for the topic is available
         yield from self.client._wait_on_metadata(topic)
 
-        key_bytes, value_bytes = self._serialize(topic, key, value)
+        if self._watchdog is None:
+            key_bytes, value_bytes = self._serialize(topic, key, value)
+        else:
+            with self._watchdog.span("serialize") as span:
+                key_bytes, value_bytes = self._serialize(topic, key, value)
+                span.size = len(key_bytes or b"") + len(value_bytes or b"")
         partition = self._partition(topic, partition, key, value,
                                     key_bytes, value_bytes)
 
@@ -401,29 +477,29 @@ class AIOKafkaProducer(object):
                 (tp.partition, batch.get_data_buffer())
             )
 
-        if self.client.api_version >= (0, 10):
-            version = 2
-        elif self.client.api_version == (0, 9):
-            version = 1
-        else:
-            version = 0
-
+        # Versions 3+ require message format v2
+        version = self.client.pick_version(
+            ProduceRequest[0].API_KEY, (0, 2), node_id)
         request = ProduceRequest[version](
             required_acks=self._acks,
             timeout=self._request_timeout_ms,
             topics=list(topics.items()))
 
         reenqueue = []
+        throttle = 0
         try:
-            response = yield from self.client.send(node_id, request)
+            response = yield from self.client.send(
+                node_id, request, group=ConnectionGroup.PRODUCE)
         except KafkaError as err:
             log.warning(
                 "Got error produce response: %s", err)
             if getattr(err, "invalid_metadata", False):
-                self.client.force_metadata_update()
+                self.client.force_metadata_update(
+                    {tp.topic for tp in batches})
 
             for batch in batches.values():
                 if not self._can_retry(err, batch):
+                    self._error_sensor.inc()
                     batch.failure(exception=err)
                 else:
                     reenqueue.append(batch)
@@ -433,6 +509,12 @@ class AIOKafkaProducer(object):
                 for batch in batches.values():
                     batch.done_noack()
             else:
+                if response.API_VERSION >= 1 and response.throttle_time_ms > 0:
+                    throttle = response.throttle_time_ms / 1000
+                    self._throttle_sensor.record(throttle)
+                    log.info(
+                        "Produce request to node %s was throttled by %d ms",
+                        node_id, response.throttle_time_ms)
                 for topic, partitions in response.topics:
                     for partition_info in partitions:
                         if response.API_VERSION < 2:
@@ -451,6 +533,7 @@ class AIOKafkaProducer(object):
                         if error is Errors.NoError:
                             batch.done(offset, timestamp)
                         elif not self._can_retry(error(), batch):
+                            self._error_sensor.inc()
                             batch.failure(exception=error())
                         else:
                             log.warning(
@@ -458,10 +541,14 @@ class AIOKafkaProducer(object):
                                 " %s, retrying. Error: %s", tp, error)
                             # Ok, we can retry this batch
                             if getattr(error, "invalid_metadata", False):
-                                self.client.force_metadata_update()
+                                self.client.force_metadata_update(
+                                    [tp.topic])
                             reenqueue.append(batch)
 
+        self._request_latency_sensor.record(self._loop.time() - t0)
+
         if reenqueue:
+            self._retry_sensor.inc(len(reenqueue))
             # Wait backoff before reequeue
             yield from asyncio.sleep(self._retry_backoff, loop=self._loop)
 
@@ -472,8 +559,11 @@ class AIOKafkaProducer(object):
             yield from self.client._maybe_wait_metadata()
 
         # if batches for node is processed in less than a linger seconds
-        # then waiting for the remaining time
-        sleep_time = self._linger_time - (self._loop.time() - t0)
+        # then waiting for the remaining time. If the broker throttled us due
+        # to quota violation, don't send to the node until the throttle time
+        # passes.
+        sleep_time = max(
+            self._linger_time - (self._loop.time() - t0), throttle)
         if sleep_time > 0:
             yield from asyncio.sleep(sleep_time, loop=self._loop)
 
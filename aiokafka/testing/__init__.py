@@ -0,0 +1,4 @@
+from .fake_broker import FakeBroker
+
+
+__all__ = ["FakeBroker"]
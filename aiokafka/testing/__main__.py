@@ -0,0 +1,63 @@
+""" Run a fake broker in a separate process::
+
+    python -m aiokafka.testing --port 9092 --topic test:4 --latency-ms 1
+
+The first line printed to stdout is ``Listening on <host>:<port>``, so
+scripts can pick a free port with ``--port 0`` and parse the address.
+"""
+import argparse
+import asyncio
+import signal
+import sys
+
+from aiokafka.testing.fake_broker import FakeBroker
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='In-memory Kafka broker for tests and benchmarks')
+    parser.add_argument(
+        '--host', default="127.0.0.1",
+        help='Address to listen on. Default {default}.')
+    parser.add_argument(
+        '--port', type=int, default=9092,
+        help='Port to listen on, 0 picks a free one. Default {default}.')
+    parser.add_argument(
+        '--topic', action='append', default=[],
+        help='Topic to create as `name:partitions`. Can be repeated.')
+    parser.add_argument(
+        '--num-partitions', type=int, default=1,
+        help='Partitions of automatically created topics. '
+             'Default {default}.')
+    parser.add_argument(
+        '--latency-ms', type=int, default=0,
+        help='Delay before each response. Default {default}.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    topics = {}
+    for topic in args.topic:
+        name, _, partitions = topic.partition(":")
+        topics[name] = int(partitions or args.num_partitions)
+
+    loop = asyncio.get_event_loop()
+    broker = FakeBroker(
+        loop=loop, host=args.host, port=args.port, topics=topics,
+        num_partitions=args.num_partitions, latency_ms=args.latency_ms)
+    loop.run_until_complete(broker.start())
+    print("Listening on {}".format(broker.bootstrap_servers))
+    sys.stdout.flush()
+
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    loop.add_signal_handler(signal.SIGINT, loop.stop)
+    try:
+        loop.run_forever()
+    finally:
+        loop.run_until_complete(broker.close())
+        loop.close()
+
+
+if __name__ == "__main__":
+    main()
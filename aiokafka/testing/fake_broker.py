@@ -0,0 +1,988 @@
+import asyncio
+import bisect
+import collections
+import logging
+import struct
+import uuid
+from io import BytesIO
+
+from kafka.protocol.admin import ApiVersionRequest
+from kafka.protocol.api import Request
+from kafka.protocol.commit import GroupCoordinatorRequest, OffsetFetchRequest
+from kafka.protocol.group import LeaveGroupRequest
+from kafka.protocol.metadata import MetadataRequest
+from kafka.protocol.offset import OffsetRequest
+from kafka.protocol.produce import ProduceRequest
+from kafka.protocol.types import (
+    Array, Bytes, Int16, Int32, Schema, String)
+
+import aiokafka.errors as Errors
+from aiokafka.consumer.fetch import FetchRequest
+from aiokafka.consumer.group_protocol import (
+    HeartbeatRequest, JoinGroupRequest, OffsetCommitRequest, SyncGroupRequest)
+from aiokafka.record.legacy_records import (
+    LegacyRecordBase, LegacyRecordBatch, LegacyRecordBatchBuilder)
+from aiokafka.structs import TopicPartition
+from aiokafka.util import create_future, ensure_future
+
+log = logging.getLogger(__name__)
+
+
+class _ProduceRequest(Request):
+    """ ProduceRequest v0-v2 with record data kept as raw bytes, instead of
+    being parsed into a MessageSet.
+    """
+    API_KEY = 0
+    SCHEMA = Schema(
+        ('required_acks', Int16),
+        ('timeout', Int32),
+        ('topics', Array(
+            ('topic', String('utf-8')),
+            ('partitions', Array(
+                ('partition', Int32),
+                ('messages', Bytes)))))
+    )
+
+
+def _raw_produce_request(version):
+    return type(
+        "_ProduceRequest_v{}".format(version), (_ProduceRequest, ), {
+            "API_VERSION": version,
+            "RESPONSE_TYPE": ProduceRequest[version].RESPONSE_TYPE})
+
+
+# api_key => list of request classes indexed by version
+_REQUESTS = {
+    0: [_raw_produce_request(version) for version in range(3)],
+    1: FetchRequest[:4],
+    2: OffsetRequest[:2],
+    3: MetadataRequest[:3],
+    8: OffsetCommitRequest,
+    9: OffsetFetchRequest[:2],
+    10: GroupCoordinatorRequest[:1],
+    11: JoinGroupRequest,
+    12: HeartbeatRequest,
+    13: LeaveGroupRequest[:1],
+    14: SyncGroupRequest,
+    18: ApiVersionRequest[:1],
+}
+
+_HEADER = struct.Struct(">hhi")  # api_key, api_version, correlation_id
+_SIZE = struct.Struct(">i")
+_ENTRY_HEADER = struct.Struct(">qi")  # offset, size
+_MAGIC_OFFSET = _ENTRY_HEADER.size + 4  # after CRC
+_TIMESTAMP = struct.Struct(">q")
+
+
+class _LogChunk:
+    """ Record data of one produce request. ``offsets`` holds the offset of
+    each entry (the last offset for compressed wrappers) and ``positions``
+    its start in ``data``.
+    """
+
+    __slots__ = ("data", "offsets", "positions", "timestamps")
+
+    def __init__(self, data, offsets, positions, timestamps):
+        self.data = data
+        self.offsets = offsets
+        self.positions = positions
+        self.timestamps = timestamps
+
+
+class _PartitionLog:
+    """ In-memory log of a single partition. Accepts legacy (v0 and v1)
+    message sets and assigns offsets the same way the broker does.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._last_offsets = []
+        self.highwater = 0
+
+    def append(self, data):
+        data = bytearray(data)
+        offsets = []
+        positions = []
+        timestamps = []
+        base_offset = offset = self.highwater
+        pos = 0
+        parts = []
+        while pos < len(data):
+            if pos + _ENTRY_HEADER.size > len(data):
+                raise Errors.CorruptRecordException()
+            _, size = _ENTRY_HEADER.unpack_from(data, pos)
+            end = pos + _ENTRY_HEADER.size + size
+            if size < 6 or end > len(data):
+                raise Errors.CorruptRecordException()
+            entry = data[pos:end]
+            magic = entry[_MAGIC_OFFSET]
+            attrs = entry[_MAGIC_OFFSET + 1]
+            if magic not in (0, 1) or \
+                    not LegacyRecordBatch(bytes(entry), magic).validate_crc():
+                raise Errors.CorruptRecordException()
+            if attrs & LegacyRecordBase.CODEC_MASK:
+                entry, offset, timestamp = self._append_wrapper(
+                    entry, magic, attrs, offset)
+            else:
+                struct.pack_into(">q", entry, 0, offset)
+                if magic > 0:
+                    timestamp, = _TIMESTAMP.unpack_from(
+                        entry, _MAGIC_OFFSET + 2)
+                else:
+                    timestamp = -1
+                offset += 1
+            positions.append(sum(map(len, parts)))
+            offsets.append(offset - 1)
+            timestamps.append(timestamp)
+            parts.append(entry)
+            pos = end
+
+        if not parts:
+            return base_offset
+        self._chunks.append(_LogChunk(
+            bytes(b"".join(parts)), offsets, positions, timestamps))
+        self._last_offsets.append(offset - 1)
+        self.highwater = offset
+        return base_offset
+
+    def _append_wrapper(self, entry, magic, attrs, offset):
+        records = list(LegacyRecordBatch(bytes(entry), magic))
+        if not records:
+            raise Errors.CorruptRecordException()
+        last_offset = offset + len(records) - 1
+        if magic == 0:
+            timestamp = -1
+            # Inner messages of v0 wrappers have absolute offsets, so those
+            # have to be rewritten and compressed again.
+            codec = attrs & LegacyRecordBase.CODEC_MASK
+            builder = LegacyRecordBatchBuilder(
+                magic=0, compression_type=codec, batch_size=2 ** 31 - 1)
+            for i, record in enumerate(records):
+                builder.append(
+                    offset=offset + i, timestamp=None,
+                    key=record.key, value=record.value)
+            entry = bytearray(builder.build())
+        else:
+            timestamp = max(record.timestamp for record in records)
+        # Wrapper offset is the offset of the last inner message
+        struct.pack_into(">q", entry, 0, last_offset)
+        return entry, last_offset + 1, timestamp
+
+    def read(self, offset, max_bytes):
+        """ Return record data starting from the entry, that contains
+        ``offset``. At least one entry is returned, even if it's bigger than
+        ``max_bytes``.
+        """
+        index = bisect.bisect_left(self._last_offsets, offset)
+        parts = []
+        size = 0
+        for chunk in self._chunks[index:]:
+            start = chunk.positions[
+                bisect.bisect_left(chunk.offsets, offset)] if not parts else 0
+            end = len(chunk.data)
+            if size + end - start > max_bytes:
+                # Cut at entry boundary, but return at least one entry
+                i = bisect.bisect_right(
+                    chunk.positions, start + max_bytes - size)
+                if i < len(chunk.positions):
+                    end = chunk.positions[i]
+                if end <= start:
+                    if parts:
+                        break
+                    end = chunk.positions[i] \
+                        if i < len(chunk.positions) else len(chunk.data)
+                parts.append(chunk.data[start:end])
+                break
+            parts.append(chunk.data[start:end])
+            size += end - start
+        return b"".join(parts)
+
+    def offset_for_time(self, timestamp):
+        """ Return (timestamp, offset) of the first entry with timestamp
+        greater or equal to ``timestamp`` or (-1, -1) if there's none.
+        """
+        for chunk in self._chunks:
+            for i, entry_ts in enumerate(chunk.timestamps):
+                if entry_ts >= timestamp:
+                    first_offset = chunk.offsets[i - 1] + 1 if i else None
+                    if first_offset is None:
+                        first_offset = self._chunk_base(chunk)
+                    return entry_ts, first_offset
+        return -1, -1
+
+    def _chunk_base(self, chunk):
+        index = self._chunks.index(chunk)
+        if index == 0:
+            return 0
+        return self._chunks[index - 1].offsets[-1] + 1
+
+    def records(self):
+        result = []
+        for chunk in self._chunks:
+            for i, pos in enumerate(chunk.positions):
+                end = chunk.positions[i + 1] \
+                    if i + 1 < len(chunk.positions) else len(chunk.data)
+                entry = chunk.data[pos:end]
+                result.extend(LegacyRecordBatch(entry, entry[_MAGIC_OFFSET]))
+        return result
+
+
+def _join_response(version, error_type, generation=-1, protocol="",
+                   leader_id="", member_id="", members=()):
+    """ JoinGroup response of the given version. ``members`` are
+    (member_id, group_instance_id, metadata) tuples.
+    """
+    if version < 5:
+        members = [(m_id, metadata) for m_id, _, metadata in members]
+    fields = [error_type.errno, generation, protocol, leader_id, member_id,
+              list(members)]
+    if version >= 2:
+        fields.insert(0, 0)  # throttle_time_ms
+    return JoinGroupRequest[version].RESPONSE_TYPE(*fields)
+
+
+class _Member:
+
+    def __init__(self, member_id, client_id, session_timeout, protocols, *,
+                 loop, group_instance_id=None):
+        self.member_id = member_id
+        self.client_id = client_id
+        self.group_instance_id = group_instance_id
+        self.join_version = 0
+        self.session_timeout = session_timeout / 1000
+        self.protocols = protocols
+        self.last_seen = loop.time()
+        self.join_future = None
+        self.sync_future = None
+        self.assignment = b""
+
+
+class _Group:
+    """ Group membership state machine, that follows the broker's
+    ``GroupCoordinator`` closely enough for client tests.
+    """
+
+    EMPTY = "Empty"
+    PREPARING_REBALANCE = "PreparingRebalance"
+    AWAITING_SYNC = "AwaitingSync"
+    STABLE = "Stable"
+
+    def __init__(self, group_id, *, loop):
+        self.group_id = group_id
+        self.state = self.EMPTY
+        self.generation = 0
+        self.protocol = None
+        self.leader_id = None
+        self.members = collections.OrderedDict()
+        # group_instance_id => member_id of static members
+        self.static_members = {}
+        self.offsets = {}
+        self._loop = loop
+        self._rebalance_task = None
+
+    def _error_response(self, request, error_type):
+        return _join_response(
+            request.API_VERSION, error_type, member_id=request.member_id)
+
+    @asyncio.coroutine
+    def join(self, request, client_id):
+        member_id = request.member_id
+        instance_id = getattr(request, "group_instance_id", None)
+        if member_id and instance_id is not None and \
+                self.static_members.get(instance_id, member_id) != member_id:
+            return self._error_response(request, Errors.FencedInstanceIdError)
+        if member_id and member_id not in self.members:
+            return self._error_response(request, Errors.UnknownMemberIdError)
+        if self.members and request.protocol_type != "consumer" and \
+                self.protocol is None:
+            return self._error_response(
+                request, Errors.InconsistentGroupProtocolError)
+        protocols = collections.OrderedDict(request.group_protocols)
+        if not member_id and instance_id in self.static_members:
+            # Restarted static member takes over its previous membership
+            leader_id = self.leader_id
+            member_id = "{}-{}".format(client_id, uuid.uuid4())
+            member = self._replace_static_member(instance_id, member_id)
+            member.protocols = protocols
+            member.last_seen = self._loop.time()
+            member.join_version = request.API_VERSION
+            if self.state == self.STABLE:
+                # Old leader id is returned, so the member does not perform
+                # an assignment and just fetches its previous one
+                return _join_response(
+                    request.API_VERSION, Errors.NoError, self.generation,
+                    self.protocol, leader_id, member_id)
+        elif not member_id:
+            member_id = "{}-{}".format(client_id, uuid.uuid4())
+            member = self.members[member_id] = _Member(
+                member_id, client_id, request.session_timeout, protocols,
+                loop=self._loop, group_instance_id=instance_id)
+            if instance_id is not None:
+                self.static_members[instance_id] = member_id
+        else:
+            member = self.members[member_id]
+            member.protocols = protocols
+            member.last_seen = self._loop.time()
+
+        if member.join_future is not None and not member.join_future.done():
+            # Duplicate join of the same member replaces the old one
+            member.join_future.set_result(_join_response(
+                member.join_version, Errors.UnknownMemberIdError,
+                member_id=member_id))
+        member.join_version = request.API_VERSION
+        member.join_future = fut = create_future(loop=self._loop)
+        self._prepare_rebalance()
+        self._maybe_complete_join()
+        return (yield from fut)
+
+    def _replace_static_member(self, instance_id, member_id):
+        """ Give the membership of a static member a new member id. Requests
+        with the old member id are fenced after that.
+        """
+        old_member_id = self.static_members[instance_id]
+        member = self.members[old_member_id]
+        if member.join_future is not None and not member.join_future.done():
+            member.join_future.set_result(_join_response(
+                member.join_version, Errors.FencedInstanceIdError,
+                member_id=old_member_id))
+        if member.sync_future is not None and not member.sync_future.done():
+            member.sync_future.set_result(
+                (Errors.FencedInstanceIdError, b""))
+        member.join_future = member.sync_future = None
+
+        member.member_id = member_id
+        self.members = collections.OrderedDict(
+            (member_id if m_id == old_member_id else m_id, m)
+            for m_id, m in self.members.items())
+        self.static_members[instance_id] = member_id
+        if self.leader_id == old_member_id:
+            self.leader_id = member_id
+        return member
+
+    def _prepare_rebalance(self):
+        if self.state == self.PREPARING_REBALANCE:
+            return
+        # Members waiting for assignment should rejoin
+        for member in self.members.values():
+            if member.sync_future is not None and \
+                    not member.sync_future.done():
+                member.sync_future.set_result(
+                    (Errors.RebalanceInProgressError, b""))
+        self.state = self.PREPARING_REBALANCE
+        timeout = max(m.session_timeout for m in self.members.values())
+        self._rebalance_task = ensure_future(
+            self._rebalance_timeout(timeout), loop=self._loop)
+
+    @asyncio.coroutine
+    def _rebalance_timeout(self, timeout):
+        yield from asyncio.sleep(timeout, loop=self._loop)
+        # Members, that did not rejoin in time, are removed from the group
+        for member_id, member in list(self.members.items()):
+            if member.join_future is None or member.join_future.done():
+                del self.members[member_id]
+        self._maybe_complete_join(force=True)
+
+    def _maybe_complete_join(self, force=False):
+        if self.state != self.PREPARING_REBALANCE:
+            return
+        joined = [
+            m for m in self.members.values()
+            if m.join_future is not None and not m.join_future.done()]
+        if not force and len(joined) != len(self.members):
+            return
+        task = self._rebalance_task
+        if task is not None and task is not asyncio.Task.current_task(
+                loop=self._loop):
+            task.cancel()
+        self._rebalance_task = None
+        if not self.members:
+            self.state = self.EMPTY
+            self.generation += 1
+            return
+
+        self.generation += 1
+        self.state = self.AWAITING_SYNC
+        if self.leader_id not in self.members:
+            self.leader_id = next(iter(self.members))
+        leader = self.members[self.leader_id]
+        # First protocol of the leader, supported by all members
+        for name in leader.protocols:
+            if all(name in m.protocols for m in self.members.values()):
+                self.protocol = name
+                break
+        else:
+            self.protocol = next(iter(leader.protocols))
+
+        for member in self.members.values():
+            if member.member_id == self.leader_id:
+                members = [
+                    (m.member_id, m.group_instance_id,
+                     m.protocols.get(self.protocol, b""))
+                    for m in self.members.values()]
+            else:
+                members = []
+            member.join_future.set_result(_join_response(
+                member.join_version, Errors.NoError, self.generation,
+                self.protocol, self.leader_id, member.member_id, members))
+
+    def check_member(self, member_id, generation, group_instance_id=None):
+        """ Return the error type for requests of a group member """
+        if group_instance_id is not None and self.static_members.get(
+                group_instance_id, member_id) != member_id:
+            return Errors.FencedInstanceIdError
+        if member_id not in self.members:
+            return Errors.UnknownMemberIdError
+        if generation != self.generation:
+            return Errors.IllegalGenerationError
+        self.members[member_id].last_seen = self._loop.time()
+        if self.state == self.PREPARING_REBALANCE:
+            return Errors.RebalanceInProgressError
+        return Errors.NoError
+
+    @asyncio.coroutine
+    def sync(self, request):
+        error_type = self.check_member(
+            request.member_id, request.generation_id,
+            getattr(request, "group_instance_id", None))
+        if error_type is not Errors.NoError:
+            return error_type, b""
+        member = self.members[request.member_id]
+        if request.member_id == self.leader_id and \
+                self.state == self.AWAITING_SYNC:
+            assignments = dict(request.group_assignment)
+            for other in self.members.values():
+                other.assignment = assignments.get(other.member_id, b"")
+                if other.sync_future is not None and \
+                        not other.sync_future.done():
+                    other.sync_future.set_result(
+                        (Errors.NoError, other.assignment))
+            self.state = self.STABLE
+        if self.state == self.STABLE:
+            return Errors.NoError, member.assignment
+        member.sync_future = create_future(loop=self._loop)
+        return (yield from member.sync_future)
+
+    def leave(self, member_id):
+        if member_id not in self.members:
+            return Errors.UnknownMemberIdError
+        member = self.members.pop(member_id)
+        if member.group_instance_id is not None:
+            del self.static_members[member.group_instance_id]
+        for fut in (member.join_future, member.sync_future):
+            if fut is not None:
+                fut.cancel()
+        if self.members:
+            self._prepare_rebalance()
+            self._maybe_complete_join()
+        else:
+            self._reset()
+        return Errors.NoError
+
+    def expire_members(self):
+        now = self._loop.time()
+        expired = [
+            member_id for member_id, m in self.members.items()
+            if m.last_seen + m.session_timeout < now and (
+                m.join_future is None or m.join_future.done())]
+        for member_id in expired:
+            log.debug("Member %s of group %s expired", member_id,
+                      self.group_id)
+            self.leave(member_id)
+
+    def _reset(self):
+        if self._rebalance_task is not None:
+            self._rebalance_task.cancel()
+            self._rebalance_task = None
+        if self.state != self.EMPTY:
+            self.generation += 1
+        self.state = self.EMPTY
+        self.leader_id = None
+        self.protocol = None
+
+    def close(self):
+        for member in self.members.values():
+            for fut in (member.join_future, member.sync_future):
+                if fut is not None:
+                    fut.cancel()
+        if self._rebalance_task is not None:
+            self._rebalance_task.cancel()
+
+
+class FakeBroker:
+    """ In-process single node Kafka cluster, that speaks enough of the wire
+    protocol for ``AIOKafkaProducer`` and ``AIOKafkaConsumer`` to work
+    against it. Records are kept in memory. Useful for tests and benchmarks,
+    that should not depend on a real broker::
+
+        broker = FakeBroker(loop=loop, topics={"my_topic": 2})
+        yield from broker.start()
+        producer = AIOKafkaProducer(
+            loop=loop, bootstrap_servers=broker.bootstrap_servers)
+
+    The broker reports itself as Kafka 0.10.1 and supports Metadata,
+    ApiVersions, Produce, Fetch, ListOffsets, GroupCoordinator, JoinGroup,
+    SyncGroup, Heartbeat, LeaveGroup, OffsetCommit and OffsetFetch requests,
+    including static group membership (``group_instance_id``).
+    Connections sending other requests are closed, as Kafka does. Quotas,
+    replication, transactions and record format v2 are not supported.
+
+    Arguments:
+        host (str): address to listen on. Default: ``127.0.0.1``
+        port (int): port to listen on, 0 picks a free port. Default: 0
+        node_id (int): node id reported in metadata. Default: 0
+        topics (dict): {topic: number of partitions} to create on start.
+            Default: None
+        auto_create_topics (bool): create topics on metadata requests, like
+            ``auto.create.topics.enable`` broker option. Default: True
+        num_partitions (int): number of partitions of automatically created
+            topics. Default: 1
+        latency_ms (int or dict): delay before each response in
+            milliseconds, either for all requests or as {api_key: delay}.
+            Default: 0
+    """
+
+    API_VERSIONS = collections.OrderedDict(
+        (api_key, (0, len(requests) - 1))
+        for api_key, requests in sorted(_REQUESTS.items()))
+
+    def __init__(self, *, loop, host="127.0.0.1", port=0, node_id=0,
+                 topics=None, auto_create_topics=True, num_partitions=1,
+                 latency_ms=0):
+        self._loop = loop
+        self._host = host
+        self._port = port
+        self.node_id = node_id
+        self._auto_create_topics = auto_create_topics
+        self._num_partitions = num_partitions
+        self._latency = {}
+        self.set_latency(latency_ms)
+        # api_key => deque of error types to respond with
+        self._errors = collections.defaultdict(collections.deque)
+        self._logs = {}
+        self._topics = {}
+        self._groups = {}
+        for topic, partitions in (topics or {}).items():
+            self.create_topic(topic, partitions)
+
+        self._server = None
+        self._connections = set()
+        self._expire_task = None
+        # Resolved on each append to wake up long polling fetches
+        self._data_waiter = create_future(loop=loop)
+        self._handlers = {
+            0: self._handle_produce,
+            1: self._handle_fetch,
+            2: self._handle_list_offsets,
+            3: self._handle_metadata,
+            8: self._handle_offset_commit,
+            9: self._handle_offset_fetch,
+            10: self._handle_group_coordinator,
+            11: self._handle_join_group,
+            12: self._handle_heartbeat,
+            13: self._handle_leave_group,
+            14: self._handle_sync_group,
+            18: self._handle_api_versions,
+        }
+
+    @property
+    def host(self):
+        return self._host
+
+    @property
+    def port(self):
+        return self._port
+
+    @property
+    def bootstrap_servers(self):
+        return "{}:{}".format(self._host, self._port)
+
+    @asyncio.coroutine
+    def start(self):
+        self._server = yield from asyncio.start_server(
+            self._handle_connection, self._host, self._port, loop=self._loop)
+        self._port = self._server.sockets[0].getsockname()[1]
+        self._expire_task = ensure_future(
+            self._expire_routine(), loop=self._loop)
+        log.debug("Fake broker listening on %s", self.bootstrap_servers)
+
+    @asyncio.coroutine
+    def close(self):
+        if self._server is None:
+            return
+        self._server.close()
+        yield from self._server.wait_closed()
+        self._server = None
+        self._expire_task.cancel()
+        for writer, task in list(self._connections):
+            writer.close()
+            task.cancel()
+        tasks = [task for _, task in self._connections]
+        if tasks:
+            yield from asyncio.wait(tasks, loop=self._loop)
+        for group in self._groups.values():
+            group.close()
+
+    def create_topic(self, topic, num_partitions=None):
+        """ Create a topic, if it does not exist yet """
+        if topic in self._topics:
+            return
+        if num_partitions is None:
+            num_partitions = self._num_partitions
+        self._topics[topic] = num_partitions
+        for partition in range(num_partitions):
+            self._logs[TopicPartition(topic, partition)] = _PartitionLog()
+
+    def set_latency(self, latency_ms, api_key=None):
+        """ Delay responses to requests with ``api_key`` or to all requests
+        if it's None.
+        """
+        if isinstance(latency_ms, dict):
+            self._latency = {
+                key: value / 1000 for key, value in latency_ms.items()}
+        elif api_key is None:
+            self._latency = collections.defaultdict(
+                lambda delay=latency_ms / 1000: delay)
+        else:
+            self._latency[api_key] = latency_ms / 1000
+
+    def inject_error(self, api_key, error_type, count=1):
+        """ Respond to the next ``count`` requests with ``api_key`` with
+        ``error_type`` error code. Per-partition responses get the error for
+        all partitions. If ``error_type`` is
+        ``aiokafka.errors.ConnectionError`` the connection is closed instead
+        of sending a response.
+        """
+        self._errors[api_key].extend([error_type] * count)
+
+    def highwater(self, tp):
+        return self._logs[tp].highwater
+
+    def records(self, tp):
+        """ Return all records of a partition """
+        return self._logs[tp].records()
+
+    def committed(self, group_id, tp):
+        """ Return committed (offset, metadata) of a group or None """
+        group = self._groups.get(group_id)
+        if group is None:
+            return None
+        return group.offsets.get(tp)
+
+    # Connection handling
+
+    @asyncio.coroutine
+    def _handle_connection(self, reader, writer):
+        conn = (writer, asyncio.Task.current_task(loop=self._loop))
+        self._connections.add(conn)
+        try:
+            while True:
+                size_data = yield from reader.readexactly(_SIZE.size)
+                size, = _SIZE.unpack(size_data)
+                data = yield from reader.readexactly(size)
+                response = yield from self._handle_request(data)
+                if response is not None:
+                    writer.write(response)
+        except (asyncio.IncompleteReadError, ConnectionError,
+                Errors.ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            log.exception("Unexpected error in fake broker connection")
+        finally:
+            self._connections.discard(conn)
+            writer.close()
+
+    @asyncio.coroutine
+    def _handle_request(self, data):
+        api_key, api_version, correlation_id = _HEADER.unpack_from(data)
+        buf = BytesIO(data)
+        buf.seek(_HEADER.size)
+        client_id = String('utf-8').decode(buf)
+
+        requests = _REQUESTS.get(api_key, ())
+        if api_version >= len(requests):
+            log.debug("Unsupported request api_key=%s version=%s",
+                      api_key, api_version)
+            raise Errors.ConnectionError()
+        request_class = requests[api_version]
+        request = request_class.decode(buf)
+
+        error_type = Errors.NoError
+        if self._errors.get(api_key):
+            error_type = self._errors[api_key].popleft()
+        if error_type is Errors.ConnectionError:
+            raise Errors.ConnectionError()
+
+        delay = self._latency.get(api_key, 0)
+        if delay:
+            yield from asyncio.sleep(delay, loop=self._loop)
+        response = yield from self._handlers[api_key](
+            request, error_type, client_id)
+        if response is None:
+            return None
+        body = response.encode()
+        header = struct.pack(">ii", len(body) + 4, correlation_id)
+        return header + body
+
+    @asyncio.coroutine
+    def _expire_routine(self):
+        while True:
+            yield from asyncio.sleep(0.1, loop=self._loop)
+            for group in self._groups.values():
+                group.expire_members()
+
+    def _get_group(self, group_id):
+        group = self._groups.get(group_id)
+        if group is None:
+            group = self._groups[group_id] = _Group(group_id, loop=self._loop)
+        return group
+
+    def _notify_data(self):
+        if not self._data_waiter.done():
+            self._data_waiter.set_result(None)
+        self._data_waiter = create_future(loop=self._loop)
+
+    # Request handlers
+
+    @asyncio.coroutine
+    def _handle_api_versions(self, request, error_type, client_id):
+        return request.RESPONSE_TYPE(error_type.errno, [
+            (api_key, min_version, max_version)
+            for api_key, (min_version, max_version)
+            in self.API_VERSIONS.items()])
+
+    @asyncio.coroutine
+    def _handle_metadata(self, request, error_type, client_id):
+        version = request.API_VERSION
+        if request.topics is None or (version == 0 and not request.topics):
+            topics = list(self._topics)
+        else:
+            topics = request.topics
+            if self._auto_create_topics:
+                for topic in topics:
+                    self.create_topic(topic)
+
+        topics_data = []
+        for topic in topics:
+            if topic not in self._topics:
+                topics_data.append(
+                    (Errors.UnknownTopicOrPartitionError.errno, topic, []))
+                continue
+            partitions = [
+                (0, partition, self.node_id, [self.node_id], [self.node_id])
+                for partition in range(self._topics[topic])]
+            topics_data.append((error_type.errno, topic, partitions))
+
+        if version == 0:
+            return request.RESPONSE_TYPE(
+                [(self.node_id, self._host, self._port)], topics_data)
+        brokers = [(self.node_id, self._host, self._port, None)]
+        topics_data = [
+            (error, topic, False, partitions)
+            for error, topic, partitions in topics_data]
+        if version == 1:
+            return request.RESPONSE_TYPE(brokers, self.node_id, topics_data)
+        return request.RESPONSE_TYPE(
+            brokers, "fake-cluster", self.node_id, topics_data)
+
+    @asyncio.coroutine
+    def _handle_produce(self, request, error_type, client_id):
+        topics = []
+        for topic, partitions in request.topics:
+            partition_data = []
+            for partition, messages in partitions:
+                tp = TopicPartition(topic, partition)
+                log_ = self._logs.get(tp)
+                offset = -1
+                if error_type is not Errors.NoError:
+                    error = error_type
+                elif log_ is None:
+                    error = Errors.UnknownTopicOrPartitionError
+                else:
+                    try:
+                        offset = log_.append(messages)
+                    except Errors.CorruptRecordException:
+                        error = Errors.CorruptRecordException
+                    else:
+                        error = Errors.NoError
+                if request.API_VERSION >= 2:
+                    partition_data.append((partition, error.errno, offset, -1))
+                else:
+                    partition_data.append((partition, error.errno, offset))
+            topics.append((topic, partition_data))
+        self._notify_data()
+
+        if request.required_acks == 0:
+            return None
+        if request.API_VERSION == 0:
+            return request.RESPONSE_TYPE(topics)
+        return request.RESPONSE_TYPE(topics, 0)
+
+    @asyncio.coroutine
+    def _handle_fetch(self, request, error_type, client_id):
+        deadline = self._loop.time() + request.max_wait_time / 1000
+        while True:
+            topics, size = self._read_fetch_data(request, error_type)
+            timeout = deadline - self._loop.time()
+            if size >= request.min_bytes or timeout <= 0:
+                break
+            yield from asyncio.wait(
+                [self._data_waiter], timeout=timeout, loop=self._loop)
+
+        if request.API_VERSION == 0:
+            return request.RESPONSE_TYPE(topics)
+        return request.RESPONSE_TYPE(0, topics)
+
+    def _read_fetch_data(self, request, error_type):
+        topics = []
+        total_size = 0
+        for topic, partitions in request.topics:
+            partition_data = []
+            for partition, offset, max_bytes in partitions:
+                tp = TopicPartition(topic, partition)
+                log_ = self._logs.get(tp)
+                data = b""
+                highwater = -1
+                if error_type is not Errors.NoError:
+                    error = error_type
+                elif log_ is None:
+                    error = Errors.UnknownTopicOrPartitionError
+                elif offset < 0 or offset > log_.highwater:
+                    error = Errors.OffsetOutOfRangeError
+                    highwater = log_.highwater
+                else:
+                    error = Errors.NoError
+                    highwater = log_.highwater
+                    data = log_.read(offset, max_bytes)
+                    total_size += len(data)
+                partition_data.append(
+                    (partition, error.errno, highwater, data))
+            topics.append((topic, partition_data))
+        return topics, total_size
+
+    @asyncio.coroutine
+    def _handle_list_offsets(self, request, error_type, client_id):
+        topics = []
+        for topic, partitions in request.topics:
+            partition_data = []
+            for partition_request in partitions:
+                partition, timestamp = partition_request[:2]
+                tp = TopicPartition(topic, partition)
+                log_ = self._logs.get(tp)
+                offset = -1
+                if error_type is not Errors.NoError:
+                    error = error_type
+                elif log_ is None:
+                    error = Errors.UnknownTopicOrPartitionError
+                else:
+                    error = Errors.NoError
+                    if timestamp == -1:
+                        offset = log_.highwater
+                    elif timestamp == -2:
+                        offset = 0
+                    else:
+                        timestamp, offset = log_.offset_for_time(timestamp)
+
+                if request.API_VERSION == 0:
+                    offsets = [offset] if offset != -1 else []
+                    partition_data.append((partition, error.errno, offsets))
+                else:
+                    if timestamp in (-1, -2):
+                        timestamp = -1
+                    partition_data.append(
+                        (partition, error.errno, timestamp, offset))
+            topics.append((topic, partition_data))
+        return request.RESPONSE_TYPE(topics)
+
+    @asyncio.coroutine
+    def _handle_group_coordinator(self, request, error_type, client_id):
+        return request.RESPONSE_TYPE(
+            error_type.errno, self.node_id, self._host, self._port)
+
+    @asyncio.coroutine
+    def _handle_join_group(self, request, error_type, client_id):
+        if error_type is not Errors.NoError:
+            return _join_response(
+                request.API_VERSION, error_type, member_id=request.member_id)
+        group = self._get_group(request.group)
+        return (yield from group.join(request, client_id))
+
+    @asyncio.coroutine
+    def _handle_sync_group(self, request, error_type, client_id):
+        if error_type is Errors.NoError:
+            group = self._get_group(request.group)
+            error_type, assignment = yield from group.sync(request)
+        else:
+            assignment = b""
+        if request.API_VERSION >= 1:
+            return request.RESPONSE_TYPE(0, error_type.errno, assignment)
+        return request.RESPONSE_TYPE(error_type.errno, assignment)
+
+    @asyncio.coroutine
+    def _handle_heartbeat(self, request, error_type, client_id):
+        if error_type is Errors.NoError:
+            group = self._get_group(request.group)
+            error_type = group.check_member(
+                request.member_id, request.generation_id,
+                getattr(request, "group_instance_id", None))
+        if request.API_VERSION >= 1:
+            return request.RESPONSE_TYPE(0, error_type.errno)
+        return request.RESPONSE_TYPE(error_type.errno)
+
+    @asyncio.coroutine
+    def _handle_leave_group(self, request, error_type, client_id):
+        if error_type is Errors.NoError:
+            group = self._get_group(request.group)
+            error_type = group.leave(request.member_id)
+        return request.RESPONSE_TYPE(error_type.errno)
+
+    @asyncio.coroutine
+    def _handle_offset_commit(self, request, error_type, client_id):
+        group = self._get_group(request.consumer_group)
+        if error_type is Errors.NoError and request.API_VERSION >= 1:
+            generation = request.consumer_group_generation_id
+            # Commits from consumers, that don't use group management
+            if generation != -1 or request.consumer_id:
+                error_type = group.check_member(
+                    request.consumer_id, generation,
+                    getattr(request, "group_instance_id", None))
+                if error_type is Errors.NoError and \
+                        group.state == group.AWAITING_SYNC:
+                    error_type = Errors.RebalanceInProgressError
+
+        topics = []
+        for topic, partitions in request.topics:
+            partition_data = []
+            for partition_request in partitions:
+                partition, offset = partition_request[:2]
+                metadata = partition_request[-1]
+                tp = TopicPartition(topic, partition)
+                error = error_type
+                if error is Errors.NoError:
+                    if tp not in self._logs:
+                        error = Errors.UnknownTopicOrPartitionError
+                    else:
+                        group.offsets[tp] = (offset, metadata)
+                partition_data.append((partition, error.errno))
+            topics.append((topic, partition_data))
+        if request.API_VERSION >= 3:
+            return request.RESPONSE_TYPE(0, topics)
+        return request.RESPONSE_TYPE(topics)
+
+    @asyncio.coroutine
+    def _handle_offset_fetch(self, request, error_type, client_id):
+        group = self._get_group(request.consumer_group)
+        topics = []
+        for topic, partitions in request.topics:
+            partition_data = []
+            for partition in partitions:
+                tp = TopicPartition(topic, partition)
+                offset, metadata = group.offsets.get(tp, (-1, ""))
+                partition_data.append(
+                    (partition, offset, metadata, error_type.errno))
+            topics.append((topic, partition_data))
+        return request.RESPONSE_TYPE(topics)
+
+
+__all__ = ["FakeBroker"]
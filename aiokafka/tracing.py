@@ -0,0 +1,102 @@
+import abc
+import collections
+import math
+
+__all__ = ["AbstractRequestTracer", "RollingLatencyTracer"]
+
+
+class AbstractRequestTracer(metaclass=abc.ABCMeta):
+    """ Hook called by broker connections for every request sent. Pass an
+    instance as ``request_tracer`` to ``AIOKafkaClient``, ``AIOKafkaProducer``
+    or ``AIOKafkaConsumer``.
+
+    Both methods are called synchronously from the connection code, so they
+    should be fast and must not block. Exceptions are logged and ignored.
+    """
+
+    @abc.abstractmethod
+    def on_request(self, node, api_key, api_version, correlation_id,
+                   request_bytes):
+        """ Called after a request is written to the connection.
+
+        Arguments:
+            node (int or str): broker node id, ``"bootstrap"`` for bootstrap
+                connections or ``"host:port"`` if node id is unknown.
+            api_key (int): Kafka API key of the request.
+            api_version (int): version of the request.
+            correlation_id (int): correlation id of the request.
+            request_bytes (int): size of the request on the wire.
+
+        Returns:
+            callable or None: called as ``callback(response_bytes, latency)``
+                when the response is received, ``latency`` is in seconds.
+                Not called for requests without response or if the request
+                fails.
+        """
+        pass
+
+
+class RollingLatencyTracer(AbstractRequestTracer):
+    """ Keeps latency of the last ``window`` responses and byte counts per
+    ``(node, api_key)`` pair.
+
+    Arguments:
+        window (int): number of last responses to calculate latency
+            percentiles from. Default: 1000
+    """
+
+    def __init__(self, window=1000):
+        self._window = window
+        self._latencies = collections.defaultdict(
+            lambda: collections.deque(maxlen=window))
+        self._counts = collections.defaultdict(lambda: [0, 0, 0])
+
+    def on_request(self, node, api_key, api_version, correlation_id,
+                   request_bytes):
+        key = (node, api_key)
+        counts = self._counts[key]
+        counts[0] += 1
+        counts[1] += request_bytes
+
+        def on_response(response_bytes, latency):
+            counts[2] += response_bytes
+            self._latencies[key].append(latency)
+        return on_response
+
+    def percentile(self, node, api_key, q):
+        """ Return latency in seconds below which ``q`` (0..1) of the last
+        responses fall, or None if there were no responses.
+        """
+        latencies = self._latencies.get((node, api_key))
+        if not latencies:
+            return None
+        return _percentile(sorted(latencies), q)
+
+    def stats(self):
+        """ Return collected statistics.
+
+        Returns:
+            dict: {(node, api_key): dict} with ``requests``,
+                ``request_bytes``, ``response_bytes``, ``p50`` and ``p99``
+                keys. Percentiles are None if no responses were received.
+        """
+        result = {}
+        for key, (requests, request_bytes, response_bytes) in \
+                list(self._counts.items()):
+            latencies = sorted(self._latencies.get(key, ()))
+            result[key] = {
+                "requests": requests,
+                "request_bytes": request_bytes,
+                "response_bytes": response_bytes,
+                "p50": _percentile(latencies, 0.5),
+                "p99": _percentile(latencies, 0.99),
+            }
+        return result
+
+
+def _percentile(values, q):
+    """ Nearest-rank percentile of sorted ``values`` """
+    if not values:
+        return None
+    index = max(0, min(len(values), math.ceil(q * len(values))) - 1)
+    return values[index]
@@ -0,0 +1,153 @@
+import asyncio
+import collections
+import logging
+import time
+
+from aiokafka.metrics import Metrics
+from aiokafka.util import ensure_future
+
+__all__ = ["LoopWatchdog"]
+
+log = logging.getLogger(__name__)
+
+
+class _Span:
+    """ Context manager timing one synchronous section """
+
+    __slots__ = ("_watchdog", "name", "size", "_start")
+
+    def __init__(self, watchdog, name, size):
+        self._watchdog = watchdog
+        self.name = name
+        self.size = size
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._watchdog._record_span(
+            self.name, time.perf_counter() - self._start, self.size)
+        return False
+
+
+class LoopWatchdog:
+    """ Detects event loop stalls and attributes them to synchronous work
+    done by aiokafka itself. Pass an instance as ``watchdog`` to
+    ``AIOKafkaClient``, ``AIOKafkaProducer`` or ``AIOKafkaConsumer``, one
+    instance can be shared by several clients on the same loop.
+
+    Loop lag is measured by a background task while at least one client
+    using the watchdog is started. CPU bound sections of the clients are
+    timed as named spans:
+
+        * ``serialize`` - key and value serializers in ``send()``
+        * ``compress`` - building (and compressing) a batch for sending
+        * ``decompress`` - decompressing and parsing a fetched batch
+        * ``deserialize`` - key and value deserializers of a fetched batch
+
+    A warning is logged for each span longer than ``threshold_ms`` and for
+    each stall of the loop, listing the time spent in spans since the
+    previous check. A stall with no spans listed was caused by code outside
+    of aiokafka.
+
+    Arguments:
+        loop (asyncio.AbstractEventLoop): event loop to watch.
+        threshold_ms (int): loop lag or span duration to report.
+            Default: 100
+        interval_ms (int): how often loop lag is measured. Default: 100
+        metrics (Metrics): registry to record ``aiokafka_loop_lag_seconds``
+            and ``aiokafka_span_duration_seconds`` histograms and
+            ``aiokafka_loop_stalls_total`` counter in. Default: None
+    """
+
+    def __init__(self, *, loop, threshold_ms=100, interval_ms=100,
+                 metrics=None):
+        self._loop = loop
+        self._threshold = threshold_ms / 1000
+        self._interval = interval_ms / 1000
+        if metrics is None:
+            metrics = Metrics(enabled=False)
+        self._metrics = metrics
+        self._lag_sensor = metrics.histogram(
+            "aiokafka_loop_lag_seconds",
+            "Delay of event loop callbacks")
+        self._stall_sensor = metrics.counter(
+            "aiokafka_loop_stalls_total",
+            "Number of times loop lag exceeded the threshold")
+        self._span_sensors = {}
+
+        # span name => [total duration, calls, total size]
+        self._recent = collections.OrderedDict()
+        self._users = 0
+        self._task = None
+        self.last_lag = 0
+
+    def span(self, name, size=None):
+        """ Return a context manager timing a synchronous section.
+
+        Arguments:
+            name (str): name of the section.
+            size (int): amount of processed data, can also be set later as
+                ``size`` attribute of the returned object.
+        """
+        return _Span(self, name, size)
+
+    def start(self):
+        """ Start measuring loop lag. Each call should be paired with
+        ``stop()``, measuring stops after the last one.
+        """
+        self._users += 1
+        if self._task is None:
+            self._task = ensure_future(
+                self._monitor_routine(), loop=self._loop)
+
+    def stop(self):
+        self._users = max(0, self._users - 1)
+        if self._users == 0 and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _record_span(self, name, duration, size):
+        sensor = self._span_sensors.get(name)
+        if sensor is None:
+            sensor = self._span_sensors[name] = self._metrics.histogram(
+                "aiokafka_span_duration_seconds",
+                "Duration of synchronous sections of aiokafka", span=name)
+        sensor.record(duration)
+
+        recent = self._recent.get(name)
+        if recent is None:
+            recent = self._recent[name] = [0, 0, 0]
+        recent[0] += duration
+        recent[1] += 1
+        recent[2] += size or 0
+
+        if duration >= self._threshold:
+            log.warning(
+                "%s took %.3f seconds (size %s), blocking the event loop",
+                name, duration, size)
+
+    @asyncio.coroutine
+    def _monitor_routine(self):
+        interval = self._interval
+        while True:
+            start = self._loop.time()
+            yield from asyncio.sleep(interval, loop=self._loop)
+            lag = max(0, self._loop.time() - start - interval)
+            self.last_lag = lag
+            self._lag_sensor.record(lag)
+            if lag >= self._threshold:
+                self._stall_sensor.inc()
+                log.warning(
+                    "Event loop was blocked for %.3f seconds, spent in "
+                    "aiokafka: %s", lag, self._format_recent())
+            self._recent.clear()
+
+    def _format_recent(self):
+        if not self._recent:
+            return "nothing"
+        return ", ".join(
+            "{} {:.3f}s in {} call(s) size {}".format(
+                name, duration, calls, size)
+            for name, (duration, calls, size) in self._recent.items())
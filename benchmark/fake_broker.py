@@ -0,0 +1,24 @@
+import subprocess
+import sys
+
+
+def start_fake_broker(*topics):
+    """ Start ``aiokafka.testing`` fake broker in a subprocess on a free port.
+    Returns the process and its bootstrap address.
+    """
+    args = [sys.executable, "-m", "aiokafka.testing", "--port", "0"]
+    for topic in topics:
+        args += ["--topic", topic]
+    proc = subprocess.Popen(
+        args, stdout=subprocess.PIPE, universal_newlines=True)
+    line = proc.stdout.readline()
+    if not line.startswith("Listening on "):
+        proc.kill()
+        raise RuntimeError("Fake broker failed to start")
+    return proc, line.split()[-1]
+
+
+def stop_fake_broker(proc):
+    proc.terminate()
+    proc.wait()
+    proc.stdout.close()
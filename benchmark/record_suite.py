@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+""" Benchmark suite for ``aiokafka.record``.
+
+Measures compose (``LegacyRecordBatchBuilder``) and read (``MemoryRecords``)
+throughput and memory allocations for every message format, codec and
+key/value size, both for C extensions and pure python implementation. Run::
+
+    python benchmark/record_suite.py run -o new.json
+    python benchmark/record_suite.py compare old.json new.json --threshold 10
+
+``compare`` exits with status 1 if any case got slower or allocates more by
+more than the threshold percent.
+"""
+import argparse
+import datetime
+import gc
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+
+MAGICS = [0, 1]
+CODECS = ["none", "gzip", "snappy", "lz4"]
+SIZES = [10, 100, 1024, 10 * 1024, 100 * 1024, 1024 * 1024]
+IMPLEMENTATIONS = ["cext", "python"]
+OPERATIONS = ["compose", "read"]
+
+# Records in one batch are capped by both count and total payload
+MAX_RECORDS_PER_BATCH = 100
+MAX_BATCH_PAYLOAD = 4 * 1024 * 1024
+MIN_MEASURE_TIME = 0.2
+REPEAT = 3
+
+
+def case_name(op, magic, codec, size, impl):
+    return "{}/v{}/{}/{}/{}".format(op, magic, codec, size, impl)
+
+
+def payload(rnd, size):
+    # Text-like data, so codecs have something to compress
+    alphabet = b"abcdefghijklmnopqrstuvwxyz0123456789 "
+    return bytes(rnd.choice(alphabet) for _ in range(size))
+
+
+def _codec_available(codec):
+    from kafka import codec as kafka_codec
+    return {
+        "none": True,
+        "gzip": kafka_codec.has_gzip(),
+        "snappy": kafka_codec.has_snappy(),
+        "lz4": kafka_codec.has_lz4(),
+    }[codec]
+
+
+def _compression_type(codec):
+    from aiokafka.record.legacy_records import LegacyRecordBase
+    return {
+        "none": 0,
+        "gzip": LegacyRecordBase.CODEC_GZIP,
+        "snappy": LegacyRecordBase.CODEC_SNAPPY,
+        "lz4": LegacyRecordBase.CODEC_LZ4,
+    }[codec]
+
+
+def _measure(func):
+    """ Return best seconds per call and peak bytes allocated by one call """
+    func()  # warm up
+    loops = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - t0
+        if elapsed >= MIN_MEASURE_TIME:
+            break
+        loops *= 2 if elapsed == 0 else max(
+            2, int(MIN_MEASURE_TIME / elapsed) + 1)
+    best = elapsed / loops
+    for _ in range(REPEAT - 1):
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            func()
+        best = min(best, (time.perf_counter() - t0) / loops)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        tracemalloc.clear_traces()
+        base, _ = tracemalloc.get_traced_memory()
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+        del result
+    finally:
+        tracemalloc.stop()
+    return best, peak - base
+
+
+def run_worker(args):
+    """ Measure all cases with the implementation loaded in this process """
+    from aiokafka.record.legacy_records import LegacyRecordBatchBuilder
+    from aiokafka.record.memory_records import MemoryRecords
+
+    impl = "python" if LegacyRecordBatchBuilder.__name__.endswith("Py") \
+        else "cext"
+    results = {}
+    rnd = random.Random(args.seed)
+    for magic, codec, size in itertools.product(
+            args.magic, args.codec, args.size):
+        if not _codec_available(codec):
+            continue
+        if codec == "lz4" and magic == 0:
+            # Broken framing of old brokers, no point measuring it
+            continue
+        compression_type = _compression_type(codec)
+        count = max(1, min(
+            MAX_RECORDS_PER_BATCH, MAX_BATCH_PAYLOAD // (size * 2)))
+        records = [
+            (payload(rnd, size), payload(rnd, size)) for _ in range(count)]
+        payload_bytes = size * 2 * count
+
+        def compose():
+            builder = LegacyRecordBatchBuilder(
+                magic=magic, compression_type=compression_type,
+                batch_size=2 ** 31 - 1)
+            for offset, (key, value) in enumerate(records):
+                builder.append(
+                    offset, timestamp=1505824130000, key=key, value=value)
+            return builder.build()
+
+        batch = bytes(compose())
+
+        def read():
+            values = []
+            memory_records = MemoryRecords(batch)
+            while memory_records.has_next():
+                record_batch = memory_records.next_batch()
+                record_batch.validate_crc()
+                for record in record_batch:
+                    values.append(record.value)
+            assert len(values) == count
+            return values
+
+        for op, func in (("compose", compose), ("read", read)):
+            if op not in args.op:
+                continue
+            seconds, alloc = _measure(func)
+            results[case_name(op, magic, codec, size, impl)] = {
+                "records_per_batch": count,
+                "batch_bytes": len(batch),
+                "seconds_per_batch": seconds,
+                "records_per_sec": count / seconds,
+                "mb_per_sec": payload_bytes / seconds / 1024 / 1024,
+                "peak_alloc_bytes": alloc,
+                "alloc_bytes_per_record": alloc / count,
+            }
+            if not args.quiet:
+                print("{:<40} {:>12.0f} rec/s {:>10.2f} MB/s {:>12} B".format(
+                    case_name(op, magic, codec, size, impl),
+                    count / seconds, payload_bytes / seconds / 1024 / 1024,
+                    alloc), file=sys.stderr)
+    json.dump({"implementation": impl, "results": results}, sys.stdout)
+
+
+def _worker_args(args):
+    worker_args = ["--seed", str(args.seed)]
+    for name in ("magic", "codec", "size", "op"):
+        worker_args.append("--" + name)
+        worker_args.extend(str(value) for value in getattr(args, name))
+    if args.quiet:
+        worker_args.append("--quiet")
+    return worker_args
+
+
+def run(args):
+    import aiokafka
+
+    results = {}
+    skipped = []
+    for impl in args.impl:
+        env = dict(os.environ)
+        env.pop("AIOKAFKA_NO_EXTENSIONS", None)
+        if impl == "python":
+            env["AIOKAFKA_NO_EXTENSIONS"] = "1"
+        output = subprocess.check_output(
+            [sys.executable, __file__, "worker"] + _worker_args(args),
+            env=env, universal_newlines=True)
+        data = json.loads(output)
+        if data["implementation"] != impl:
+            # C extensions are not built, python fallback was used instead
+            skipped.append(impl)
+            print("Skipped {}: not available".format(impl), file=sys.stderr)
+            continue
+        results.update(data["results"])
+
+    report = {
+        "meta": {
+            "aiokafka": aiokafka.__version__,
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "date": datetime.datetime.utcnow().isoformat(),
+            "skipped": skipped,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print("Saved {} results to {}".format(len(results), args.output))
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = json.load(f)["results"]
+    with open(args.new) as f:
+        new = json.load(f)["results"]
+
+    threshold = args.threshold / 100
+    regressions = []
+    print("{:<40} {:>10} {:>10}   {}".format(
+        "case", "speed", "alloc", ""))
+    for name in sorted(set(base) & set(new)):
+        # Positive values are improvements for both columns
+        speed = new[name]["records_per_sec"] / \
+            base[name]["records_per_sec"] - 1
+        base_alloc = base[name]["peak_alloc_bytes"]
+        new_alloc = new[name]["peak_alloc_bytes"]
+        alloc = (base_alloc - new_alloc) / base_alloc if base_alloc else 0
+        flags = []
+        if speed < -threshold:
+            flags.append("SLOWER")
+        if alloc < -threshold:
+            flags.append("MORE ALLOCS")
+        if flags:
+            regressions.append(name)
+        print("{:<40} {:>+9.1f}% {:>+9.1f}%   {}".format(
+            name, speed * 100, alloc * 100, " ".join(flags)))
+
+    missing = sorted(set(base) - set(new))
+    if missing:
+        print("Missing in {}: {}".format(args.new, ", ".join(missing)))
+    if regressions:
+        print("{} regression(s) beyond {}%".format(
+            len(regressions), args.threshold))
+        return 1
+    print("No regressions beyond {}%".format(args.threshold))
+    return 0
+
+
+def _add_case_args(parser):
+    parser.add_argument(
+        '--magic', type=int, nargs='+', default=MAGICS, choices=MAGICS,
+        help='Message format versions. Default {default}.')
+    parser.add_argument(
+        '--codec', nargs='+', default=CODECS, choices=CODECS,
+        help='Compression codecs, unavailable ones are skipped. '
+             'Default {default}.')
+    parser.add_argument(
+        '--size', type=int, nargs='+', default=SIZES,
+        help='Key and value sizes in bytes. Default {default}.')
+    parser.add_argument(
+        '--op', nargs='+', default=OPERATIONS, choices=OPERATIONS,
+        help='Operations to measure. Default {default}.')
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='Seed of generated payloads. Default {default}.')
+    parser.add_argument(
+        '-q', '--quiet', action='store_true',
+        help='Do not print results while running.')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Throughput and allocation benchmarks of aiokafka.record')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser(
+        'run', help='Run benchmarks and save results as JSON.')
+    _add_case_args(run_parser)
+    run_parser.add_argument(
+        '--impl', nargs='+', default=IMPLEMENTATIONS,
+        choices=IMPLEMENTATIONS,
+        help='C extensions and/or AIOKAFKA_NO_EXTENSIONS python '
+             'implementation. Default {default}.')
+    run_parser.add_argument(
+        '-o', '--output', default="record_suite.json",
+        help='File to save results to. Default {default}.')
+
+    worker_parser = subparsers.add_parser('worker')
+    _add_case_args(worker_parser)
+
+    compare_parser = subparsers.add_parser(
+        'compare', help='Compare 2 result files and flag regressions.')
+    compare_parser.add_argument('base', help='Results to compare against.')
+    compare_parser.add_argument('new', help='New results.')
+    compare_parser.add_argument(
+        '-t', '--threshold', type=float, default=10,
+        help='Allowed slowdown or allocation growth in percent. '
+             'Default {default}.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "run":
+        run(args)
+    elif args.command == "worker":
+        run_worker(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
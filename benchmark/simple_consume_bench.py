@@ -2,9 +2,11 @@ import argparse
 import signal
 
 import asyncio
-from aiokafka import AIOKafkaConsumer
+from aiokafka import AIOKafkaConsumer, AIOKafkaProducer
 from collections import Counter
 
+from fake_broker import start_fake_broker, stop_fake_broker
+
 
 class Benchmark:
 
@@ -12,6 +14,8 @@ class Benchmark:
         self._topic = args.topic
         self._bootstrap_servers = args.broker_list
         self._num = args.num
+        self._populate = args.fake_broker
+        self._size = args.size
         self._stats_interval = 1
         self._stats = [Counter()]
 
@@ -42,9 +46,31 @@ class Benchmark:
                 )
             )
 
+    async def populate(self):
+        # Fake broker starts empty, so fill the topic before measuring
+        loop = asyncio.get_event_loop()
+        producer = AIOKafkaProducer(
+            bootstrap_servers=self._bootstrap_servers, loop=loop)
+        await producer.start()
+        try:
+            payload = b"m" * self._size
+            batch = producer.create_batch()
+            for _ in range(self._num):
+                if batch.append(
+                        key=None, value=payload, timestamp=None) is None:
+                    await (await producer.send_batch(
+                        batch, self._topic, partition=0))
+                    batch = producer.create_batch()
+                    batch.append(key=None, value=payload, timestamp=None)
+            await (await producer.send_batch(batch, self._topic, partition=0))
+        finally:
+            await producer.stop()
+
     async def bench_simple(self):
         topic = self._topic
         loop = asyncio.get_event_loop()
+        if self._populate:
+            await self.populate()
 
         consumer = AIOKafkaConsumer(
             topic, group_id="test_group", auto_offset_reset="earliest",
@@ -89,9 +115,17 @@ def parse_args():
     parser.add_argument(
         '--topic', default="test",
         help='Topic to consume messages from. Default {default}.')
+    parser.add_argument(
+        '-s', '--size', type=int, default=100,
+        help='Size of message payload in bytes, used with `--fake-broker`. '
+             'Default {default}.')
     parser.add_argument(
         '--uvloop', action='store_true',
         help='Use uvloop instead of asyncio default loop.')
+    parser.add_argument(
+        '--fake-broker', action='store_true',
+        help='Run against an in-memory broker in a subprocess, populated '
+             'with `--num` messages. `--broker-list` is ignored.')
     return parser.parse_args()
 
 
@@ -100,6 +134,9 @@ def main():
     if args.uvloop:
         import uvloop
         asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    broker = None
+    if args.fake_broker:
+        broker, args.broker_list = start_fake_broker(args.topic)
 
     loop = asyncio.get_event_loop()
     task = loop.create_task(Benchmark(args).bench_simple())
@@ -114,6 +151,8 @@ def main():
         loop.run_forever()
     finally:
         loop.close()
+        if broker is not None:
+            stop_fake_broker(broker)
         if not task.cancelled():
             task.result()
 
@@ -5,6 +5,8 @@ from aiokafka import AIOKafkaProducer
 from collections import Counter
 import random
 
+from fake_broker import start_fake_broker, stop_fake_broker
+
 
 class Benchmark:
 
@@ -99,6 +101,10 @@ def parse_args():
     parser.add_argument(
         '--uvloop', action='store_true',
         help='Use uvloop instead of asyncio default loop.')
+    parser.add_argument(
+        '--fake-broker', action='store_true',
+        help='Run against an in-memory broker in a subprocess. '
+             '`--broker-list` is ignored.')
     return parser.parse_args()
 
 
@@ -107,6 +113,10 @@ def main():
     if args.uvloop:
         import uvloop
         asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    broker = None
+    if args.fake_broker:
+        broker, args.broker_list = start_fake_broker(
+            "{}:{}".format(args.topic, args.partition + 1))
 
     loop = asyncio.get_event_loop()
     task = loop.create_task(Benchmark(args).bench_simple())
@@ -121,6 +131,8 @@ def main():
         loop.run_forever()
     finally:
         loop.close()
+        if broker is not None:
+            stop_fake_broker(broker)
         if not task.cancelled():
             task.result()
 
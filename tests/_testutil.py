@@ -15,6 +15,7 @@ from aiokafka.client import AIOKafkaClient
 from aiokafka.errors import ConnectionError
 from aiokafka.producer import AIOKafkaProducer
 from aiokafka.helpers import create_ssl_context
+from aiokafka.testing import FakeBroker
 
 
 __all__ = ['KafkaIntegrationTestCase', 'random_string']
@@ -33,6 +34,44 @@ def run_until_complete(fun):
     return wrapper
 
 
+@asyncio.coroutine
+def start_fake_broker(test, **kw):
+    """ Start a FakeBroker, that is closed on cleanup of ``test`` """
+    broker = FakeBroker(loop=test.loop, **kw)
+    yield from broker.start()
+    test.addCleanup(test.loop.run_until_complete, broker.close())
+    return broker
+
+
+@asyncio.coroutine
+def start_client(test, broker, **kw):
+    """ Bootstrap an AIOKafkaClient to ``broker``, that is closed on cleanup
+    of ``test``
+    """
+    client = AIOKafkaClient(
+        loop=test.loop, bootstrap_servers=broker.bootstrap_servers, **kw)
+    yield from client.bootstrap()
+    test.addCleanup(test.loop.run_until_complete, client.close())
+    return client
+
+
+def record_requests(broker, api_key=None):
+    """ Return a list, that all requests handled by ``broker`` (or only ones
+    of ``api_key``) are appended to
+    """
+    requests = []
+    for key, handler in list(broker._handlers.items()):
+        if api_key is not None and key != api_key:
+            continue
+
+        @asyncio.coroutine
+        def handle(request, *args, handler=handler):
+            requests.append(request)
+            return (yield from handler(request, *args))
+        broker._handlers[key] = handle
+    return requests
+
+
 def kafka_versions(*versions):
     # Took from kafka-python
 
@@ -0,0 +1,382 @@
+import asyncio
+import pytest
+import unittest
+from unittest import mock
+
+from kafka.coordinator.assignors.roundrobin import RoundRobinPartitionAssignor
+from kafka.coordinator.protocol import ConsumerProtocol
+
+from aiokafka.abc import ConsumerRebalanceListener
+from aiokafka.consumer import AIOKafkaConsumer
+from aiokafka.consumer.assignors import (
+    StickyAssignorUserData, StickyPartitionAssignor,
+    CooperativeStickyPartitionAssignor)
+from aiokafka.producer import AIOKafkaProducer
+from aiokafka.structs import TopicPartition
+from ._testutil import run_until_complete, start_fake_broker
+
+
+def _cluster(partitions):
+    cluster = mock.Mock()
+    cluster.partitions_for_topic.side_effect = \
+        lambda topic: set(range(partitions[topic])) \
+        if topic in partitions else None
+    return cluster
+
+
+class TestStickyPartitionAssignor(unittest.TestCase):
+
+    def _rebalance(self, cluster, members):
+        """ Run one rebalance of ``members`` ({member_id: (assignor, topics)})
+        and return {member_id: set(TopicPartition)}
+        """
+        member_metadata = {}
+        for member_id, (assignor, topics) in members.items():
+            # Metadata goes through the wire format as in a real JoinGroup
+            metadata = assignor.metadata(topics)
+            member_metadata[member_id] = ConsumerProtocol.METADATA.decode(
+                metadata.encode())
+        leader = next(iter(members.values()))[0]
+        assignments = leader.assign(cluster, member_metadata)
+        self.assertEqual(set(assignments), set(members))
+
+        result = {}
+        for member_id, assignment in assignments.items():
+            assignment = ConsumerProtocol.ASSIGNMENT.decode(
+                assignment.encode())
+            members[member_id][0].on_assignment(assignment)
+            result[member_id] = set(assignment.partitions())
+        return result
+
+    def _assert_valid(self, cluster_partitions, members, result):
+        assigned = [tp for tps in result.values() for tp in tps]
+        self.assertEqual(len(assigned), len(set(assigned)))
+        subscribed = set()
+        for _, topics in members.values():
+            subscribed.update(topics)
+        self.assertEqual(set(assigned), {
+            TopicPartition(topic, partition)
+            for topic in subscribed
+            for partition in range(cluster_partitions.get(topic, 0))})
+        for member_id, tps in result.items():
+            for tp in tps:
+                self.assertIn(tp.topic, members[member_id][1])
+
+    def _moved(self, before, after):
+        # Partitions taken from members, that are still in the group
+        owners = {tp: member_id
+                  for member_id, tps in before.items() for tp in tps
+                  if member_id in after}
+        return sum(
+            1 for member_id, tps in after.items() for tp in tps
+            if tp in owners and owners[tp] != member_id)
+
+    def test_balanced_and_sticky_on_join_and_leave(self):
+        partitions = {"t1": 13, "t2": 7}
+        cluster = _cluster(partitions)
+        topics = ["t1", "t2"]
+        members = {
+            "c{}".format(i): (StickyPartitionAssignor(), topics)
+            for i in range(3)}
+
+        first = self._rebalance(cluster, members)
+        self._assert_valid(partitions, members, first)
+        self.assertEqual(
+            sorted(len(tps) for tps in first.values()), [6, 7, 7])
+
+        # A new member only takes partitions needed for balance
+        members["c3"] = (StickyPartitionAssignor(), topics)
+        second = self._rebalance(cluster, members)
+        self._assert_valid(partitions, members, second)
+        self.assertEqual(
+            sorted(len(tps) for tps in second.values()), [5, 5, 5, 5])
+        self.assertEqual(self._moved(first, second), 5)
+        for member_id in first:
+            self.assertTrue(second[member_id] <= first[member_id])
+
+        # Partitions of a leaving member are spread, others stay in place
+        del members["c1"]
+        third = self._rebalance(cluster, members)
+        self._assert_valid(partitions, members, third)
+        self.assertEqual(
+            sorted(len(tps) for tps in third.values()), [6, 7, 7])
+        for member_id in members:
+            self.assertTrue(second[member_id] <= third[member_id])
+
+        # Nothing moves if the group did not change
+        fourth = self._rebalance(cluster, members)
+        self.assertEqual(third, fourth)
+
+    def test_compared_to_roundrobin(self):
+        partitions = {"topic": 100}
+        cluster = _cluster(partitions)
+        members = {
+            "c{:02}".format(i): (StickyPartitionAssignor(), ["topic"])
+            for i in range(10)}
+        before = self._rebalance(cluster, members)
+        del members["c03"]
+        after = self._rebalance(cluster, members)
+        # Only the partitions of the member that left are moved
+        self.assertEqual(self._moved(before, after), 0)
+        self.assertEqual(
+            sorted(len(tps) for tps in after.values()), [11] * 8 + [12])
+
+        metadata = {
+            member_id: RoundRobinPartitionAssignor.metadata(["topic"])
+            for member_id in before}
+        rr_before = RoundRobinPartitionAssignor.assign(cluster, metadata)
+        del metadata["c03"]
+        rr_after = RoundRobinPartitionAssignor.assign(cluster, metadata)
+        rr_moved = self._moved(
+            {m: set(a.partitions()) for m, a in rr_before.items()},
+            {m: set(a.partitions()) for m, a in rr_after.items()})
+        self.assertGreater(rr_moved, 50)
+
+    def test_subscription_changes(self):
+        partitions = {"t1": 4, "t2": 4, "t3": 2}
+        cluster = _cluster(partitions)
+        members = {
+            "c0": (StickyPartitionAssignor(), ["t1", "t2"]),
+            "c1": (StickyPartitionAssignor(), ["t1", "t2"]),
+        }
+        first = self._rebalance(cluster, members)
+        self._assert_valid(partitions, members, first)
+
+        # Partitions of unsubscribed topics are dropped from the claims
+        members["c0"] = (members["c0"][0], ["t1", "t3"])
+        members["c2"] = (StickyPartitionAssignor(), ["t2"])
+        second = self._rebalance(cluster, members)
+        self._assert_valid(partitions, members, second)
+        t1_kept = {tp for tp in first["c0"] if tp.topic == "t1"}
+        self.assertTrue(t1_kept <= second["c0"])
+        counts = sorted(len(tps) for tps in second.values())
+        self.assertLessEqual(counts[-1] - counts[0], 1)
+
+        # Unknown topics and removed partitions are ignored
+        cluster = _cluster({"t1": 2, "t2": 4})
+        third = self._rebalance(cluster, members)
+        self._assert_valid({"t1": 2, "t2": 4}, members, third)
+
+    def test_unequal_subscriptions(self):
+        partitions = {"t1": 1, "t2": 2, "t3": 3}
+        cluster = _cluster(partitions)
+        members = {
+            "c0": (StickyPartitionAssignor(), ["t1"]),
+            "c1": (StickyPartitionAssignor(), ["t1", "t2"]),
+            "c2": (StickyPartitionAssignor(), ["t1", "t2", "t3"]),
+        }
+        result = self._rebalance(cluster, members)
+        self._assert_valid(partitions, members, result)
+        self.assertEqual(
+            {member_id: len(tps) for member_id, tps in result.items()},
+            {"c0": 1, "c1": 2, "c2": 3})
+
+    def test_conflicting_claims(self):
+        cluster = _cluster({"topic": 4})
+        old_data = StickyAssignorUserData([("topic", [0, 1, 2, 3])], 3)
+        new_data = StickyAssignorUserData([("topic", [0, 1])], 5)
+        metadata = {
+            "a": ConsumerProtocol.METADATA(0, ["topic"], old_data.encode()),
+            "b": ConsumerProtocol.METADATA(0, ["topic"], new_data.encode()),
+            "c": ConsumerProtocol.METADATA(0, ["topic"], b"garbage"),
+        }
+        assignor = StickyPartitionAssignor()
+        assignments = assignor.assign(cluster, metadata)
+        result = {m: set(a.partitions()) for m, a in assignments.items()}
+        # The latest claim wins
+        self.assertEqual(result["b"], {
+            TopicPartition("topic", 0), TopicPartition("topic", 1)})
+        self.assertEqual(len(result["a"]), 1)
+        self.assertEqual(len(result["c"]), 1)
+
+        assignor.on_assignment(assignments["a"])
+        self.assertEqual(assignor._generation, 6)
+        metadata = assignor.metadata(["topic"])
+        user_data = StickyAssignorUserData.decode(metadata.user_data)
+        self.assertEqual(user_data.generation, 6)
+        self.assertEqual(user_data.previous_assignment, [
+            ("topic", [tp.partition for tp in result["a"]])])
+
+    def test_large_group(self):
+        partitions = {"topic{}".format(i): 500 for i in range(40)}
+        cluster = _cluster(partitions)
+        topics = sorted(partitions)
+        members = {
+            "c{:03}".format(i): (StickyPartitionAssignor(), topics)
+            for i in range(150)}
+        before = self._rebalance(cluster, members)
+        self._assert_valid(partitions, members, before)
+
+        for i in range(0, 150, 10):
+            del members["c{:03}".format(i)]
+        after = self._rebalance(cluster, members)
+        self._assert_valid(partitions, members, after)
+        counts = [len(tps) for tps in after.values()]
+        self.assertLessEqual(max(counts) - min(counts), 1)
+        self.assertEqual(self._moved(before, after), 0)
+
+    def test_cooperative_withholds_owned_partitions(self):
+        partitions = {"t1": 6, "t2": 3}
+        cluster = _cluster(partitions)
+        topics = ["t1", "t2"]
+        members = {"c0": (CooperativeStickyPartitionAssignor(), topics)}
+        first = self._rebalance(cluster, members)
+        self.assertEqual(len(first["c0"]), 9)
+
+        # Moved partitions are only revoked from the previous owner...
+        members["c1"] = (CooperativeStickyPartitionAssignor(), topics)
+        members["c2"] = (CooperativeStickyPartitionAssignor(), topics)
+        second = self._rebalance(cluster, members)
+        self.assertEqual(len(second["c0"]), 3)
+        self.assertTrue(second["c0"] <= first["c0"])
+        self.assertEqual(second["c1"], set())
+        self.assertEqual(second["c2"], set())
+
+        # ... and assigned to new owners once it rejoins without them
+        third = self._rebalance(cluster, members)
+        self._assert_valid(partitions, members, third)
+        self.assertEqual(third["c0"], second["c0"])
+        self.assertEqual(
+            sorted(len(tps) for tps in third.values()), [3, 3, 3])
+        self.assertEqual(self._rebalance(cluster, members), third)
+
+    def test_cooperative_conflicting_claims(self):
+        cluster = _cluster({"topic": 2})
+        a_data = StickyAssignorUserData([("topic", [0, 1])], 3)
+        b_data = StickyAssignorUserData([("topic", [1])], 5)
+        metadata = {
+            "a": ConsumerProtocol.METADATA(0, ["topic"], a_data.encode()),
+            "b": ConsumerProtocol.METADATA(0, ["topic"], b_data.encode()),
+        }
+        assignments = CooperativeStickyPartitionAssignor().assign(
+            cluster, metadata)
+        # Partition claimed by both is withheld until one of them revokes it
+        self.assertEqual(
+            set(assignments["a"].partitions()), {TopicPartition("topic", 0)})
+        self.assertEqual(set(assignments["b"].partitions()), set())
+
+
+class _Listener(ConsumerRebalanceListener):
+
+    def __init__(self):
+        self.revoked = []
+        self.assigned = []
+
+    def on_partitions_revoked(self, revoked):
+        self.revoked.append(set(revoked))
+
+    def on_partitions_assigned(self, assigned):
+        self.assigned.append(set(assigned))
+
+
+@pytest.mark.usefixtures('setup_test_class_serverless')
+class TestStickyPartitionAssignorGroup(unittest.TestCase):
+
+    @run_until_complete
+    def test_consumer_group(self):
+        broker = yield from start_fake_broker(self, topics={"topic": 6})
+        producer = AIOKafkaProducer(
+            loop=self.loop, bootstrap_servers=broker.bootstrap_servers)
+        yield from producer.start()
+        self.addCleanup(self.loop.run_until_complete, producer.stop())
+
+        def create_consumer():
+            consumer = AIOKafkaConsumer(
+                "topic", loop=self.loop, group_id="group",
+                bootstrap_servers=broker.bootstrap_servers,
+                partition_assignment_strategy=[StickyPartitionAssignor],
+                heartbeat_interval_ms=100)
+            self.addCleanup(self.loop.run_until_complete, consumer.stop())
+            return consumer
+
+        consumer1 = create_consumer()
+        assignor = consumer1._partition_assignment_strategy[0]
+        self.assertIsInstance(assignor, StickyPartitionAssignor)
+        yield from consumer1.start()
+        self.assertEqual(len(consumer1.assignment()), 6)
+
+        consumer2 = create_consumer()
+        self.assertIsNot(
+            consumer2._partition_assignment_strategy[0], assignor)
+        yield from consumer2.start()
+        for _ in range(50):
+            if len(consumer1.assignment()) == 3 and \
+                    len(consumer2.assignment()) == 3:
+                break
+            yield from asyncio.sleep(0.1, loop=self.loop)
+        self.assertEqual(len(consumer1.assignment()), 3)
+        self.assertEqual(len(consumer2.assignment()), 3)
+        self.assertEqual(
+            set(assignor._member_assignment), consumer1.assignment())
+
+    @asyncio.coroutine
+    def _wait_assignments(self, consumers, sizes):
+        for _ in range(50):
+            if [len(c.assignment()) for c in consumers] == sizes:
+                break
+            yield from asyncio.sleep(0.1, loop=self.loop)
+        self.assertEqual([len(c.assignment()) for c in consumers], sizes)
+
+    @run_until_complete
+    def test_cooperative_rebalance(self):
+        broker = yield from start_fake_broker(self, topics={"topic": 6})
+        producer = AIOKafkaProducer(
+            loop=self.loop, bootstrap_servers=broker.bootstrap_servers)
+        yield from producer.start()
+        self.addCleanup(self.loop.run_until_complete, producer.stop())
+        for partition in range(6):
+            yield from producer.send_and_wait(
+                "topic", b"value", partition=partition)
+
+        def create_consumer(listener):
+            consumer = AIOKafkaConsumer(
+                loop=self.loop, group_id="group",
+                bootstrap_servers=broker.bootstrap_servers,
+                auto_offset_reset="earliest",
+                partition_assignment_strategy=[
+                    CooperativeStickyPartitionAssignor],
+                heartbeat_interval_ms=100)
+            consumer.subscribe(["topic"], listener=listener)
+            self.addCleanup(self.loop.run_until_complete, consumer.stop())
+            return consumer
+
+        listener1 = _Listener()
+        consumer1 = create_consumer(listener1)
+        yield from consumer1.start()
+        initial = consumer1.assignment()
+        self.assertEqual(len(initial), 6)
+        received = 0
+        while received < 6:
+            batch = yield from consumer1.getmany(timeout_ms=1000)
+            received += sum(len(msgs) for msgs in batch.values())
+        states = {
+            tp: consumer1._subscription.subscription.assignment.state_value(
+                tp) for tp in initial}
+
+        subscription = consumer1._subscription
+        with mock.patch.object(
+                subscription, "begin_reassignment",
+                wraps=subscription.begin_reassignment) as begin_mock:
+            listener2 = _Listener()
+            consumer2 = create_consumer(listener2)
+            yield from consumer2.start()
+            yield from self._wait_assignments([consumer1, consumer2], [3, 3])
+            # Consumption was only stopped to revoke moved partitions
+            self.assertEqual(begin_mock.call_count, 1)
+
+        retained = consumer1.assignment()
+        self.assertTrue(retained < initial)
+        self.assertEqual(listener1.revoked, [set(), initial - retained])
+        self.assertEqual(listener1.assigned[0], initial)
+        self.assertFalse(any(listener1.assigned[1:]))
+        self.assertEqual(set().union(*listener2.assigned), initial - retained)
+        self.assertFalse(any(listener2.revoked))
+
+        # Retained partitions keep positions and committed offsets
+        assignment = consumer1._subscription.subscription.assignment
+        for tp in retained:
+            self.assertIs(assignment.state_value(tp), states[tp])
+            self.assertEqual((yield from consumer1.position(tp)), 1)
+        # Consumed offsets of revoked partitions were committed
+        for tp in initial - retained:
+            self.assertEqual((yield from consumer2.committed(tp)), 1)
@@ -6,7 +6,8 @@ import types
 from unittest import mock
 
 from kafka.common import (KafkaError, ConnectionError, RequestTimedOutError,
-                          NodeNotReadyError, UnrecognizedBrokerVersion)
+                          NodeNotReadyError, UnrecognizedBrokerVersion,
+                          UnsupportedVersionError)
 from kafka.protocol.metadata import (
     MetadataRequest_v0 as MetadataRequest,
     MetadataResponse_v0 as MetadataResponse)
@@ -14,7 +15,11 @@ from kafka.protocol.fetch import FetchRequest_v0
 
 from aiokafka.client import AIOKafkaClient, ConnectionGroup
 from aiokafka.conn import AIOKafkaConnection, CloseReason
-from ._testutil import KafkaIntegrationTestCase, run_until_complete
+from aiokafka.consumer import AIOKafkaConsumer
+from aiokafka.producer import AIOKafkaProducer
+from ._testutil import (
+    KafkaIntegrationTestCase, record_requests, run_until_complete,
+    start_client, start_fake_broker)
 
 
 NO_ERROR = 0
@@ -23,6 +28,326 @@ NO_LEADER = 5
 REPLICA_NOT_AVAILABLE = 9
 
 
+@pytest.mark.usefixtures('setup_test_class_serverless')
+class TestAIOKafkaClientConnectionGroups(unittest.TestCase):
+
+    @run_until_complete
+    def test_connections_per_broker(self):
+        broker = yield from start_fake_broker(self)
+        client = yield from start_client(
+            self, broker, connections_per_broker={ConnectionGroup.FETCH: 2},
+            socket_options={ConnectionGroup.FETCH: {
+                "tcp_nodelay": False, "receive_buffer_bytes": 65536}})
+        fetch_conns = []
+        for _ in range(4):
+            conn = yield from client._get_conn(
+                0, group=ConnectionGroup.FETCH)
+            fetch_conns.append(conn)
+        default_conn = yield from client._get_conn(0)
+        produce_conn = yield from client._get_conn(
+            0, group=ConnectionGroup.PRODUCE)
+
+        # Requests are spread round-robin
+        self.assertIs(fetch_conns[0], fetch_conns[2])
+        self.assertIs(fetch_conns[1], fetch_conns[3])
+        self.assertIsNot(fetch_conns[0], fetch_conns[1])
+        self.assertEqual(
+            len({id(fetch_conns[0]), id(fetch_conns[1]),
+                 id(default_conn), id(produce_conn)}), 4)
+
+        sock = fetch_conns[0]._writer.get_extra_info("socket")
+        self.assertEqual(
+            sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY), 0)
+        # Linux doubles the requested value
+        self.assertGreaterEqual(
+            sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF), 65536)
+        sock = produce_conn._writer.get_extra_info("socket")
+        self.assertNotEqual(
+            sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY), 0)
+
+        # Broken connection is replaced only in its own slot
+        fetch_conns[1].close()
+        conn1 = yield from client._get_conn(0, group=ConnectionGroup.FETCH)
+        conn2 = yield from client._get_conn(0, group=ConnectionGroup.FETCH)
+        self.assertIs(conn1, fetch_conns[0])
+        self.assertIsNot(conn2, fetch_conns[1])
+        self.assertEqual(len(client._conns), 4)
+
+    def test_invalid_connection_options(self):
+        with self.assertRaises(ValueError):
+            AIOKafkaClient(
+                loop=self.loop, connections_per_broker={100: 1})
+        with self.assertRaises(ValueError):
+            AIOKafkaClient(
+                loop=self.loop,
+                connections_per_broker={ConnectionGroup.FETCH: 0})
+        with self.assertRaises(ValueError):
+            AIOKafkaClient(
+                loop=self.loop,
+                socket_options={ConnectionGroup.FETCH: {"linger": 1}})
+
+
+@pytest.mark.usefixtures('setup_test_class_serverless')
+class TestAIOKafkaClientBootstrap(unittest.TestCase):
+
+    @run_until_complete
+    def test_bootstrap_servers_raced(self):
+        slow_broker = yield from start_fake_broker(
+            self, node_id=1, latency_ms={3: 5000})
+        dead_broker = yield from start_fake_broker(self, node_id=2)
+        yield from dead_broker.close()
+        broker = yield from start_fake_broker(self, topics={"topic": 1})
+
+        client = AIOKafkaClient(
+            loop=self.loop, api_version="0.10", bootstrap_servers=[
+                slow_broker.bootstrap_servers, dead_broker.bootstrap_servers,
+                broker.bootstrap_servers])
+        t0 = self.loop.time()
+        yield from client.bootstrap()
+        self.addCleanup(self.loop.run_until_complete, client.close())
+        self.assertLess(self.loop.time() - t0, 2)
+        self.assertEqual(
+            [b.nodeId for b in client.cluster.brokers()], [0])
+        self.assertEqual(client.cluster.topics(), {"topic"})
+
+    @run_until_complete
+    def test_bootstrap_all_failed(self):
+        dead_broker = yield from start_fake_broker(self)
+        yield from dead_broker.close()
+        client = AIOKafkaClient(
+            loop=self.loop, bootstrap_servers=dead_broker.bootstrap_servers)
+        with self.assertRaises(ConnectionError):
+            yield from client.bootstrap()
+
+    @run_until_complete
+    def test_warm_up_connections(self):
+        broker = yield from start_fake_broker(self, topics={"topic": 2})
+        client = AIOKafkaClient(
+            loop=self.loop, bootstrap_servers=broker.bootstrap_servers,
+            connections_per_broker={ConnectionGroup.FETCH: 2})
+        yield from client.bootstrap()
+        self.addCleanup(self.loop.run_until_complete, client.close())
+        ready = yield from client.warm_up_connections(
+            ["topic"], group=ConnectionGroup.FETCH)
+        self.assertEqual(ready, 2)
+        for index in range(2):
+            conn = client._conns[(0, ConnectionGroup.FETCH, index)]
+            self.assertTrue(conn.connected())
+        ready = yield from client.warm_up_connections(["unknown"])
+        self.assertEqual(ready, 0)
+
+        producer = AIOKafkaProducer(
+            loop=self.loop, bootstrap_servers=broker.bootstrap_servers,
+            warm_up_connections=["topic"])
+        yield from producer.start()
+        self.addCleanup(self.loop.run_until_complete, producer.stop())
+        self.assertIn(
+            (0, ConnectionGroup.PRODUCE, 0), producer.client._conns)
+
+
+@pytest.mark.usefixtures('setup_test_class_serverless')
+class TestAIOKafkaClientApiVersions(unittest.TestCase):
+
+    def _versions(self, requests, api_key):
+        return {
+            request.API_VERSION for request in requests
+            if request.API_KEY == api_key}
+
+    @run_until_complete
+    def test_pick_version_from_api_versions(self):
+        broker = yield from start_fake_broker(self, topics={"topic": 1})
+        requests = record_requests(broker)
+        client = AIOKafkaClient(
+            loop=self.loop, bootstrap_servers=broker.bootstrap_servers)
+        yield from client.bootstrap()
+        self.addCleanup(self.loop.run_until_complete, client.close())
+        yield from client._get_conn(0, group=ConnectionGroup.FETCH)
+        self.assertEqual(client._api_versions[0][1], (0, 3))
+
+        self.assertEqual(client.pick_version(1, (0, 3), 0), 3)
+        self.assertEqual(client.pick_version(1, (0, 10)), 3)
+        self.assertEqual(client.pick_version(1, (0, 1), 0), 1)
+        with self.assertRaises(UnsupportedVersionError):
+            client.pick_version(18, (1, 2), 0)
+        with self.assertRaises(UnsupportedVersionError):
+            client.pick_version(42, (0, 1))
+
+        producer = AIOKafkaProducer(
+            loop=self.loop, bootstrap_servers=broker.bootstrap_servers)
+        yield from producer.start()
+        self.addCleanup(self.loop.run_until_complete, producer.stop())
+        yield from producer.send_and_wait("topic", b"value")
+        consumer = AIOKafkaConsumer(
+            "topic", loop=self.loop, auto_offset_reset="earliest",
+            bootstrap_servers=broker.bootstrap_servers)
+        yield from consumer.start()
+        self.addCleanup(self.loop.run_until_complete, consumer.stop())
+        msg = yield from consumer.getone()
+        self.assertEqual(msg.value, b"value")
+        self.assertEqual(self._versions(requests, 0), {2})  # Produce
+        self.assertEqual(self._versions(requests, 1), {3})  # Fetch
+        # Metadata, v0 on bootstrap
+        self.assertEqual(self._versions(requests, 3), {0, 2})
+
+    @run_until_complete
+    def test_pick_version_of_configured_release(self):
+        broker = yield from start_fake_broker(self, topics={"topic": 1})
+        requests = record_requests(broker)
+        client = AIOKafkaClient(
+            loop=self.loop, bootstrap_servers=broker.bootstrap_servers,
+            api_version=(0, 10))
+        yield from client.bootstrap()
+        self.addCleanup(self.loop.run_until_complete, client.close())
+        yield from client._get_conn(0)
+        self.assertEqual(client._api_versions, {})
+        self.assertEqual(self._versions(requests, 18), set())
+        self.assertEqual(client.pick_version(1, (0, 3), 0), 2)
+        self.assertEqual(client.pick_version(3, (0, 2)), 1)
+        with self.assertRaises(UnsupportedVersionError):
+            client.pick_version(2, (1, 1))
+
+        client._api_version = (0, 9)
+        self.assertEqual(client.pick_version(1, (0, 3)), 1)
+        with self.assertRaises(UnsupportedVersionError):
+            client.pick_version(18, (0, 0))
+
+
+@pytest.mark.usefixtures('setup_test_class_serverless')
+class TestAIOKafkaClientTargetedMetadata(unittest.TestCase):
+
+    @asyncio.coroutine
+    def _start_client(self, topics):
+        broker = yield from start_fake_broker(
+            self, topics=topics, auto_create_topics=False)
+        client = yield from start_client(self, broker)
+        return broker, client, record_requests(broker, api_key=3)
+
+    @run_until_complete
+    def test_targeted_refresh_coalesced(self):
+        broker, client, requested = yield from self._start_client(
+            {"topic1": 1, "topic2": 2, "topic3": 1})
+        client.set_topics(["topic1", "topic2", "topic3"])
+        yield from client._maybe_wait_metadata()
+        self.assertEqual(
+            client.cluster.topics(), {"topic1", "topic2", "topic3"})
+        del requested[:]
+
+        broker.create_topic("topic4", 3)
+        broker._topics["topic1"] = 2
+        fut1 = client.force_metadata_update(["topic1"])
+        fut2 = client.force_metadata_update(["topic4", "topic1"])
+        res = yield from asyncio.gather(fut1, fut2, loop=self.loop)
+        self.assertEqual(res, [True, True])
+        self.assertEqual(len(requested), 1)
+        self.assertEqual(sorted(requested[0].topics), ["topic1", "topic4"])
+
+        # Metadata of other topics is kept
+        self.assertEqual(
+            client.cluster.topics(), {"topic1", "topic2", "topic3", "topic4"})
+        self.assertEqual(client.cluster.partitions_for_topic("topic1"), {0, 1})
+        self.assertEqual(client.cluster.partitions_for_topic("topic2"), {0, 1})
+        self.assertEqual(
+            len(client.cluster.partitions_for_broker(0)), 8)
+
+        # Deleted topic is removed
+        del broker._topics["topic3"]
+        yield from client.force_metadata_update(["topic3"])
+        self.assertEqual(
+            client.cluster.topics(), {"topic1", "topic2", "topic4"})
+        self.assertEqual(
+            len(client.cluster.partitions_for_broker(0)), 7)
+
+    @run_until_complete
+    def test_full_refresh_absorbs_targeted(self):
+        broker, client, requested = yield from self._start_client(
+            {"topic1": 1, "topic2": 1})
+        client.set_topics(["topic1"])
+        yield from client._maybe_wait_metadata()
+        del requested[:]
+
+        # Only new topics are requested when subscription grows
+        fut = client.set_topics(["topic1", "topic2"])
+        yield from client._maybe_wait_metadata()
+        self.assertTrue((yield from fut))
+        self.assertEqual([r.topics for r in requested], [["topic2"]])
+        del requested[:]
+
+        full = client.force_metadata_update()
+        targeted = client.force_metadata_update(["topic1"])
+        yield from asyncio.gather(full, targeted, loop=self.loop)
+        self.assertEqual(len(requested), 1)
+        self.assertEqual(sorted(requested[0].topics), ["topic1", "topic2"])
+
+
+@pytest.mark.usefixtures('setup_test_class_serverless')
+class TestAIOKafkaClientShared(unittest.TestCase):
+
+    @run_until_complete
+    def test_shared_by_producer_and_consumers(self):
+        broker = yield from start_fake_broker(
+            self, topics={"topic1": 1, "topic2": 1, "topic3": 1})
+        client = AIOKafkaClient(
+            loop=self.loop, bootstrap_servers=broker.bootstrap_servers)
+
+        producer = AIOKafkaProducer(loop=self.loop, client=client)
+        consumer1 = AIOKafkaConsumer(
+            "topic1", loop=self.loop, client=client,
+            auto_offset_reset="earliest")
+        consumer2 = AIOKafkaConsumer(
+            "topic2", loop=self.loop, client=client,
+            auto_offset_reset="earliest")
+        self.assertEqual(client._topics, {"topic1", "topic2"})
+
+        yield from asyncio.gather(
+            producer.start(), consumer1.start(), consumer2.start(),
+            loop=self.loop)
+        sync_task = client._sync_task
+        self.assertIsNotNone(sync_task)
+        self.assertEqual(client._users, 3)
+
+        yield from producer.send_and_wait("topic1", b"value1")
+        yield from producer.send_and_wait("topic3", b"value3")
+        self.assertEqual(client._topics, {"topic1", "topic2", "topic3"})
+        msg = yield from consumer1.getone()
+        self.assertEqual(msg.value, b"value1")
+        # Only one connection per traffic class to the broker
+        self.assertEqual(
+            sorted(group for _, group, _ in client._conns),
+            [ConnectionGroup.DEFAULT, ConnectionGroup.FETCH,
+             ConnectionGroup.PRODUCE])
+
+        yield from consumer2.stop()
+        self.assertEqual(client._topics, {"topic1", "topic3"})
+        yield from producer.stop()
+        self.assertEqual(client._topics, {"topic1"})
+        self.assertIs(client._sync_task, sync_task)
+        self.assertFalse(sync_task.done())
+
+        # Last user closes the client
+        yield from consumer1.stop()
+        self.assertEqual(client._users, 0)
+        self.assertIsNone(client._sync_task)
+
+    @run_until_complete
+    def test_not_closed_if_bootstrapped_by_application(self):
+        broker = yield from start_fake_broker(self, topics={"topic": 1})
+        client = AIOKafkaClient(
+            loop=self.loop, bootstrap_servers=broker.bootstrap_servers)
+        yield from client.bootstrap()
+        self.addCleanup(self.loop.run_until_complete, client.close())
+
+        producer = AIOKafkaProducer(loop=self.loop, client=client)
+        yield from producer.start()
+        yield from producer.send_and_wait("topic", b"value")
+        yield from producer.stop()
+        self.assertIsNotNone(client._sync_task)
+
+        other_loop = asyncio.new_event_loop()
+        self.addCleanup(other_loop.close)
+        with self.assertRaises(ValueError):
+            AIOKafkaProducer(loop=other_loop, client=client)
+
+
 @pytest.mark.usefixtures('setup_test_class')
 class TestAIOKafkaClient(unittest.TestCase):
 
@@ -83,8 +408,8 @@ class TestAIOKafkaClient(unittest.TestCase):
         def send(request_id):
             return MetadataResponse(brokers, topics)
 
-        mocked_conns = {(0, 0): mock.MagicMock()}
-        mocked_conns[(0, 0)].send.side_effect = send
+        mocked_conns = {(0, 0, 0): mock.MagicMock()}
+        mocked_conns[(0, 0, 0)].send.side_effect = send
         client = AIOKafkaClient(loop=self.loop,
                                 bootstrap_servers=['broker_1:4567'])
         task = asyncio.async(client._md_synchronizer(), loop=self.loop)
@@ -111,7 +436,7 @@ class TestAIOKafkaClient(unittest.TestCase):
         self.assertEqual(
             md.available_partitions_for_topic('topic_2'), set([1]))
 
-        mocked_conns[(0, 0)].connected.return_value = False
+        mocked_conns[(0, 0, 0)].connected.return_value = False
         is_ready = self.loop.run_until_complete(client.ready(0))
         self.assertEqual(is_ready, False)
         is_ready = self.loop.run_until_complete(client.ready(1))
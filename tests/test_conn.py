@@ -14,7 +14,70 @@ from kafka.protocol.commit import (
 
 from aiokafka.conn import AIOKafkaConnection, create_conn
 from aiokafka.errors import ConnectionError, CorrelationIdError
-from ._testutil import KafkaIntegrationTestCase, run_until_complete
+from aiokafka.tracing import RollingLatencyTracer
+from aiokafka.util import ensure_future
+from ._testutil import (
+    KafkaIntegrationTestCase, run_until_complete, start_fake_broker)
+
+
+@pytest.mark.usefixtures('setup_test_class_serverless')
+class ConnTimeoutTest(unittest.TestCase):
+
+    @asyncio.coroutine
+    def _create_conn(self, **kw):
+        broker = yield from start_fake_broker(self)
+        conn = yield from create_conn(
+            broker.host, broker.port, loop=self.loop, **kw)
+        self.addCleanup(conn.close)
+        return broker, conn
+
+    @run_until_complete
+    def test_request_timeout_sweep(self):
+        broker, conn = yield from self._create_conn(request_timeout_ms=50)
+        broker.set_latency(100, api_key=MetadataRequest.API_KEY)
+
+        start = self.loop.time()
+        futs = [conn.send(MetadataRequest([])) for _ in range(3)]
+        # Requests get plain futures and share a single timer
+        for fut in futs:
+            self.assertIsInstance(fut, asyncio.Future)
+        sweep_handle = conn._sweep_handle
+        self.assertIsNotNone(sweep_handle)
+
+        yield from asyncio.wait(futs, loop=self.loop)
+        self.assertLess(self.loop.time() - start, 0.1)
+        for fut in futs:
+            with self.assertRaises(asyncio.TimeoutError):
+                fut.result()
+        self.assertTrue(conn.connected())
+
+        # Late responses are discarded and don't break later requests
+        broker.set_latency(0, api_key=MetadataRequest.API_KEY)
+        conn._request_timeout = 1
+        response = yield from conn.send(MetadataRequest([]))
+        self.assertEqual(response.brokers[0][0], broker.node_id)
+        self.assertEqual(len(conn._requests), 0)
+
+    @run_until_complete
+    def test_close_with_pending_requests(self):
+        broker, conn = yield from self._create_conn()
+        broker.set_latency(1000)
+        fut = conn.send(MetadataRequest([]))
+        self.assertIsNotNone(conn._sweep_handle)
+        conn.close()
+        self.assertIsNone(conn._sweep_handle)
+        with self.assertRaises(ConnectionError):
+            yield from fut
+
+    @run_until_complete
+    def test_send_without_response_no_drain(self):
+        broker, conn = yield from self._create_conn()
+        request = ProduceRequest(
+            required_acks=0, timeout=10 * 1000, topics=[])
+        fut = conn.send(request, expect_response=False)
+        self.assertTrue(fut.done())
+        self.assertIsNone((yield from fut))
+        self.assertEqual(len(conn._requests), 0)
 
 
 @pytest.mark.usefixtures('setup_test_class')
@@ -28,6 +91,46 @@ class ConnTest(unittest.TestCase):
         self.assertIsNone(conn._reader)
         self.assertIsNone(conn._writer)
 
+    @run_until_complete
+    def test_request_tracer(self):
+        tracer = RollingLatencyTracer()
+        conn = AIOKafkaConnection(
+            'localhost', 1234, loop=self.loop, node_id=1,
+            request_tracer=tracer)
+
+        reader = mock.MagicMock()
+        int32 = struct.Struct('>i')
+        resp = MetadataResponse(brokers=[], topics=[])
+        resp = int32.pack(1) + resp.encode()
+
+        chunks = asyncio.Queue(loop=self.loop)
+        reader.readexactly.side_effect = lambda n: chunks.get()
+        conn._reader = reader
+        conn._writer = mock.MagicMock()
+        conn._read_task = ensure_future(conn._read(), loop=self.loop)
+
+        chunks.put_nowait(int32.pack(len(resp)))
+        chunks.put_nowait(resp)
+        yield from conn.send(MetadataRequest([]))
+        stats = tracer.stats()
+        self.assertEqual(list(stats), [(1, MetadataRequest.API_KEY)])
+        stats = stats[(1, MetadataRequest.API_KEY)]
+        self.assertEqual(stats["requests"], 1)
+        self.assertEqual(
+            stats["request_bytes"], len(conn._writer.write.call_args[0][0]))
+        self.assertEqual(stats["response_bytes"], len(resp) + 4)
+        self.assertGreaterEqual(stats["p50"], 0)
+        self.assertEqual(stats["p50"], stats["p99"])
+
+        # Errors in tracer do not break the connection
+        tracer.on_request = mock.Mock(side_effect=ValueError)
+        conn._correlation_id = 0
+        chunks.put_nowait(int32.pack(len(resp)))
+        chunks.put_nowait(resp)
+        yield from conn.send(MetadataRequest([]))
+        self.assertEqual(tracer.on_request.call_count, 1)
+        conn._read_task.cancel()
+
 
 @pytest.mark.usefixtures('setup_test_class')
 class ConnIntegrationTest(KafkaIntegrationTestCase):
@@ -1,5 +1,8 @@
 import asyncio
+import os
 import re
+import shutil
+import tempfile
 from unittest import mock
 
 from kafka.protocol.group import (
@@ -22,6 +25,7 @@ from aiokafka.client import AIOKafkaClient
 from aiokafka.structs import OffsetAndMetadata, TopicPartition
 from aiokafka.consumer.group_coordinator import (
     GroupCoordinator, CoordinatorGroupRebalance)
+from aiokafka.consumer.offset_store import LocalOffsetStore
 from aiokafka.consumer.subscription_state import SubscriptionState
 from aiokafka.util import create_future, ensure_future
 
@@ -478,6 +482,45 @@ class TestKafkaCoordinatorIntegration(KafkaIntegrationTestCase):
         yield from coordinator.close()
         yield from client.close()
 
+    @run_until_complete
+    def test_commit_partial_failure(self):
+        client = AIOKafkaClient(loop=self.loop, bootstrap_servers=self.hosts)
+        yield from client.bootstrap()
+        yield from self.wait_topic(client, 'topic1')
+        subscription = SubscriptionState(loop=self.loop)
+        tp0 = TopicPartition('topic1', 0)
+        tp1 = TopicPartition('topic1', 1)
+        subscription.assign_from_user({tp0, tp1})
+        coordinator = GroupCoordinator(
+            client, subscription, loop=self.loop,
+            group_id='test-partial-commit-group')
+        assignment = subscription.subscription.assignment
+
+        offsets = {
+            tp0: OffsetAndMetadata(1, ''),
+            tp1: OffsetAndMetadata(2, '')}
+        _orig_send_req = coordinator._send_req
+        with mock.patch.object(coordinator, "_send_req") as mocked:
+            @asyncio.coroutine
+            def mock_send_req(request):
+                if request.API_KEY == OffsetCommitRequest[0].API_KEY:
+                    error_code = Errors.OffsetMetadataTooLargeError.errno
+                    return OffsetCommitResponse_v2(
+                        [("topic1", [(0, 0), (1, error_code)])])
+                return (yield from _orig_send_req(request))
+            mocked.side_effect = mock_send_req
+
+            with self.assertRaises(Errors.OffsetMetadataTooLargeError):
+                yield from coordinator.commit_offsets(assignment, offsets)
+
+        # Partition committed successfully has it's commit cache updated
+        self.assertEqual(
+            assignment.state_value(tp0).committed, OffsetAndMetadata(1, ''))
+        self.assertIsNone(assignment.state_value(tp1).committed)
+
+        yield from coordinator.close()
+        yield from client.close()
+
     @run_until_complete
     def test_fetchoffsets_failed_scenarios(self):
         client = AIOKafkaClient(loop=self.loop, bootstrap_servers=self.hosts)
@@ -1180,6 +1223,132 @@ class TestKafkaCoordinatorIntegration(KafkaIntegrationTestCase):
         self.assertAlmostEqual(
             coordinator._next_autocommit_deadline, now + interval, places=1)
 
+    @run_until_complete
+    def test_coordinator_commit_coalescing(self):
+        client = AIOKafkaClient(loop=self.loop, bootstrap_servers=self.hosts)
+        subscription = SubscriptionState(loop=self.loop)
+        tp0 = TopicPartition("topic1", 0)
+        tp1 = TopicPartition("topic1", 1)
+        coordinator = GroupCoordinator(
+            client, subscription, loop=self.loop,
+            heartbeat_interval_ms=20000, enable_auto_commit=False)
+        coordinator._coordination_task.cancel()  # disable for test
+        try:
+            yield from coordinator._coordination_task
+        except asyncio.CancelledError:
+            pass
+        coordinator._coordination_task = asyncio.sleep(0.1, loop=self.loop)
+        self.add_cleanup(coordinator.close)
+
+        coordinator.ensure_coordinator_known = mock.Mock()
+        coordinator.ensure_coordinator_known.side_effect = asyncio.coroutine(
+            lambda: None)
+        coordinator._do_commit_offsets = mocked = mock.Mock()
+        committed = []
+        loop = self.loop
+
+        @asyncio.coroutine
+        def do_commit(assignment, offsets):
+            committed.append(dict(offsets))
+            yield from asyncio.sleep(0.1, loop=loop)
+        mocked.side_effect = do_commit
+
+        subscription.assign_from_user({tp0, tp1})
+        assignment = subscription.subscription.assignment
+
+        # First commit is sent right away, others wait for it and are merged
+        # into one request with the highest offsets
+        first = ensure_future(coordinator.commit_offsets(
+            assignment, {tp0: OffsetAndMetadata(1, "")}), loop=self.loop)
+        yield from asyncio.sleep(0.01, loop=self.loop)
+        rest = [
+            ensure_future(coordinator.commit_offsets(
+                assignment, offsets), loop=self.loop)
+            for offsets in [
+                {tp0: OffsetAndMetadata(5, "")},
+                {tp0: OffsetAndMetadata(3, ""),
+                 tp1: OffsetAndMetadata(2, "")},
+            ]
+        ]
+        yield from asyncio.sleep(0.01, loop=self.loop)
+        # Cancelled caller does not affect merged ones
+        rest[0].cancel()
+        yield from asyncio.gather(first, rest[1], loop=self.loop)
+        self.assertEqual(committed, [
+            {tp0: OffsetAndMetadata(1, "")},
+            {tp0: OffsetAndMetadata(5, ""), tp1: OffsetAndMetadata(2, "")},
+        ])
+
+        # Error is raised to all merged callers
+        @asyncio.coroutine
+        def do_commit_error(assignment, offsets):
+            yield from asyncio.sleep(0.1, loop=loop)
+            raise Errors.OffsetMetadataTooLargeError()
+        mocked.side_effect = do_commit_error
+        calls = [
+            ensure_future(coordinator.commit_offsets(
+                assignment, {tp: OffsetAndMetadata(6, "")}), loop=self.loop)
+            for tp in [tp0, tp1]
+        ]
+        res = yield from asyncio.gather(
+            *calls, loop=self.loop, return_exceptions=True)
+        for err in res:
+            self.assertIsInstance(err, Errors.OffsetMetadataTooLargeError)
+        self.assertEqual(mocked.call_count, 3)
+
+        # Close waits for commits in progress, even if all callers are gone
+        call = ensure_future(coordinator.commit_offsets(
+            assignment, {tp0: OffsetAndMetadata(7, "")}), loop=self.loop)
+        yield from asyncio.sleep(0.01, loop=self.loop)
+        call.cancel()
+        self.assertEqual(len(coordinator._commit_tasks), 1)
+        yield from coordinator.close()
+        self.assertEqual(coordinator._commit_tasks, set())
+        self.assertEqual(mocked.call_count, 4)
+
+    @run_until_complete
+    def test_coordinator_local_offset_store(self):
+        client = AIOKafkaClient(loop=self.loop, bootstrap_servers=self.hosts)
+        subscription = SubscriptionState(loop=self.loop)
+        tp = TopicPartition("topic1", 0)
+        tmp_dir = tempfile.mkdtemp()
+        self.add_cleanup(asyncio.coroutine(shutil.rmtree), tmp_dir)
+        store = LocalOffsetStore(os.path.join(tmp_dir, "offsets"))
+        coordinator = GroupCoordinator(
+            client, subscription, loop=self.loop,
+            heartbeat_interval_ms=20000, enable_auto_commit=False,
+            offset_store=store)
+        coordinator._coordination_task.cancel()  # disable for test
+        try:
+            yield from coordinator._coordination_task
+        except asyncio.CancelledError:
+            pass
+        coordinator._coordination_task = asyncio.sleep(0.1, loop=self.loop)
+        self.add_cleanup(coordinator.close)
+        coordinator.ensure_coordinator_known = mock.Mock()
+        coordinator.ensure_coordinator_known.side_effect = asyncio.coroutine(
+            lambda: None)
+
+        subscription.assign_from_user({tp})
+        assignment = subscription.subscription.assignment
+        tp_state = assignment.state_value(tp)
+        resp = yield from coordinator._maybe_refresh_commit_offsets(assignment)
+        self.assertEqual(resp, True)
+        self.assertEqual(tp_state.committed, OffsetAndMetadata(-1, ""))
+
+        # Commits do not send any requests to the coordinator
+        yield from coordinator.commit_offsets(
+            assignment, {tp: OffsetAndMetadata(10, "")})
+        self.assertEqual(tp_state.committed, OffsetAndMetadata(10, ""))
+
+        subscription.assign_from_user({tp})
+        assignment = subscription.subscription.assignment
+        tp_state = assignment.state_value(tp)
+        resp = yield from coordinator._maybe_refresh_commit_offsets(assignment)
+        self.assertEqual(tp_state.committed, OffsetAndMetadata(10, ""))
+        res = yield from coordinator.fetch_committed_offsets([tp])
+        self.assertEqual(res, {tp: OffsetAndMetadata(10, "")})
+
     @run_until_complete
     def test_coordinator__coordination_routine(self):
         client = AIOKafkaClient(loop=self.loop, bootstrap_servers=self.hosts)
@@ -0,0 +1,320 @@
+import asyncio
+import pytest
+import unittest
+
+from aiokafka.consumer import AIOKafkaConsumer
+from aiokafka.producer import AIOKafkaProducer
+from aiokafka.record.legacy_records import LegacyRecordBatchBuilder
+from aiokafka.errors import (
+    NotLeaderForPartitionError, ConnectionError, CorruptRecordException,
+    FencedInstanceIdError)
+from aiokafka.structs import TopicPartition
+from aiokafka.testing.fake_broker import _PartitionLog
+from aiokafka.util import ensure_future
+from ._testutil import run_until_complete, start_fake_broker
+
+
+def _message_set(magic, values, compression_type=0, offset=0):
+    builder = LegacyRecordBatchBuilder(
+        magic=magic, compression_type=compression_type, batch_size=99999)
+    for i, value in enumerate(values):
+        builder.append(offset + i, timestamp=1000 + i, key=None, value=value)
+    return bytes(builder.build())
+
+
+def test_partition_log_offsets():
+    log = _PartitionLog()
+    assert log.append(_message_set(1, [b"a", b"b"])) == 0
+    # Offsets in produced data are ignored
+    assert log.append(_message_set(1, [b"c"], offset=100)) == 2
+    # Compressed wrappers get the offset of their last message
+    assert log.append(_message_set(1, [b"d", b"e"], compression_type=1)) == 3
+    assert log.append(_message_set(0, [b"f", b"g"], compression_type=1)) == 5
+    assert log.highwater == 7
+
+    records = log.records()
+    assert [r.offset for r in records] == list(range(7))
+    assert [r.value for r in records] == [
+        b"a", b"b", b"c", b"d", b"e", b"f", b"g"]
+
+    # Reads start from the entry, that contains the offset
+    batch = _message_set(1, [b"d", b"e"], compression_type=1)
+    assert len(log.read(4, 1)) == len(batch)
+    assert log.read(7, 1000) == b""
+    # At least one entry is returned
+    assert len(log.read(0, 1)) == len(_message_set(1, [b"a"]))
+
+    assert log.offset_for_time(1001) == (1001, 1)
+    assert log.offset_for_time(5000) == (-1, -1)
+
+    with pytest.raises(CorruptRecordException):
+        log.append(b"\x00" * 20)
+    corrupted = bytearray(_message_set(1, [b"a"]))
+    corrupted[-1] ^= 0xFF
+    with pytest.raises(CorruptRecordException):
+        log.append(bytes(corrupted))
+    assert log.highwater == 7
+
+
+@pytest.mark.usefixtures('setup_test_class_serverless')
+class TestFakeBroker(unittest.TestCase):
+
+    @run_until_complete
+    def test_produce_consume(self):
+        broker = yield from start_fake_broker(self, topics={"topic": 2})
+        producer = AIOKafkaProducer(
+            loop=self.loop, bootstrap_servers=broker.bootstrap_servers)
+        yield from producer.start()
+        try:
+            for i in range(10):
+                yield from producer.send_and_wait(
+                    "topic", b"value" + str(i).encode(), partition=i % 2)
+            batch = producer.create_batch()
+            batch.append(key=None, value=b"batch", timestamp=None)
+            fut = yield from producer.send_batch(batch, "topic", partition=0)
+            meta = yield from fut
+            self.assertEqual(meta.offset, 5)
+        finally:
+            yield from producer.stop()
+
+        tp0 = TopicPartition("topic", 0)
+        self.assertEqual(broker.highwater(tp0), 6)
+
+        consumer = AIOKafkaConsumer(
+            "topic", loop=self.loop, group_id="group",
+            bootstrap_servers=broker.bootstrap_servers,
+            auto_offset_reset="earliest", enable_auto_commit=False)
+        yield from consumer.start()
+        try:
+            values = []
+            while len(values) < 11:
+                records = yield from consumer.getmany(timeout_ms=1000)
+                for tp_records in records.values():
+                    values.extend(r.value for r in tp_records)
+            self.assertEqual(sorted(values), sorted(
+                [b"value" + str(i).encode() for i in range(10)] + [b"batch"]))
+            self.assertEqual(
+                consumer.assignment(),
+                {tp0, TopicPartition("topic", 1)})
+
+            yield from consumer.commit()
+            self.assertEqual(broker.committed("group", tp0), (6, ""))
+            end_offsets = yield from consumer.end_offsets([tp0])
+            self.assertEqual(end_offsets, {tp0: 6})
+        finally:
+            yield from consumer.stop()
+
+    @run_until_complete
+    def test_group_rebalance(self):
+        broker = yield from start_fake_broker(self, topics={"topic": 4})
+        consumers = []
+        for _ in range(2):
+            consumer = AIOKafkaConsumer(
+                "topic", loop=self.loop, group_id="group",
+                bootstrap_servers=broker.bootstrap_servers,
+                heartbeat_interval_ms=100, session_timeout_ms=6000)
+            consumers.append(consumer)
+        try:
+            yield from consumers[0].start()
+            self.assertEqual(len(consumers[0].assignment()), 4)
+            yield from consumers[1].start()
+            for _ in range(100):
+                if len(consumers[0].assignment()) == 2 and \
+                        len(consumers[1].assignment()) == 2:
+                    break
+                yield from asyncio.sleep(0.05, loop=self.loop)
+            self.assertEqual(
+                consumers[0].assignment() | consumers[1].assignment(),
+                {TopicPartition("topic", i) for i in range(4)})
+
+            yield from consumers[1].stop()
+            for _ in range(100):
+                if len(consumers[0].assignment()) == 4:
+                    break
+                yield from asyncio.sleep(0.05, loop=self.loop)
+            self.assertEqual(len(consumers[0].assignment()), 4)
+        finally:
+            for consumer in consumers:
+                yield from consumer.stop()
+
+    @run_until_complete
+    def test_rebalance_keeps_buffered_records(self):
+        broker = yield from start_fake_broker(self, topics={"topic": 4})
+        producer = AIOKafkaProducer(
+            loop=self.loop, bootstrap_servers=broker.bootstrap_servers)
+        yield from producer.start()
+        self.addCleanup(self.loop.run_until_complete, producer.stop())
+        for partition in range(4):
+            yield from producer.send_and_wait(
+                "topic", b"value", partition=partition)
+
+        consumers = []
+        for _ in range(2):
+            consumer = AIOKafkaConsumer(
+                "topic", loop=self.loop, group_id="group",
+                bootstrap_servers=broker.bootstrap_servers,
+                auto_offset_reset="earliest",
+                heartbeat_interval_ms=100, session_timeout_ms=6000)
+            self.addCleanup(self.loop.run_until_complete, consumer.stop())
+            consumers.append(consumer)
+        yield from consumers[0].start()
+        fetcher = consumers[0]._fetcher
+        for _ in range(100):
+            if len(fetcher._records) == 4:
+                break
+            yield from asyncio.sleep(0.05, loop=self.loop)
+        buffered = dict(fetcher._records)
+        self.assertEqual(len(buffered), 4)
+        assignment = consumers[0]._subscription.subscription.assignment
+        states = {tp: assignment.state_value(tp) for tp in assignment.tps}
+        node_task = fetcher._nodes[0].task
+
+        yield from consumers[1].start()
+        for _ in range(100):
+            if len(consumers[0].assignment()) == 2 and \
+                    len(consumers[1].assignment()) == 2:
+                break
+            yield from asyncio.sleep(0.05, loop=self.loop)
+        retained = consumers[0].assignment()
+        self.assertEqual(len(retained), 2)
+
+        # Retained partitions keep their states and prefetched records
+        new_assignment = consumers[0]._subscription.subscription.assignment
+        self.assertIsNot(new_assignment, assignment)
+        for tp in retained:
+            self.assertIs(new_assignment.state_value(tp), states[tp])
+            self.assertIs(fetcher._records[tp], buffered[tp])
+        # Node fetch task is kept, only revoked partitions are dropped
+        self.assertIs(fetcher._nodes[0].task, node_task)
+        self.assertEqual(set(fetcher._tp_nodes), retained)
+        self.assertEqual(fetcher._nodes[0].tps, retained)
+        batch = yield from consumers[0].getmany(timeout_ms=1000)
+        self.assertEqual(set(batch), retained)
+        for tp in retained:
+            self.assertEqual((yield from consumers[0].position(tp)), 1)
+
+    @run_until_complete
+    def test_static_membership(self):
+        broker = yield from start_fake_broker(self, topics={"topic": 4})
+
+        def create_consumer(instance_id):
+            consumer = AIOKafkaConsumer(
+                "topic", loop=self.loop, group_id="group",
+                group_instance_id=instance_id,
+                bootstrap_servers=broker.bootstrap_servers,
+                heartbeat_interval_ms=100, session_timeout_ms=6000)
+            self.addCleanup(self.loop.run_until_complete, consumer.stop())
+            return consumer
+
+        consumer_a = create_consumer("a")
+        consumer_b = create_consumer("b")
+        yield from consumer_a.start()
+        yield from consumer_b.start()
+        for _ in range(100):
+            if len(consumer_a.assignment()) == 2 and \
+                    len(consumer_b.assignment()) == 2:
+                break
+            yield from asyncio.sleep(0.05, loop=self.loop)
+        assignment_a = consumer_a.assignment()
+        assignment_b = consumer_b.assignment()
+        self.assertEqual(len(assignment_a), 2)
+        generation = consumer_b._coordinator.generation
+        old_member_id = consumer_a._coordinator.member_id
+
+        # No LeaveGroup is sent on stop
+        yield from consumer_a.stop()
+        group = broker._groups["group"]
+        self.assertEqual(len(group.members), 2)
+        self.assertEqual(group.state, group.STABLE)
+
+        # Restarted instance gets its assignment back without a rebalance
+        consumer_a = create_consumer("a")
+        yield from consumer_a.start()
+        self.assertEqual(consumer_a.assignment(), assignment_a)
+        self.assertEqual(consumer_a._coordinator.generation, generation)
+        self.assertNotEqual(consumer_a._coordinator.member_id, old_member_id)
+        yield from asyncio.sleep(0.3, loop=self.loop)
+        self.assertEqual(consumer_b.assignment(), assignment_b)
+        self.assertEqual(consumer_b._coordinator.generation, generation)
+        self.assertEqual(group.generation, generation)
+
+        # The previous member id of the instance is fenced
+        self.assertIs(
+            group.check_member(old_member_id, generation, "a"),
+            FencedInstanceIdError)
+        tp = next(iter(assignment_a))
+        yield from consumer_a.commit({tp: 1})
+        self.assertEqual(broker.committed("group", tp), (1, ""))
+
+    @run_until_complete
+    def test_static_member_fenced(self):
+        broker = yield from start_fake_broker(self, topics={"topic": 2})
+
+        def create_consumer():
+            consumer = AIOKafkaConsumer(
+                "topic", loop=self.loop, group_id="group",
+                group_instance_id="a",
+                bootstrap_servers=broker.bootstrap_servers,
+                heartbeat_interval_ms=100, session_timeout_ms=6000)
+            self.addCleanup(self.loop.run_until_complete, consumer.stop())
+            return consumer
+
+        consumer1 = create_consumer()
+        yield from consumer1.start()
+        self.assertEqual(len(consumer1.assignment()), 2)
+        pending = ensure_future(consumer1.getone(), loop=self.loop)
+        yield from asyncio.sleep(0.05, loop=self.loop)
+
+        # Second instance with the same id fences the first one
+        consumer2 = create_consumer()
+        yield from consumer2.start()
+        self.assertEqual(consumer2.assignment(), consumer1.assignment())
+        with self.assertRaises(FencedInstanceIdError):
+            yield from asyncio.wait_for(pending, 2, loop=self.loop)
+        with self.assertRaises(FencedInstanceIdError):
+            yield from consumer1.getone()
+        with self.assertRaises(FencedInstanceIdError):
+            yield from consumer1.getmany(timeout_ms=100)
+        with self.assertRaises(FencedInstanceIdError):
+            yield from consumer1.commit({TopicPartition("topic", 0): 1})
+        coordinator = consumer1._coordinator
+        self.assertTrue(coordinator._heartbeat_task.done())
+        self.assertTrue(coordinator._coordination_task.done())
+        self.assertTrue(consumer1._fetcher._fetch_task.done())
+        self.assertEqual(consumer1._fetcher._nodes, {})
+        tp = TopicPartition("topic", 0)
+        self.assertIsNone(broker.committed("group", tp))
+        yield from consumer1.stop()
+
+        # The new instance is not affected
+        yield from consumer2.commit({tp: 1})
+        self.assertEqual(broker.committed("group", tp), (1, ""))
+
+    @run_until_complete
+    def test_injected_errors_and_latency(self):
+        broker = yield from start_fake_broker(
+            self, topics={"topic": 1}, latency_ms=0)
+        producer = AIOKafkaProducer(
+            loop=self.loop, bootstrap_servers=broker.bootstrap_servers,
+            retry_backoff_ms=10)
+        yield from producer.start()
+        try:
+            # Retriable errors are retried by the producer
+            broker.inject_error(0, NotLeaderForPartitionError, count=2)
+            meta = yield from producer.send_and_wait("topic", b"1")
+            self.assertEqual(meta.offset, 0)
+
+            # Connection is closed instead of responding
+            broker.inject_error(0, ConnectionError)
+            meta = yield from producer.send_and_wait("topic", b"2")
+            self.assertEqual(meta.offset, 1)
+
+            broker.set_latency(200, api_key=0)
+            start = self.loop.time()
+            yield from producer.send_and_wait("topic", b"3")
+            self.assertGreaterEqual(self.loop.time() - start, 0.2)
+        finally:
+            yield from producer.stop()
+        self.assertEqual(
+            [r.value for r in broker.records(TopicPartition("topic", 0))],
+            [b"1", b"2", b"3"])
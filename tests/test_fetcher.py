@@ -9,7 +9,8 @@ from kafka.protocol.offset import OffsetResponse
 from aiokafka.record.legacy_records import LegacyRecordBatchBuilder
 
 from aiokafka.consumer.fetch import (
-    FetchRequest_v0 as FetchRequest, FetchResponse_v0 as FetchResponse)
+    FetchRequest_v0 as FetchRequest, FetchResponse_v0 as FetchResponse,
+    FetchResponse_v1)
 from aiokafka.errors import (
     TopicAuthorizationFailedError, UnknownError, UnknownTopicOrPartitionError,
     OffsetOutOfRangeError, KafkaTimeoutError, NotLeaderForPartitionError
@@ -22,6 +23,9 @@ from aiokafka.consumer.fetcher import (
     Fetcher, FetchResult, FetchError, ConsumerRecord, OffsetResetStrategy
 )
 from aiokafka.consumer.subscription_state import SubscriptionState
+from aiokafka.consumer.drain_policy import (
+    RoundRobinDrainPolicy, LagWeightedDrainPolicy, PriorityDrainPolicy
+)
 from aiokafka.util import ensure_future
 from ._testutil import run_until_complete
 
@@ -56,6 +60,57 @@ def test_fetch_result_and_error(loop):
     assert repr(error) == "<FetchError error=OffsetOutOfRangeError({},)>"
 
 
+def test_drain_policies(loop):
+    tp0 = TopicPartition("topic", 0)
+    tp1 = TopicPartition("topic", 1)
+    tp2 = TopicPartition("other", 0)
+    subscriptions = SubscriptionState(loop=loop)
+    subscriptions.assign_from_user({tp0, tp1, tp2})
+    assignment = subscriptions.subscription.assignment
+    for tp, position, highwater in [
+            (tp0, 10, 20), (tp1, 10, 1000), (tp2, 0, None)]:
+        tp_state = assignment.state_value(tp)
+        tp_state.seek(position)
+        tp_state.highwater = highwater
+
+    def drain(policy, tps):
+        for tp in tps:
+            policy.push(tp, assignment)
+        assert len(policy) == len(tps)
+        res = [policy.pop() for _ in tps]
+        assert len(policy) == 0
+        with pytest.raises(IndexError):
+            policy.pop()
+        return res
+
+    policy = RoundRobinDrainPolicy()
+    assert drain(policy, [tp2, tp0, tp1]) == [tp2, tp0, tp1]
+
+    policy = LagWeightedDrainPolicy()
+    assert drain(policy, [tp2, tp0, tp1]) == [tp1, tp0, tp2]
+    policy.push(tp0, None)
+    policy.push(tp1, None)
+    assert policy.pop() == tp0
+    policy.clear()
+    assert len(policy) == 0
+
+    policy = PriorityDrainPolicy({tp0: 5, "other": 3})
+    assert drain(policy, [tp1, tp2, tp0]) == [tp0, tp2, tp1]
+    policy = PriorityDrainPolicy(lambda tp: tp.partition)
+    assert drain(policy, [tp1, tp2, tp0]) == [tp1, tp2, tp0]
+
+    # Removed partitions are skipped and can be pushed again
+    for tp in [tp0, tp1, tp2]:
+        policy.push(tp, assignment)
+    policy.remove(tp1)
+    assert len(policy) == 2
+    policy.push(tp1, assignment)
+    policy.remove(tp2)
+    assert [policy.pop() for _ in range(len(policy))] == [tp1, tp0]
+    with pytest.raises(IndexError):
+        policy.pop()
+
+
 @pytest.mark.usefixtures('setup_test_class_serverless')
 class TestFetcher(unittest.TestCase):
 
@@ -237,7 +292,7 @@ class TestFetcher(unittest.TestCase):
         client.ready.side_effect = asyncio.coroutine(lambda a: True)
         client.force_metadata_update = mock.MagicMock()
         client.force_metadata_update.side_effect = asyncio.coroutine(
-            lambda: False)
+            lambda topics=None: False)
         client.send = mock.MagicMock()
 
         builder = LegacyRecordBatchBuilder(
@@ -246,7 +301,7 @@ class TestFetcher(unittest.TestCase):
         raw_batch = bytes(builder.build())
 
         client.send.side_effect = asyncio.coroutine(
-            lambda n, r: FetchResponse(
+            lambda n, r, **kw: FetchResponse(
                 [('test', [(0, 0, 9, raw_batch)])]))
         subscriptions.assign_from_user({tp})
         assignment = subscriptions.subscription.assignment
@@ -294,7 +349,7 @@ class TestFetcher(unittest.TestCase):
         subscriptions.seek(tp, 4)
         fetcher._records.clear()
         client.send.side_effect = asyncio.coroutine(
-            lambda n, r: FetchResponse(
+            lambda n, r, **kw: FetchResponse(
                 [('test', [(0, 3, 9, raw_batch)])]))
         cc = client.force_metadata_update.call_count
         needs_wake_up = yield from fetcher._proc_fetch_request(
@@ -304,7 +359,7 @@ class TestFetcher(unittest.TestCase):
 
         # error -> topic auth failed (TopicAuthorizationFailedError)
         client.send.side_effect = asyncio.coroutine(
-            lambda n, r: FetchResponse(
+            lambda n, r, **kw: FetchResponse(
                 [('test', [(0, 29, 9, raw_batch)])]))
         needs_wake_up = yield from fetcher._proc_fetch_request(
             assignment, 0, req)
@@ -314,7 +369,7 @@ class TestFetcher(unittest.TestCase):
 
         # error -> unknown
         client.send.side_effect = asyncio.coroutine(
-            lambda n, r: FetchResponse(
+            lambda n, r, **kw: FetchResponse(
                 [('test', [(0, -1, 9, raw_batch)])]))
         needs_wake_up = yield from fetcher._proc_fetch_request(
             assignment, 0, req)
@@ -322,7 +377,7 @@ class TestFetcher(unittest.TestCase):
 
         # error -> offset out of range with offset strategy
         client.send.side_effect = asyncio.coroutine(
-            lambda n, r: FetchResponse(
+            lambda n, r, **kw: FetchResponse(
                 [('test', [(0, 1, 9, raw_batch)])]))
         needs_wake_up = yield from fetcher._proc_fetch_request(
             assignment, 0, req)
@@ -362,13 +417,13 @@ class TestFetcher(unittest.TestCase):
             topic="some_topic", partition=1, offset=0, timestamp=0,
             timestamp_type=0, key=None, value=b"some", checksum=None,
             serialized_key_size=0, serialized_value_size=4)]
-        fetcher._records[tp2] = FetchResult(
+        fetcher._add_buffered(tp2, FetchResult(
             tp2, assignment=assignment, loop=self.loop,
             message_iterator=iter(messages), backoff=0,
-            fetch_offset=0)
+            fetch_offset=0))
         # Add some error
-        fetcher._records[tp1] = FetchError(
-            loop=self.loop, error=OffsetOutOfRangeError({}), backoff=0)
+        fetcher._add_buffered(tp1, FetchError(
+            loop=self.loop, error=OffsetOutOfRangeError({}), backoff=0))
         return fetcher, tp1, tp2, messages
 
     @run_until_complete
@@ -400,6 +455,210 @@ class TestFetcher(unittest.TestCase):
             yield from asyncio.wait_for(
                 fetcher.next_record([]), timeout=0.1, loop=self.loop)
 
+    def _record(self, tp, offset):
+        return ConsumerRecord(
+            topic=tp.topic, partition=tp.partition, offset=offset,
+            timestamp=0, timestamp_type=0, key=None, value=b"some",
+            checksum=None, serialized_key_size=0, serialized_value_size=4)
+
+    def _setup_buffered_partitions(self, count, drain_policy=None,
+                                   highwaters=None):
+        subscriptions = SubscriptionState(loop=self.loop)
+        client = AIOKafkaClient(
+            loop=self.loop,
+            bootstrap_servers=[])
+        fetcher = Fetcher(
+            client, subscriptions, loop=self.loop, drain_policy=drain_policy)
+        self.add_cleanup(fetcher.close)
+        tps = [TopicPartition('some_topic', i) for i in range(count)]
+
+        subscriptions.subscribe(set(["some_topic"]))
+        subscriptions.assign_from_subscribed(set(tps))
+        assignment = subscriptions.subscription.assignment
+        for i, tp in enumerate(tps):
+            subscriptions.seek(tp, 0)
+            if highwaters is not None:
+                assignment.state_value(tp).highwater = highwaters[i]
+            messages = [self._record(tp, offset) for offset in range(10)]
+            fetcher._add_buffered(tp, FetchResult(
+                tp, assignment=assignment, loop=self.loop,
+                message_iterator=iter(messages), backoff=0,
+                fetch_offset=0))
+        return fetcher, tps, assignment
+
+    @run_until_complete
+    def test_fetched_records_round_robin(self):
+        fetcher, tps, _ = self._setup_buffered_partitions(3)
+
+        # With `max_records` every partition should be served in turn, even
+        # if the first one still has buffered data.
+        served = []
+        for i in range(6):
+            records = yield from fetcher.fetched_records([], max_records=5)
+            self.assertEqual(len(records), 1)
+            served.extend(records.keys())
+        self.assertEqual(served, tps + tps)
+
+        records = yield from fetcher.fetched_records([], max_records=5)
+        self.assertEqual(records, {})
+
+    @run_until_complete
+    def test_next_record_round_robin(self):
+        fetcher, tps, _ = self._setup_buffered_partitions(3)
+
+        served = []
+        for i in range(6):
+            msg = yield from fetcher.next_record([])
+            served.append(TopicPartition(msg.topic, msg.partition))
+        self.assertEqual(served, tps + tps)
+
+    @run_until_complete
+    def test_fetched_records_lag_weighted(self):
+        fetcher, tps, assignment = self._setup_buffered_partitions(
+            3, drain_policy=LagWeightedDrainPolicy(),
+            highwaters=[100, 300, 200])
+
+        records = yield from fetcher.fetched_records([], max_records=5)
+        self.assertEqual(list(records.keys()), [tps[1]])
+        records = yield from fetcher.fetched_records([], max_records=12)
+        self.assertEqual(list(records.keys()), [tps[1], tps[2]])
+        self.assertEqual(len(records[tps[1]]), 5)
+        self.assertEqual(len(records[tps[2]]), 7)
+
+        # Data dropped by seek is queued with the new lag once fetched again
+        fetcher.seek_to(tps[0], 0)
+        assignment.state_value(tps[0]).highwater = 1000
+        fetcher._add_buffered(tps[0], FetchResult(
+            tps[0], assignment=assignment, loop=self.loop,
+            message_iterator=iter([self._record(tps[0], 0)]), backoff=0,
+            fetch_offset=0))
+        records = yield from fetcher.fetched_records([], max_records=2)
+        self.assertEqual(list(records.keys()), [tps[0], tps[2]])
+
+    @run_until_complete
+    def test_next_record_skips_dropped_partitions(self):
+        fetcher, tps, _ = self._setup_buffered_partitions(3)
+
+        # Partitions, which buffered data is dropped by `seek_to()`, are
+        # removed from the ready queue.
+        fetcher.seek_to(tps[0], 5)
+        self.assertEqual(len(fetcher._drain_policy), 2)
+        msg = yield from fetcher.next_record([])
+        self.assertEqual(msg.partition, tps[1].partition)
+
+        # Explicit partitions do not change the queue order
+        msg = yield from fetcher.next_record([tps[2]])
+        self.assertEqual(msg.partition, tps[2].partition)
+        msg = yield from fetcher.next_record([])
+        self.assertEqual(msg.partition, tps[2].partition)
+        msg = yield from fetcher.next_record([])
+        self.assertEqual(msg.partition, tps[1].partition)
+        self.assertEqual(len(fetcher._drain_policy), 2)
+
+    @run_until_complete
+    def test_fetch_requests_per_node(self):
+        client = AIOKafkaClient(
+            loop=self.loop,
+            bootstrap_servers=[])
+        tp0 = TopicPartition('test', 0)
+        tp1 = TopicPartition('test', 1)
+        leaders = {tp0: 0, tp1: 1}
+        client.cluster.leader_for_partition = mock.MagicMock()
+        client.cluster.leader_for_partition.side_effect = leaders.get
+
+        sent = []
+
+        @asyncio.coroutine
+        def send(node_id, request, **kw):
+            sent.append(node_id)
+            topics = []
+            for topic, partitions in request.topics:
+                partition_data = []
+                for partition, offset, _ in partitions:
+                    builder = LegacyRecordBatchBuilder(
+                        magic=1, compression_type=0, batch_size=99999999)
+                    builder.append(
+                        offset=offset, value=b"msg", key=None, timestamp=None)
+                    partition_data.append(
+                        (partition, 0, 9, bytes(builder.build())))
+                topics.append((topic, partition_data))
+            return FetchResponse(topics)
+        client.send = mock.MagicMock()
+        client.send.side_effect = send
+
+        subscriptions = SubscriptionState(loop=self.loop)
+        fetcher = Fetcher(
+            client, subscriptions, loop=self.loop, prefetch_backoff=0)
+        self.add_cleanup(fetcher.close)
+        subscriptions.assign_from_user({tp0, tp1})
+        subscriptions.seek(tp0, 0)
+        subscriptions.seek(tp1, 0)
+
+        # Each node gets a fetch request for it's own partitions and does not
+        # fetch again until data is consumed.
+        records = yield from fetcher.fetched_records([tp0], timeout=1)
+        self.assertEqual(len(records[tp0]), 1)
+        yield from asyncio.sleep(0.1, loop=self.loop)
+        self.assertEqual(sorted(sent), [0, 0, 1])
+        self.assertEqual(set(fetcher._records), {tp0, tp1})
+
+        # Leader change moves the partition to another node. Nodes without
+        # partitions are stopped.
+        node1 = fetcher._nodes[1]
+        leaders[tp1] = 0
+        fetcher._handle_metadata_update(client.cluster)
+        self.assertEqual(set(fetcher._nodes), {0})
+        self.assertEqual(fetcher._nodes[0].tps, {tp0, tp1})
+        self.assertEqual(fetcher._closing_nodes, {node1})
+        yield from asyncio.sleep(0, loop=self.loop)
+        self.assertTrue(node1.task.done())
+        yield from asyncio.sleep(0, loop=self.loop)
+        self.assertEqual(fetcher._closing_nodes, set())
+
+        records = yield from fetcher.fetched_records([tp1], timeout=1)
+        self.assertEqual(len(records[tp1]), 1)
+        yield from asyncio.sleep(0.1, loop=self.loop)
+        self.assertEqual(sorted(sent), [0, 0, 0, 1])
+        self.assertEqual(set(fetcher._records), {tp0, tp1})
+
+        # No leader for partition
+        leaders.pop(tp0)
+        fetcher._handle_metadata_update(client.cluster)
+        self.assertEqual(fetcher._no_leader_tps, {tp0})
+        self.assertEqual(fetcher._nodes[0].tps, {tp1})
+
+    @run_until_complete
+    def test_fetch_throttle_time(self):
+        client = AIOKafkaClient(
+            loop=self.loop,
+            bootstrap_servers=[])
+        tp = TopicPartition('test', 0)
+        client.cluster.leader_for_partition = mock.MagicMock()
+        client.cluster.leader_for_partition.return_value = 0
+
+        sent = []
+
+        @asyncio.coroutine
+        def send(node_id, request, **kw):
+            sent.append(self.loop.time())
+            # Empty response, that asks to back off for 200ms
+            return FetchResponse_v1(200, [('test', [(0, 0, 9, b"")])])
+        client.send = mock.MagicMock()
+        client.send.side_effect = send
+
+        subscriptions = SubscriptionState(loop=self.loop)
+        fetcher = Fetcher(
+            client, subscriptions, loop=self.loop, fetcher_timeout=0.01)
+        self.add_cleanup(fetcher.close)
+        subscriptions.assign_from_user({tp})
+        subscriptions.seek(tp, 0)
+
+        yield from asyncio.sleep(0.3, loop=self.loop)
+        # Without throttling the node would fetch every `fetcher_timeout`
+        self.assertEqual(len(sent), 2)
+        self.assertGreaterEqual(sent[1] - sent[0], 0.2)
+        self.assertGreater(fetcher._nodes[0].throttled_until, sent[1])
+
     @run_until_complete
     def test_compacted_topic_consumption(self):
         # Compacted topics can have offsets skipped
@@ -410,7 +669,7 @@ class TestFetcher(unittest.TestCase):
         client.ready.side_effect = asyncio.coroutine(lambda a: True)
         client.force_metadata_update = mock.MagicMock()
         client.force_metadata_update.side_effect = asyncio.coroutine(
-            lambda: False)
+            lambda topics=None: False)
         client.send = mock.MagicMock()
 
         subscriptions = SubscriptionState(loop=self.loop)
@@ -437,10 +696,9 @@ class TestFetcher(unittest.TestCase):
         subscriptions.assign_from_user({tp})
         assignment = subscriptions.subscription.assignment
         tp_state = assignment.state_value(tp)
-        client.send.side_effect = asyncio.coroutine(lambda n, r: resp)
+        client.send.side_effect = asyncio.coroutine(lambda n, r, **kw: resp)
 
         tp_state.seek(155)
-        fetcher._in_flight.add(0)
         needs_wake_up = yield from fetcher._proc_fetch_request(
             assignment, 0, req)
         self.assertEqual(needs_wake_up, True)
@@ -491,7 +749,7 @@ class TestFetcher(unittest.TestCase):
         # Broker returns UnsupportedForMessageFormatError
         with mock.patch.object(client, "send") as mocked:
             @asyncio.coroutine
-            def mock_send(node_id, request):
+            def mock_send(node_id, request, **kw):
                 return OffsetResponse[1]([
                     ("topic", [(0, 43, -1, -1)]),
                     ("topic", [(1, 0, 1000, 9999)])
@@ -506,7 +764,7 @@ class TestFetcher(unittest.TestCase):
         # Brokers returns NotLeaderForPartitionError
         with mock.patch.object(client, "send") as mocked:
             @asyncio.coroutine
-            def mock_send(node_id, request):
+            def mock_send(node_id, request, **kw):
                 return OffsetResponse[1]([
                     ("topic", [(0, 6, -1, -1)]),
                 ])
@@ -518,7 +776,7 @@ class TestFetcher(unittest.TestCase):
         # Broker returns UnknownTopicOrPartitionError
         with mock.patch.object(client, "send") as mocked:
             @asyncio.coroutine
-            def mock_send(node_id, request):
+            def mock_send(node_id, request, **kw):
                 return OffsetResponse[1]([
                     ("topic", [(0, 3, -1, -1)]),
                 ])
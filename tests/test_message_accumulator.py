@@ -9,6 +9,8 @@ from kafka.common import (TopicPartition, KafkaTimeoutError,
                           NotLeaderForPartitionError,
                           LeaderNotAvailableError)
 from ._testutil import run_until_complete
+from aiokafka.metrics import Metrics
+from aiokafka.record.legacy_records import LegacyRecordBatchBuilder
 from aiokafka.util import ensure_future
 from aiokafka.producer.message_accumulator import (
     MessageAccumulator, MessageBatch, BatchBuilder
@@ -186,6 +188,75 @@ class TestMessageAccumulator(unittest.TestCase):
         fut01.cancel()
         batches[0][tp0].done(base_offset=21)  # no error in this case
 
+    @run_until_complete
+    def test_batch_metrics(self):
+        tp0 = TopicPartition("test-topic", 0)
+        cluster = ClusterMetadata(metadata_max_age_ms=10000)
+        cluster.leader_for_partition = mock.MagicMock(return_value=0)
+        metrics = Metrics()
+        ma = MessageAccumulator(
+            cluster, 1000, LegacyRecordBatchBuilder.CODEC_GZIP, 30, self.loop,
+            metrics=metrics)
+        for _ in range(10):
+            yield from ma.add_message(tp0, None, b'value' * 10, timeout=2)
+        snapshot = metrics.snapshot()
+        self.assertEqual(
+            snapshot[("aiokafka_producer_buffered_batches", ())], 1)
+
+        batches, _ = ma.drain_by_nodes(ignore_nodes=[])
+        snapshot = metrics.snapshot()
+        self.assertEqual(
+            snapshot[("aiokafka_producer_buffered_batches", ())], 0)
+        self.assertEqual(snapshot[("aiokafka_producer_records_total", ())], 10)
+        records = snapshot[("aiokafka_producer_batch_records", ())]
+        self.assertEqual(records["count"], 1)
+        self.assertEqual(records["sum"], 10)
+        ratio = snapshot[("aiokafka_producer_compression_ratio", ())]
+        self.assertLess(ratio["max"], 0.5)
+        size = snapshot[("aiokafka_producer_batch_size_bytes", ())]
+        self.assertEqual(size["sum"], batches[0][tp0]._builder.size())
+
+    @run_until_complete
+    def test_drain_by_nodes_leader_index(self):
+        tp0 = TopicPartition("test-topic", 0)
+        tp1 = TopicPartition("test-topic", 1)
+        leaders = {tp0: 0, tp1: 1}
+
+        cluster = ClusterMetadata(metadata_max_age_ms=10000)
+        cluster.leader_for_partition = mock.MagicMock()
+        cluster.leader_for_partition.side_effect = leaders.get
+
+        ma = MessageAccumulator(cluster, 1000, 0, 0.1, self.loop)
+        yield from ma.add_message(tp0, None, b'value', timeout=2)
+        yield from ma.add_message(tp1, None, b'value', timeout=2)
+        self.assertEqual(cluster.leader_for_partition.call_count, 2)
+
+        # Leaders are not looked up again on drain
+        batches, unknown_leaders_exist = ma.drain_by_nodes(ignore_nodes=[1])
+        self.assertEqual(list(batches), [0])
+        self.assertEqual(unknown_leaders_exist, False)
+        batches[0][tp0].done(base_offset=0)
+        fut = yield from ma.add_message(tp0, None, b'value', timeout=2)
+        self.assertEqual(cluster.leader_for_partition.call_count, 2)
+
+        # Partitions are moved to new leaders on metadata update
+        leaders[tp1] = 0
+        del leaders[tp0]
+        ma._handle_metadata_update(cluster)
+        batches, unknown_leaders_exist = ma.drain_by_nodes(ignore_nodes=[])
+        self.assertEqual(list(batches), [0])
+        self.assertEqual(list(batches[0]), [tp1])
+        self.assertEqual(unknown_leaders_exist, True)
+
+        # Batches for partitions without leader expire
+        yield from asyncio.sleep(0.15, loop=self.loop)
+        batches, unknown_leaders_exist = ma.drain_by_nodes(ignore_nodes=[])
+        self.assertEqual(batches, {})
+        self.assertEqual(unknown_leaders_exist, False)
+        self.assertEqual(ma._batches.get(tp0), None)
+        with self.assertRaises(NotLeaderForPartitionError):
+            yield from fut
+
     @run_until_complete
     def test_message_batch_builder_basic(self):
         magic = 0
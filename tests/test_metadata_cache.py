@@ -0,0 +1,171 @@
+import asyncio
+import os
+import pytest
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from aiokafka.client import AIOKafkaClient
+from aiokafka.metadata_cache import MetadataCache
+from aiokafka.producer import AIOKafkaProducer
+from aiokafka.structs import TopicPartition
+from aiokafka.testing import FakeBroker
+from ._testutil import (
+    record_requests, run_until_complete, start_client, start_fake_broker)
+
+
+HOSTS = [("127.0.0.1", 9092, 2)]
+METADATA = [
+    [[0, "127.0.0.1", 9092, None]], 0,
+    [[0, "topic", False, [[0, 0, 0, [0], [0]]]]]]
+
+
+class TestMetadataCacheFile(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def test_save_load(self):
+        cache = MetadataCache(os.path.join(self.path, "sub"))
+        self.assertIsNone(cache.load(HOSTS))
+        cache.save(HOSTS, (0, 10, 1), METADATA)
+        entry = cache.load(HOSTS)
+        self.assertEqual(entry["api_version"], (0, 10, 1))
+        self.assertEqual(entry["metadata"], [
+            [(0, "127.0.0.1", 9092, None)], 0,
+            [(0, "topic", False, [(0, 0, 0, [0], [0])])]])
+        # Entries are keyed by bootstrap servers
+        self.assertIsNone(cache.load([("127.0.0.2", 9092, 2)]))
+
+        cache.invalidate(HOSTS)
+        self.assertIsNone(cache.load(HOSTS))
+        cache.invalidate(HOSTS)
+
+    def test_stale_and_broken(self):
+        cache = MetadataCache(self.path, max_age_ms=1000)
+        cache.save(HOSTS, (0, 10, 1), METADATA)
+        with mock.patch("time.time", return_value=time.time() + 2):
+            self.assertIsNone(cache.load(HOSTS))
+        self.assertIsNotNone(cache.load(HOSTS))
+
+        with open(cache._entry_path(HOSTS), "w") as f:
+            f.write("{not json")
+        self.assertIsNone(cache.load(HOSTS))
+        with open(cache._entry_path(HOSTS), "w") as f:
+            f.write('{"format": 1, "timestamp": 0}')
+        self.assertIsNone(MetadataCache(self.path).load(HOSTS))
+
+
+@pytest.mark.usefixtures('setup_test_class_serverless')
+class TestMetadataCacheClient(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    @run_until_complete
+    def test_start_from_cache(self):
+        broker = yield from start_fake_broker(self, topics={"topic": 2})
+        requests = record_requests(broker)
+        cache = MetadataCache(self.path)
+
+        client = AIOKafkaClient(
+            loop=self.loop, bootstrap_servers=broker.bootstrap_servers,
+            metadata_cache=cache)
+        yield from client.bootstrap()
+        api_version = client.api_version
+        yield from client.close()
+        self.assertTrue(requests)
+        entry = cache.load(client.hosts)
+        self.assertEqual(entry["api_version"], api_version)
+
+        del requests[:]
+        producer = AIOKafkaProducer(
+            loop=self.loop, bootstrap_servers=broker.bootstrap_servers,
+            metadata_cache=cache)
+        yield from producer.start()
+        self.addCleanup(self.loop.run_until_complete, producer.stop())
+        client = producer.client
+        # Nothing is sent to the broker before the client is ready
+        self.assertEqual(requests, [])
+        self.assertEqual(client.api_version, api_version)
+        self.assertEqual(client.cluster.partitions_for_topic("topic"), {0, 1})
+        self.assertIsNotNone(client._cache_validation_task)
+
+        yield from producer.send_and_wait("topic", b"value", partition=1)
+        yield from client._cache_validation_task
+        self.assertIsNone(client._cache_validation_task)
+        self.assertEqual(len(broker.records(TopicPartition("topic", 1))), 1)
+
+    @run_until_complete
+    def test_cached_brokers_unavailable(self):
+        broker = yield from start_fake_broker(self, topics={"topic": 1})
+        cache = MetadataCache(self.path)
+        client = AIOKafkaClient(
+            loop=self.loop, bootstrap_servers=broker.bootstrap_servers,
+            metadata_cache=cache)
+        # Broker moved to another port since the entry was written
+        dead_broker = FakeBroker(loop=self.loop)
+        yield from dead_broker.start()
+        yield from dead_broker.close()
+        cache.save(client.hosts, (0, 10, 1), [
+            [[0, dead_broker.host, dead_broker.port, None]], 0, []])
+
+        yield from client.bootstrap()
+        self.addCleanup(self.loop.run_until_complete, client.close())
+        yield from client._cache_validation_task
+        self.assertEqual(
+            [(b.host, b.port) for b in client.cluster.brokers()],
+            [(broker.host, broker.port)])
+        self.assertEqual(client.cluster.topics(), {"topic"})
+        entry = cache.load(client.hosts)
+        self.assertEqual(entry["metadata"][0][0][2], broker.port)
+
+    @asyncio.coroutine
+    def _start_cached_client(self, cache):
+        broker = yield from start_fake_broker(self, topics={"topic": 1})
+        client = yield from start_client(self, broker, metadata_cache=cache)
+        yield from client.close()
+        self.assertIsNotNone(cache.load(client.hosts))
+
+        client = AIOKafkaClient(
+            loop=self.loop, bootstrap_servers=broker.bootstrap_servers,
+            metadata_cache=cache)
+        yield from client.bootstrap()
+        self.addCleanup(self.loop.run_until_complete, client.close())
+        return broker, client
+
+    @run_until_complete
+    def test_validation_keeps_pooled_connections(self):
+        cache = MetadataCache(self.path)
+        broker, client = yield from self._start_cached_client(cache)
+        conn = yield from client._get_conn(0)
+        yield from client._cache_validation_task
+        self.assertTrue(conn.connected())
+        self.assertIs((yield from client._get_conn(0)), conn)
+
+    @run_until_complete
+    def test_unchanged_metadata_saved_once(self):
+        cache = MetadataCache(self.path)
+        broker, client = yield from self._start_cached_client(cache)
+        yield from client._cache_validation_task
+        with mock.patch.object(cache, "save") as save:
+            yield from client.force_metadata_update()
+            yield from client.force_metadata_update(["topic"])
+            self.assertEqual(save.call_count, 0)
+
+            broker.create_topic("topic2", 1)
+            yield from client.force_metadata_update()
+            self.assertEqual(save.call_count, 1)
+
+    @run_until_complete
+    def test_close_before_validation(self):
+        cache = MetadataCache(self.path)
+        broker, client = yield from self._start_cached_client(cache)
+        task = client._cache_validation_task
+        yield from client.close()
+        self.assertTrue(task.done())
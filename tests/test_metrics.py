@@ -0,0 +1,138 @@
+import asyncio
+
+from aiokafka.client import AIOKafkaClient
+from aiokafka.metrics import Metrics, Histogram
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_counter():
+    metrics = Metrics()
+    counter = metrics.counter("requests_total", "Requests", node="1")
+    counter.inc()
+    counter.inc(2)
+    # Same name and tags return the same instrument
+    assert metrics.counter("requests_total", node=1) is counter
+    assert metrics.counter("requests_total", node=2) is not counter
+    assert metrics.snapshot() == {
+        ("requests_total", (("node", "1"),)): 3,
+        ("requests_total", (("node", "2"),)): 0,
+    }
+
+
+def test_rate():
+    clock = FakeClock()
+    metrics = Metrics(rate_window_ms=10000, rate_samples=2, time_fn=clock)
+    rate = metrics.rate("records_rate")
+    clock.now += 1
+    rate.record(10)
+    assert rate.value() == 10.0
+    clock.now += 4
+    rate.record(30)
+    assert rate.value() == 8.0
+    # First sample is dropped after a full window
+    clock.now += 6
+    assert rate.value() == 3.0
+    clock.now += 10
+    assert rate.value() == 0.0
+
+
+def test_histogram():
+    hist = Histogram([1, 2, 5, 10])
+    assert hist.quantile(0.5) is None
+    for value in range(1, 101):
+        hist.record(value / 10)
+    assert hist.counts == [10, 10, 30, 50, 0]
+    assert hist.count == 100
+    assert hist.max == 10
+    assert abs(hist.sum - 505) < 1e-9
+    assert hist.quantile(0.5) == 5
+    assert hist.quantile(0.99) == 9.9
+    assert hist.quantile(0.1) == 1
+
+    # Values above the last bucket are capped by max value
+    hist.record(50)
+    assert hist.counts[-1] == 1
+    assert hist.quantile(1) == 50
+
+
+def test_disabled():
+    metrics = Metrics(enabled=False)
+    metrics.counter("requests_total").inc()
+    metrics.histogram("latency_seconds").record(0.1)
+    metrics.rate("records_rate").record(1)
+    metrics.gauge("queue_size", lambda: 1)
+    assert metrics.snapshot() == {}
+    assert metrics.to_prometheus() == ""
+
+
+def test_tags_and_kinds():
+    metrics = Metrics()
+    view = metrics.with_tags(client_id="client-1")
+    view.counter("requests_total", node_id=1).inc()
+    assert metrics.snapshot() == {
+        ("requests_total", (("client_id", "client-1"), ("node_id", "1"))): 1
+    }
+    try:
+        metrics.histogram("requests_total")
+    except ValueError:
+        pass
+    else:
+        assert False, "ValueError expected"
+
+    size = [5]
+    metrics.gauge("queue_size", lambda: size[0])
+    size[0] = 7
+    assert metrics.snapshot()[("queue_size", ())] == 7
+    metrics.remove("queue_size")
+    assert ("queue_size", ()) not in metrics.snapshot()
+
+
+def test_prometheus():
+    metrics = Metrics()
+    metrics.counter("requests_total", "Sent requests", broker='h"1').inc(2)
+    hist = metrics.histogram("latency_seconds", buckets=[0.1, 1])
+    hist.record(0.05)
+    hist.record(0.5)
+    hist.record(5)
+    metrics.gauge("lag", lambda: None)
+    assert metrics.to_prometheus() == "\n".join([
+        "# HELP requests_total Sent requests",
+        "# TYPE requests_total counter",
+        'requests_total{broker="h\\"1"} 2',
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        "latency_seconds_sum 5.55",
+        "latency_seconds_count 3",
+        "",
+    ])
+
+
+def test_clients_sharing_registry():
+    metrics = Metrics()
+    loop = asyncio.new_event_loop()
+    try:
+        client1 = AIOKafkaClient(loop=loop, metrics=metrics)
+        client2 = AIOKafkaClient(loop=loop, metrics=metrics)
+    finally:
+        loop.close()
+    gauge1 = client1.metrics.gauge("buffered", lambda: 1)
+    gauge2 = client2.metrics.gauge("buffered", lambda: 2)
+    assert gauge1 is not gauge2
+    client1.metrics.counter("requests_total").inc()
+    assert client2.metrics.counter("requests_total").value() == 0
+
+    # Removing the gauge of one client keeps the other one
+    client1.metrics.remove("buffered")
+    assert [
+        value for (name, _), value in metrics.snapshot().items()
+        if name == "buffered"] == [2]
@@ -0,0 +1,221 @@
+import asyncio
+import os
+import pytest
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from aiokafka.consumer.offset_store import LocalOffsetStore
+from aiokafka.consumer.subscription_state import SubscriptionState
+from aiokafka.errors import GroupCoordinatorNotAvailableError
+from aiokafka.structs import TopicPartition, OffsetAndMetadata
+
+from ._testutil import run_until_complete
+
+
+class FakeCoordinator:
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._subscription = SubscriptionState(loop=loop)
+        self._commit_lock = asyncio.Lock(loop=loop)
+        self.commits = []
+        self.kafka_offsets = {}
+        self.error = None
+
+    @asyncio.coroutine
+    def _send_offset_commit_request(self, offsets):
+        if self.error is not None:
+            raise self.error
+        self.commits.append(offsets)
+
+    @asyncio.coroutine
+    def _do_fetch_commit_offsets(self, partitions):
+        return {
+            tp: self.kafka_offsets[tp]
+            for tp in partitions if tp in self.kafka_offsets}
+
+
+@pytest.mark.usefixtures('setup_test_class_serverless')
+class TestLocalOffsetStore(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "offsets")
+        self.tp0 = TopicPartition("topic", 0)
+        self.tp1 = TopicPartition("topic", 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        super().tearDown()
+
+    def open_store(self, **kw):
+        store = LocalOffsetStore(self.path, **kw)
+        store.start(FakeCoordinator(self.loop))
+        return store
+
+    @run_until_complete
+    def test_commit_and_fetch(self):
+        tp0, tp1 = self.tp0, self.tp1
+        store = self.open_store()
+        res = yield from store.fetch_offsets([tp0, tp1])
+        self.assertEqual(res, {})
+
+        yield from store.commit_offsets({
+            tp0: OffsetAndMetadata(10, ""),
+            tp1: OffsetAndMetadata(5, "meta")})
+        yield from store.commit_offsets({tp0: OffsetAndMetadata(12, "x")})
+        res = yield from store.fetch_offsets([tp0, tp1])
+        self.assertEqual(res, {
+            tp0: OffsetAndMetadata(12, "x"),
+            tp1: OffsetAndMetadata(5, "meta")})
+        yield from store.close()
+
+        # Offsets are loaded on next start
+        store = self.open_store()
+        res = yield from store.fetch_offsets([tp0, tp1])
+        self.assertEqual(res, {
+            tp0: OffsetAndMetadata(12, "x"),
+            tp1: OffsetAndMetadata(5, "meta")})
+        yield from store.close()
+
+    @run_until_complete
+    def test_compaction(self):
+        tp0, tp1 = self.tp0, self.tp1
+        store = self.open_store(initial_size=64)
+        self.assertEqual(os.path.getsize(self.path), 64)
+        for offset in range(1000):
+            yield from store.commit_offsets({
+                tp0: OffsetAndMetadata(offset, ""),
+                tp1: OffsetAndMetadata(offset * 2, "")})
+        # The file only needs space for the last offsets
+        self.assertEqual(os.path.getsize(self.path), 256)
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+        yield from store.close()
+
+        store = self.open_store(initial_size=64)
+        res = yield from store.fetch_offsets([tp0, tp1])
+        self.assertEqual(res, {
+            tp0: OffsetAndMetadata(999, ""),
+            tp1: OffsetAndMetadata(1998, "")})
+        yield from store.close()
+
+    @run_until_complete
+    def test_compaction_short_writes(self):
+        tp0, tp1 = self.tp0, self.tp1
+        store = self.open_store(initial_size=64)
+        real_write = os.write
+        with mock.patch(
+                "os.write",
+                side_effect=lambda fd, data: real_write(fd, data[:5])):
+            for i in range(20):
+                yield from store.commit_offsets({
+                    tp0: OffsetAndMetadata(i, "meta"),
+                    tp1: OffsetAndMetadata(i * 2, "")})
+        yield from store.close()
+
+        store = self.open_store()
+        res = yield from store.fetch_offsets([tp0, tp1])
+        self.assertEqual(res, {
+            tp0: OffsetAndMetadata(19, "meta"),
+            tp1: OffsetAndMetadata(38, "")})
+        yield from store.close()
+
+    @run_until_complete
+    def test_compaction_during_commit(self):
+        tp0, tp1 = self.tp0, self.tp1
+        store = self.open_store(initial_size=100)
+        yield from store.commit_offsets({
+            tp0: OffsetAndMetadata(1, ""),
+            tp1: OffsetAndMetadata(1, "")})
+        # Second entry of this commit does not fit and triggers compaction
+        yield from store.commit_offsets({
+            tp0: OffsetAndMetadata(100, ""),
+            tp1: OffsetAndMetadata(200, "")})
+        self.assertGreater(os.path.getsize(self.path), 100)
+        yield from store.close()
+
+        store = self.open_store()
+        res = yield from store.fetch_offsets([tp0, tp1])
+        self.assertEqual(res, {
+            tp0: OffsetAndMetadata(100, ""),
+            tp1: OffsetAndMetadata(200, "")})
+        yield from store.close()
+
+    @run_until_complete
+    def test_torn_entry(self):
+        tp0 = self.tp0
+        store = self.open_store()
+        yield from store.commit_offsets({tp0: OffsetAndMetadata(10, "")})
+        yield from store.commit_offsets({tp0: OffsetAndMetadata(11, "")})
+        pos = store._write_pos
+        yield from store.close()
+
+        # Corrupt the payload of the last entry
+        with open(self.path, "r+b") as f:
+            f.seek(pos - 1)
+            f.write(b"\xff")
+
+        store = self.open_store()
+        res = yield from store.fetch_offsets([tp0])
+        self.assertEqual(res, {tp0: OffsetAndMetadata(10, "")})
+        yield from store.commit_offsets({tp0: OffsetAndMetadata(12, "")})
+        yield from store.close()
+
+        store = self.open_store()
+        res = yield from store.fetch_offsets([tp0])
+        self.assertEqual(res, {tp0: OffsetAndMetadata(12, "")})
+        yield from store.close()
+
+    @run_until_complete
+    def test_invalid_file(self):
+        with open(self.path, "wb") as f:
+            f.write(b"some other data")
+        with self.assertRaises(ValueError):
+            self.open_store()
+        with self.assertRaises(ValueError):
+            LocalOffsetStore(self.path, initial_size=10)
+
+    @run_until_complete
+    def test_kafka_flush(self):
+        tp0, tp1 = self.tp0, self.tp1
+        store = self.open_store(kafka_flush_interval_ms=10)
+        coordinator = store._coordinator
+        coordinator._subscription.assign_from_user({tp0})
+
+        yield from store.commit_offsets({
+            tp0: OffsetAndMetadata(10, ""),
+            tp1: OffsetAndMetadata(5, "")})
+        yield from asyncio.sleep(0.05, loop=self.loop)
+        # Only assigned partitions are flushed and only once
+        self.assertEqual(
+            coordinator.commits, [{tp0: OffsetAndMetadata(10, "")}])
+
+        # Errors are retried on next flush
+        coordinator.error = GroupCoordinatorNotAvailableError()
+        yield from store.commit_offsets({tp0: OffsetAndMetadata(11, "")})
+        yield from asyncio.sleep(0.05, loop=self.loop)
+        self.assertEqual(len(coordinator.commits), 1)
+        coordinator.error = None
+
+        # Flush waits for the commit lock
+        yield from store.commit_offsets({tp0: OffsetAndMetadata(12, "")})
+        with (yield from coordinator._commit_lock):
+            yield from asyncio.sleep(0.05, loop=self.loop)
+            self.assertEqual(len(coordinator.commits), 1)
+
+        # Partitions missing in the file are looked up in Kafka
+        tp2 = TopicPartition("topic", 2)
+        coordinator.kafka_offsets = {
+            tp0: OffsetAndMetadata(1, ""), tp2: OffsetAndMetadata(7, "")}
+        res = yield from store.fetch_offsets([tp0, tp2])
+        self.assertEqual(res, {
+            tp0: OffsetAndMetadata(12, ""), tp2: OffsetAndMetadata(7, "")})
+
+        # Last offsets are flushed on close
+        yield from store.close()
+        self.assertEqual(coordinator.commits, [
+            {tp0: OffsetAndMetadata(10, "")},
+            {tp0: OffsetAndMetadata(12, "")}])
@@ -0,0 +1,276 @@
+import asyncio
+import pytest
+import unittest
+
+from aiokafka import ConsumerRebalanceListener
+from aiokafka.consumer.processor import ParallelProcessor, OffsetTracker
+from aiokafka.consumer.subscription_state import SubscriptionState
+from aiokafka.errors import IllegalOperation
+from aiokafka.structs import (
+    ConsumerRecord, TopicPartition, OffsetAndMetadata
+)
+from aiokafka.util import create_future, ensure_future
+
+from ._testutil import run_until_complete
+
+
+def make_records(tp, offsets, key=None):
+    return [ConsumerRecord(
+        topic=tp.topic, partition=tp.partition, offset=offset, timestamp=0,
+        timestamp_type=0, key=key, value=b"value", checksum=None,
+        serialized_key_size=0, serialized_value_size=5)
+        for offset in offsets]
+
+
+class FakeConsumer:
+
+    def __init__(self, loop, batches, enable_auto_commit=False):
+        self._loop = loop
+        self._group_id = "group"
+        self._enable_auto_commit = enable_auto_commit
+        self._batches = list(batches)
+        self._subscription = SubscriptionState(loop=loop)
+        self.commits = []
+
+    @asyncio.coroutine
+    def getmany(self, timeout_ms=0, max_records=None):
+        if self._batches:
+            return self._batches.pop(0)
+        yield from asyncio.sleep(timeout_ms / 1000, loop=self._loop)
+        return {}
+
+    @asyncio.coroutine
+    def commit(self, offsets):
+        self.commits.append(offsets)
+
+
+def test_offset_tracker():
+    tracker = OffsetTracker()
+    assert tracker.committable is None
+    for offset in [3, 4, 6, 7]:
+        tracker.add(offset)
+    tracker.done(4)
+    # Offset 4 is stored in metadata
+    assert tracker.committable == 3
+    tracker.done(3)
+    assert tracker.committable == 5
+    assert len(tracker) == 2
+    tracker.done(7)
+    assert tracker.committable == 6
+    tracker.done(6)
+    assert tracker.committable == 8
+    assert len(tracker) == 0
+
+
+def test_offset_tracker_encode():
+    tracker = OffsetTracker()
+    assert tracker.encode() == ""
+    for offset in range(10, 30):
+        tracker.add(offset)
+    for offset in [11, 12, 16, 20, 21, 22, 29]:
+        tracker.done(offset)
+    assert tracker.committable == 10
+    metadata = tracker.encode()
+    assert metadata == "rle:1,2,3,1,3,3,6,1"
+    assert OffsetTracker.decode(10, metadata) == [
+        (11, 13), (16, 17), (20, 23), (29, 30)]
+    # Ranges, that don't fit, are left out
+    assert tracker.encode(max_size=12) == "rle:1,2,3,1"
+    assert tracker.encode(max_size=5) == ""
+
+    tracker.done(10)
+    assert tracker.committable == 13
+    assert tracker.encode() == "rle:3,1,3,3,6,1"
+
+    assert OffsetTracker.decode(10, "") == []
+    assert OffsetTracker.decode(10, "some user metadata") == []
+    assert OffsetTracker.decode(10, "rle:1,x") == []
+    assert OffsetTracker.decode(10, "rle:1,2,3") == []
+    assert OffsetTracker.decode(10, "rle:1,-2") == []
+
+
+@pytest.mark.usefixtures('setup_test_class_serverless')
+class TestParallelProcessor(unittest.TestCase):
+
+    def test_config(self):
+        consumer = FakeConsumer(self.loop, [], enable_auto_commit=True)
+        with self.assertRaises(IllegalOperation):
+            ParallelProcessor(consumer, None)
+        consumer = FakeConsumer(self.loop, [])
+        with self.assertRaises(ValueError):
+            ParallelProcessor(consumer, None, ordering="value")
+        with self.assertRaises(ValueError):
+            ParallelProcessor(consumer, None, concurrency=0)
+
+    @run_until_complete
+    def test_partition_ordering(self):
+        tp0 = TopicPartition("topic", 0)
+        tp1 = TopicPartition("topic", 1)
+        consumer = FakeConsumer(self.loop, [
+            {tp0: make_records(tp0, range(0, 5)),
+             tp1: make_records(tp1, range(0, 5))},
+            {tp0: make_records(tp0, range(5, 10))},
+        ])
+        processed = {tp0: [], tp1: []}
+        running = {tp0: 0, tp1: 0}
+        max_running = {tp0: 0, tp1: 0}
+
+        @asyncio.coroutine
+        def handler(record):
+            tp = TopicPartition(record.topic, record.partition)
+            running[tp] += 1
+            max_running[tp] = max(max_running[tp], running[tp])
+            yield from asyncio.sleep(0.001 * (record.offset % 3),
+                                     loop=self.loop)
+            processed[tp].append(record.offset)
+            running[tp] -= 1
+            if len(processed[tp0]) == 10 and len(processed[tp1]) == 5:
+                processor.stop()
+
+        processor = ParallelProcessor(consumer, handler, concurrency=4)
+        yield from processor.run()
+        self.assertEqual(processed[tp0], list(range(10)))
+        self.assertEqual(processed[tp1], list(range(5)))
+        self.assertEqual(max_running, {tp0: 1, tp1: 1})
+        self.assertEqual(consumer.commits, [{tp0: (10, ""), tp1: (5, "")}])
+
+    @run_until_complete
+    def test_contiguous_commit(self):
+        tp0 = TopicPartition("topic", 0)
+        consumer = FakeConsumer(self.loop, [
+            {tp0: make_records(tp0, range(0, 6))}])
+        blocker = create_future(loop=self.loop)
+        processed = []
+
+        @asyncio.coroutine
+        def handler(record):
+            if record.offset == 2:
+                yield from blocker
+            processed.append(record.offset)
+
+        processor = ParallelProcessor(
+            consumer, handler, concurrency=10, ordering="none")
+        task = ensure_future(processor.run(), loop=self.loop)
+        yield from asyncio.sleep(0.05, loop=self.loop)
+        self.assertEqual(processed, [0, 1, 3, 4, 5])
+        yield from processor.commit()
+        self.assertEqual(consumer.commits, [{tp0: (2, "rle:1,3")}])
+
+        blocker.set_result(None)
+        yield from asyncio.sleep(0.01, loop=self.loop)
+        processor.stop()
+        yield from task
+        self.assertEqual(consumer.commits, [
+            {tp0: (2, "rle:1,3")}, {tp0: (6, "")}])
+
+    @run_until_complete
+    def test_revoke(self):
+        tp0 = TopicPartition("topic", 0)
+        consumer = FakeConsumer(self.loop, [
+            {tp0: make_records(tp0, range(0, 5))}])
+        started = []
+
+        @asyncio.coroutine
+        def handler(record):
+            started.append(record.offset)
+            if record.offset == 1:
+                yield from asyncio.sleep(1000, loop=self.loop)
+
+        class Listener(ConsumerRebalanceListener):
+            revoked = None
+
+            def on_partitions_revoked(self, revoked):
+                self.revoked = revoked
+
+            def on_partitions_assigned(self, assigned):
+                pass
+
+        user_listener = Listener()
+        processor = ParallelProcessor(
+            consumer, handler, cancel_on_revoke=True)
+        listener = processor.rebalance_listener(user_listener)
+        task = ensure_future(processor.run(), loop=self.loop)
+        yield from asyncio.sleep(0.05, loop=self.loop)
+        self.assertEqual(started, [0, 1])
+
+        # Record 1 is cancelled, other records are dropped
+        yield from listener.on_partitions_revoked({tp0})
+        self.assertEqual(user_listener.revoked, {tp0})
+        self.assertEqual(consumer.commits, [{tp0: (1, "")}])
+        yield from asyncio.sleep(0.05, loop=self.loop)
+        self.assertEqual(started, [0, 1])
+
+        processor.stop()
+        yield from task
+        self.assertEqual(consumer.commits, [{tp0: (1, "")}])
+
+    @run_until_complete
+    def test_handler_error(self):
+        tp0 = TopicPartition("topic", 0)
+        consumer = FakeConsumer(self.loop, [
+            {tp0: make_records(tp0, range(0, 5))}])
+
+        @asyncio.coroutine
+        def handler(record):
+            if record.offset == 3:
+                raise ValueError(record.offset)
+
+        processor = ParallelProcessor(consumer, handler)
+        with self.assertRaises(ValueError):
+            yield from processor.run()
+        self.assertEqual(consumer.commits, [{tp0: (3, "")}])
+
+    @run_until_complete
+    def test_key_ordering(self):
+        tp0 = TopicPartition("topic", 0)
+        records = []
+        for offset in range(12):
+            records.extend(make_records(
+                tp0, [offset], key=str(offset % 3).encode()))
+        consumer = FakeConsumer(self.loop, [{tp0: records}])
+        processed = {b"0": [], b"1": [], b"2": []}
+        running = set()
+        max_running = []
+
+        @asyncio.coroutine
+        def handler(record):
+            self.assertNotIn(record.key, running)
+            running.add(record.key)
+            max_running.append(len(running))
+            yield from asyncio.sleep(0.001, loop=self.loop)
+            running.discard(record.key)
+            processed[record.key].append(record.offset)
+            if sum(map(len, processed.values())) == 12:
+                processor.stop()
+
+        processor = ParallelProcessor(
+            consumer, handler, ordering="key", concurrency=10)
+        yield from processor.run()
+        self.assertEqual(processed, {
+            b"0": [0, 3, 6, 9], b"1": [1, 4, 7, 10], b"2": [2, 5, 8, 11]})
+        self.assertEqual(max(max_running), 3)
+        self.assertEqual(consumer.commits, [{tp0: (12, "")}])
+
+    @run_until_complete
+    def test_skip_processed_records(self):
+        tp0 = TopicPartition("topic", 0)
+        consumer = FakeConsumer(self.loop, [
+            {tp0: make_records(tp0, range(10, 20))}])
+        consumer._subscription.assign_from_user({tp0})
+        tp_state = consumer._subscription.subscription.assignment \
+            .state_value(tp0)
+        # Offsets 11, 12 and 16 were processed before rebalance
+        tp_state.reset_committed(OffsetAndMetadata(10, "rle:1,2,3,1"))
+        processed = []
+
+        @asyncio.coroutine
+        def handler(record):
+            processed.append(record.offset)
+            if len(processed) == 7:
+                processor.stop()
+
+        processor = ParallelProcessor(consumer, handler, ordering="none")
+        yield from processor.run()
+        self.assertEqual(
+            sorted(processed), [10, 13, 14, 15, 17, 18, 19])
+        self.assertEqual(consumer.commits, [{tp0: (20, "")}])
@@ -196,7 +196,7 @@ class TestKafkaProducerIntegration(KafkaIntegrationTestCase):
         yield from producer.start()
 
         @asyncio.coroutine
-        def mocked_send(nodeid, req):
+        def mocked_send(nodeid, req, **kw):
             raise KafkaTimeoutError()
 
         with mock.patch.object(producer.client, 'send') as mocked:
@@ -220,7 +220,7 @@ class TestKafkaProducerIntegration(KafkaIntegrationTestCase):
         yield from producer.start()
 
         @asyncio.coroutine
-        def mocked_send(nodeid, req):
+        def mocked_send(nodeid, req, **kw):
             # RequestTimedOutCode error for partition=0
             return ProduceResponse[0]([(self.topic, [(0, 7, 0), (1, 0, 111)])])
 
@@ -234,7 +234,7 @@ class TestKafkaProducerIntegration(KafkaIntegrationTestCase):
             self.assertEqual(resp.offset, 111)
 
         @asyncio.coroutine
-        def mocked_send_with_sleep(nodeid, req):
+        def mocked_send_with_sleep(nodeid, req, **kw):
             # RequestTimedOutCode error for partition=0
             yield from asyncio.sleep(0.1, loop=self.loop)
             return ProduceResponse[0]([(self.topic, [(0, 7, 0)])])
@@ -393,3 +393,29 @@ class TestKafkaProducerIntegration(KafkaIntegrationTestCase):
                 "XXXX", b'text1', partition=0)
             self.assertEqual(res.timestamp_type, LOG_APPEND_TIME)
             self.assertEqual(res.timestamp, expected_timestamp)
+
+    @kafka_versions('>=0.10.0')
+    @run_until_complete
+    def test_producer_throttle_time(self):
+        producer = AIOKafkaProducer(
+            loop=self.loop, bootstrap_servers=self.hosts, linger_ms=0)
+        yield from producer.start()
+        self.add_cleanup(producer.stop)
+        yield from producer.send_and_wait(self.topic, b'text1', partition=0)
+
+        @asyncio.coroutine
+        def mocked_send(*args, **kw):
+            return ProduceResponse[2](
+                topics=[(self.topic, [(0, 0, 0, -1)])],
+                throttle_time_ms=300)
+
+        with mock.patch.object(producer.client, 'send') as mocked:
+            mocked.side_effect = mocked_send
+            yield from producer.send_and_wait(
+                self.topic, b'text2', partition=0)
+            # Node is not sent to until throttle time passes
+            t0 = self.loop.time()
+            yield from producer.send_and_wait(
+                self.topic, b'text3', partition=0)
+            self.assertGreaterEqual(self.loop.time() - t0, 0.2)
+            self.assertEqual(mocked.call_count, 2)
@@ -151,6 +151,32 @@ def test_assigned_partitions(subscription_state):
     assert subscription_state.assigned_partitions() == assignment
 
 
+def test_incremental_assignment(subscription_state):
+    tp1 = TopicPartition("topic", 0)
+    tp2 = TopicPartition("topic", 1)
+    tp3 = TopicPartition("topic", 2)
+    subscription_state.subscribe(set(["topic"]))
+    subscription_state.assign_from_subscribed({tp1, tp2})
+    assignment = subscription_state.subscription.assignment
+    assignment.state_value(tp1).seek(10)
+
+    subscription_state.assign_from_subscribed({tp1, tp3}, keep_states=True)
+    new_assignment = subscription_state.subscription.assignment
+    assert not assignment.active
+    assert not subscription_state.reassignment_in_progress
+    assert new_assignment.tps == {tp1, tp3}
+    # Retained partitions keep their state
+    tp_state = new_assignment.state_value(tp1)
+    assert tp_state is assignment.state_value(tp1)
+    assert tp_state.position == 10
+    assert tp_state.assignment is new_assignment
+    assert not new_assignment.state_value(tp3).has_valid_position
+
+    subscription_state.assign_from_subscribed({tp1})
+    assert not subscription_state.subscription.assignment.state_value(
+        tp1).has_valid_position
+
+
 def test_is_assigned(subscription_state):
     tp1 = TopicPartition("topic", 0)
     tp2 = TopicPartition("topic", 1)
@@ -0,0 +1,30 @@
+from aiokafka.tracing import RollingLatencyTracer
+
+
+def test_rolling_latency_tracer():
+    tracer = RollingLatencyTracer(window=100)
+    assert tracer.percentile(0, 1, 0.5) is None
+
+    # Requests without response are only counted
+    tracer.on_request(0, 1, 2, 1, 50)
+    assert tracer.stats() == {(0, 1): {
+        "requests": 1, "request_bytes": 50, "response_bytes": 0,
+        "p50": None, "p99": None}}
+
+    for i in range(1, 201):
+        callback = tracer.on_request(0, 1, 2, i, 10)
+        callback(100, i / 1000)
+    tracer.on_request(1, 0, 2, 1, 10)(20, 5)
+
+    # Only last 100 responses are used for percentiles
+    assert tracer.percentile(0, 1, 0.5) == 0.15
+    assert tracer.percentile(0, 1, 0.99) == 0.199
+    assert tracer.percentile(0, 1, 1) == 0.2
+    assert tracer.percentile(0, 1, 0) == 0.101
+    stats = tracer.stats()
+    assert stats[(0, 1)] == {
+        "requests": 201, "request_bytes": 2050, "response_bytes": 20000,
+        "p50": 0.15, "p99": 0.199}
+    assert stats[(1, 0)] == {
+        "requests": 1, "request_bytes": 10, "response_bytes": 20,
+        "p50": 5, "p99": 5}
@@ -0,0 +1,129 @@
+import asyncio
+import pytest
+import time
+import unittest
+from unittest import mock
+
+from aiokafka.consumer import AIOKafkaConsumer
+from aiokafka.metrics import Metrics
+from aiokafka.producer import AIOKafkaProducer
+from aiokafka.watchdog import LoopWatchdog
+from ._testutil import run_until_complete, start_fake_broker
+
+
+@pytest.mark.usefixtures('setup_test_class_serverless')
+class TestLoopWatchdog(unittest.TestCase):
+
+    def _span_count(self, metrics, span):
+        for (name, tags), value in metrics.snapshot().items():
+            if name == "aiokafka_span_duration_seconds" and \
+                    ("span", span) in tags:
+                return value["count"]
+        return 0
+
+    @run_until_complete
+    def test_stall_attribution(self):
+        metrics = Metrics()
+        watchdog = LoopWatchdog(
+            loop=self.loop, threshold_ms=50, interval_ms=10, metrics=metrics)
+        watchdog.start()
+        watchdog.start()
+        try:
+            yield from asyncio.sleep(0.05, loop=self.loop)
+            with mock.patch("aiokafka.watchdog.log") as log:
+                with watchdog.span("compress", 10) as span:
+                    time.sleep(0.1)
+                span.size = 20
+                # Span warning is logged right away
+                self.assertEqual(log.warning.call_count, 1)
+                self.assertEqual(log.warning.call_args[0][1], "compress")
+                yield from asyncio.sleep(0.05, loop=self.loop)
+            self.assertEqual(log.warning.call_count, 2)
+            args = log.warning.call_args[0]
+            self.assertGreaterEqual(args[1], 0.05)
+            self.assertIn("compress", args[2])
+            self.assertIn("1 call(s) size 10", args[2])
+            self.assertGreaterEqual(watchdog.last_lag, 0)
+        finally:
+            watchdog.stop()
+
+        # Still used by one more user
+        self.assertIsNotNone(watchdog._task)
+        watchdog.stop()
+        self.assertIsNone(watchdog._task)
+        watchdog.stop()
+        self.assertEqual(watchdog._users, 0)
+
+        self.assertEqual(self._span_count(metrics, "compress"), 1)
+        stalls = [
+            value for (name, _), value in metrics.snapshot().items()
+            if name == "aiokafka_loop_stalls_total"]
+        self.assertEqual(stalls, [1])
+
+    @run_until_complete
+    def test_client_spans(self):
+        broker = yield from start_fake_broker(self, topics={"topic": 1})
+        metrics = Metrics()
+        watchdog = LoopWatchdog(loop=self.loop, metrics=metrics)
+
+        producer = AIOKafkaProducer(
+            loop=self.loop, bootstrap_servers=broker.bootstrap_servers,
+            compression_type="gzip", watchdog=watchdog)
+        yield from producer.start()
+        self.assertIsNotNone(watchdog._task)
+        try:
+            yield from producer.send_and_wait("topic", b"value", key=b"key")
+        finally:
+            yield from producer.stop()
+        self.assertIsNone(watchdog._task)
+        self.assertEqual(self._span_count(metrics, "serialize"), 1)
+        self.assertEqual(self._span_count(metrics, "compress"), 1)
+
+        consumer = AIOKafkaConsumer(
+            "topic", loop=self.loop, auto_offset_reset="earliest",
+            bootstrap_servers=broker.bootstrap_servers, watchdog=watchdog)
+        yield from consumer.start()
+        try:
+            msg = yield from consumer.getone()
+            self.assertEqual(msg.value, b"value")
+            self.assertEqual(msg.key, b"key")
+            self.assertEqual(msg.serialized_value_size, 5)
+        finally:
+            yield from consumer.stop()
+        self.assertEqual(self._span_count(metrics, "decompress"), 1)
+        self.assertEqual(self._span_count(metrics, "deserialize"), 1)
+
+    @run_until_complete
+    def test_chunked_unpack(self):
+        broker = yield from start_fake_broker(self, topics={"topic": 1})
+        metrics = Metrics()
+        watchdog = LoopWatchdog(loop=self.loop, metrics=metrics)
+
+        producer = AIOKafkaProducer(
+            loop=self.loop, bootstrap_servers=broker.bootstrap_servers,
+            compression_type="gzip", linger_ms=1000)
+        yield from producer.start()
+        try:
+            for i in range(5):
+                yield from producer.send("topic", str(i).encode())
+            yield from producer.flush()
+        finally:
+            yield from producer.stop()
+
+        consumer = AIOKafkaConsumer(
+            "topic", loop=self.loop, auto_offset_reset="earliest",
+            bootstrap_servers=broker.bootstrap_servers, watchdog=watchdog)
+        with mock.patch(
+                "aiokafka.consumer.fetcher.Fetcher._WATCHED_CHUNK_SIZE", 2):
+            yield from consumer.start()
+            try:
+                msgs = []
+                while len(msgs) < 5:
+                    msgs.append((yield from consumer.getone()))
+            finally:
+                yield from consumer.stop()
+        self.assertEqual(
+            [msg.value for msg in msgs], [b"0", b"1", b"2", b"3", b"4"])
+        # 5 records of one compressed batch are unpacked in chunks of 2, 2, 1
+        self.assertEqual(self._span_count(metrics, "decompress"), 3)
+        self.assertEqual(self._span_count(metrics, "deserialize"), 3)